@@ -17,6 +17,8 @@ CREATE TABLE IF NOT EXISTS municipios (
     localizacao GEOMETRY(Point, 4326)
 );
 CREATE INDEX idx_municipios_localizacao ON municipios USING GIST (localizacao);
+-- Índices (ordem, chave) da paginação por cursor das telas de consulta
+CREATE INDEX idx_municipios_nome_codigo ON municipios (nome, codigo_ibge);
 
 -- Tabela 3: cid10 (não depende de ninguém)
 CREATE TABLE IF NOT EXISTS cid10 (
@@ -36,6 +38,7 @@ CREATE TABLE IF NOT EXISTS hospitais (
 );
 CREATE INDEX idx_hospitais_especialidades ON hospitais USING GIN (especialidades);
 CREATE INDEX idx_hospitais_localizacao ON hospitais USING GIST (localizacao);
+CREATE INDEX idx_hospitais_nome_codigo ON hospitais (nome, codigo);
 
 -- Tabela 5: medicos (depende de municipios)
 CREATE TABLE IF NOT EXISTS medicos (
@@ -44,6 +47,7 @@ CREATE TABLE IF NOT EXISTS medicos (
     especialidade VARCHAR(100) NOT NULL,
     municipio_id BIGINT REFERENCES municipios(codigo_ibge)
 );
+CREATE INDEX idx_medicos_nome_codigo ON medicos (nome_completo, codigo);
 
 -- Tabela 6: pacientes (depende de municipios, cid10, hospitais)
 CREATE TABLE IF NOT EXISTS pacientes (
@@ -59,10 +63,15 @@ CREATE TABLE IF NOT EXISTS pacientes (
 );
 CREATE INDEX idx_pacientes_cpf ON pacientes(cpf);
 CREATE INDEX idx_pacientes_cod_municipio ON pacientes(cod_municipio);
+CREATE INDEX idx_pacientes_nome_codigo ON pacientes (nome_completo, codigo);
 
 -- Tabela 7: medico_hospital_associacao (depende de medicos e hospitais - DEVE SER UMA DAS ÚLTIMAS)
 CREATE TABLE IF NOT EXISTS medico_hospital_associacao (
     medico_id UUID NOT NULL REFERENCES medicos(codigo),
     hospital_id UUID NOT NULL REFERENCES hospitais(codigo),
     PRIMARY KEY (medico_id, hospital_id)
-);  
\ No newline at end of file
+);  
+
+-- Funções de alocação, pipeline_estado, visões do dashboard e triggers do serviço de alocação ficam em
+-- src/pipeline/sql/*.sql: rodam depois deste arquivo (ver docker-compose.yml) e são reaplicados pelo
+-- código Python que os usa (src/pipeline/ddl.py) em bancos já existentes.
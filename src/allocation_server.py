@@ -0,0 +1,8 @@
+import logging
+from pipeline import allocation_service
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+if __name__ == "__main__":
+    allocation_service.run()
@@ -1,5 +1,6 @@
 import os
-from db_utils import fetch_data, execute_query
+from db_utils import fetch_data, iter_data, execute_query, fetch_dashboard_snapshot, DashboardSnapshot, REPORT_STATEMENT_TIMEOUT_MS, EXPORT_MAX_ROWS
+from search import build_search
 
 import streamlit as st
 from streamlit_option_menu import option_menu
@@ -11,6 +12,8 @@ import pydeck as pdk # Biblioteca para mapas avançados
 import plotly.express as px
 from db_utils import fetch_data
 import subprocess
+import logging
+import tempfile
 
 import base64
 
@@ -104,49 +107,33 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- FUNÇÕES PARA BUSCAR DADOS DO DASHBOARD (COM CACHE E TRATAMENTO DE ERROS) ---
+# Os agregados vêm das visões materializadas mv_* (src/pipeline/dashboard_views.py), recalculadas
+# pelo pipeline ao fim de cada carga: o custo das consultas não cresce com a tabela de pacientes.
+
+# Uma única consulta (CTEs que devolvem JSON) traz todas as métricas do painel; o snapshot
+# em cache é compartilhado pelo dashboard e pelas funções de KPI abaixo.
+@st.cache_data(ttl=10)
+def get_dashboard_snapshot() -> DashboardSnapshot:
+    """Snapshot com todas as métricas do dashboard (uma ida ao banco a cada 10 s, no máximo)."""
+    return fetch_dashboard_snapshot()
 
-@st.cache_data(ttl=600)
 def get_kpi_data():
     """Busca os dados agregados para os KPIs de forma segura."""
-    total_pacientes_df = fetch_data("SELECT COUNT(codigo) FROM pacientes;")
-    medicos_ativos_df = fetch_data("SELECT COUNT(codigo) FROM medicos;")
-    hospitais_monitorados_df = fetch_data("SELECT COUNT(codigo) FROM hospitais;")
-
-    total_pacientes = total_pacientes_df.iloc[0, 0] if not total_pacientes_df.empty else 0
-    medicos_ativos = medicos_ativos_df.iloc[0, 0] if not medicos_ativos_df.empty else 0
-    hospitais_monitorados = hospitais_monitorados_df.iloc[0, 0] if not hospitais_monitorados_df.empty else 0
-    
+    snapshot = get_dashboard_snapshot()
     return {
-        "total_pacientes": total_pacientes,
-        "medicos_ativos": medicos_ativos,
-        "hospitais_monitorados": hospitais_monitorados
+        "total_pacientes": snapshot.total_pacientes,
+        "medicos_ativos": snapshot.total_medicos,
+        "hospitais_monitorados": snapshot.total_hospitais
     }
 
-@st.cache_data(ttl=600)
 def get_top_cid_data():
     """Busca os 8 principais diagnósticos (CID-10)."""
-    query = """
-    SELECT c.codigo || ' - ' || c.descricao AS cid_descricao, COUNT(p.codigo) AS total_pacientes
-    FROM pacientes AS p
-    INNER JOIN cid10 AS c ON p.cid_10 = c.codigo
-    GROUP BY c.codigo, c.descricao ORDER BY total_pacientes DESC LIMIT 8;
-    """
-    return fetch_data(query)
+    return get_dashboard_snapshot().top_cid_df.head(8)
 
 @st.cache_data(ttl=600)
 def get_hospital_data():
     """Busca dados detalhados dos hospitais de forma segura."""
-    query = """
-    WITH pacientes_por_hospital AS (
-        SELECT hospital_alocado_id, COUNT(codigo) as leitos_ocupados
-        FROM pacientes WHERE hospital_alocado_id IS NOT NULL GROUP BY hospital_alocado_id
-    )
-    SELECT h.nome, ST_Y(h.localizacao) AS lat, ST_X(h.localizacao) AS lon, h.leitos_totais,
-           COALESCE(p.leitos_ocupados, 0)::int AS leitos_ocupados
-    FROM hospitais h
-    LEFT JOIN pacientes_por_hospital p ON h.codigo = p.hospital_alocado_id;
-    """
-    df = fetch_data(query)
+    df = fetch_data("SELECT nome, lat, lon, leitos_totais, leitos_ocupados FROM mv_ocupacao_hospitais;")
     
     if not df.empty and 'leitos_totais' in df.columns and 'leitos_ocupados' in df.columns:
         df['leitos_totais'] = pd.to_numeric(df['leitos_totais'], errors='coerce').fillna(0)
@@ -156,52 +143,9 @@ def get_hospital_data():
         df = pd.DataFrame(columns=['nome', 'lat', 'lon', 'leitos_totais', 'leitos_ocupados', 'taxa_ocupacao'])
     return df
 
-@st.cache_data(ttl=600)
 def get_medico_alocacao_data():
     """Busca dados sobre a alocação de médicos."""
-    query = """
-    WITH contagem_por_medico AS (
-        SELECT medico_id, COUNT(hospital_id) AS num_hospitais
-        FROM medico_hospital_associacao GROUP BY medico_id
-    )
-    SELECT CASE WHEN num_hospitais = 1 THEN '1 Hospital' WHEN num_hospitais = 2 THEN '2 Hospitais' ELSE '3+ Hospitais' END AS num_hospitais,
-           COUNT(medico_id) AS total_medicos
-    FROM contagem_por_medico GROUP BY num_hospitais ORDER BY num_hospitais;
-    """
-    return fetch_data(query)
-
-# --- FUNÇÕES DE BUSCA DE DADOS (COM CORREÇÃO NOS KPIs) ---
-@st.cache_data(ttl=10) 
-def get_dashboard_data():
-    """Busca todos os dados agregados necessários para o dashboard de forma segura."""
-    def get_count(table_name):
-        df = fetch_data(f"SELECT COUNT(codigo) FROM {table_name};")
-        if df is not None and not df.empty:
-            return df.iloc[0, 0]
-        return 0
-
-    total_pacientes = get_count("pacientes")
-    total_medicos = get_count("medicos")
-    total_hospitais = get_count("hospitais")
-    
-    genero_df = fetch_data("SELECT genero, COUNT(codigo) AS total FROM pacientes GROUP BY genero;")
-    convenio_df = fetch_data("SELECT convenio, COUNT(codigo) AS total FROM pacientes GROUP BY convenio;")
-    top_cid_df = fetch_data("""
-        SELECT
-            c.codigo || ' - ' || c.descricao AS cid_completo,
-            COUNT(p.codigo) AS total_pacientes
-        FROM pacientes AS p
-        JOIN cid10 AS c ON p.cid_10 = c.codigo
-        GROUP BY c.codigo, c.descricao
-        ORDER BY total_pacientes DESC
-        LIMIT 10;
-    """)
-    
-    return {
-        "total_pacientes": total_pacientes, "total_medicos": total_medicos,
-        "total_hospitais": total_hospitais, "genero_df": genero_df,
-        "convenio_df": convenio_df, "top_cid_df": top_cid_df
-    }
+    return get_dashboard_snapshot().medicos_por_num_hospitais_df
 
 @st.cache_data(ttl=600)
 def get_hospital_geo_data():
@@ -209,6 +153,124 @@ def get_hospital_geo_data():
     query = "SELECT nome, ST_Y(localizacao) AS lat, ST_X(localizacao) AS lon, leitos_totais FROM hospitais WHERE localizacao IS NOT NULL;"
     return fetch_data(query)
 
+# --- PAGINAÇÃO POR CURSOR (KEYSET) ---
+# As tabelas são lidas uma página por vez: a próxima página começa depois da última linha da atual
+# (WHERE (ordem, chave) > (...)), sem OFFSET, então o custo de cada página não depende de quantas vieram antes.
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+@st.cache_data(ttl=600)
+def get_estimated_rows(table_name: str):
+    """Total aproximado de linhas (pg_class.reltuples, atualizado pelo ANALYZE); None se desconhecido."""
+    df = fetch_data("SELECT reltuples::bigint AS total FROM pg_class WHERE oid = to_regclass(:tabela);", {"tabela": table_name})
+    if df.empty or pd.isna(df.iloc[0, 0]) or df.iloc[0, 0] < 0:
+        return None
+    return int(df.iloc[0, 0])
+
+@st.cache_data(ttl=600)
+def has_pg_trgm():
+    """Se a extensão pg_trgm existe no banco (criada por src/pipeline/sql/busca.sql a cada carga)."""
+    df = fetch_data("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS instalada;")
+    return not df.empty and bool(df.iloc[0, 0])
+
+def fetch_keyset_page(select_clause, from_clause, order_columns, where_clauses, params, cursor, limit, timeout_ms=None):
+    """
+    Uma página ordenada por `order_columns` (a última deve tornar a ordem única, ex.: a chave
+    primária), começando depois de `cursor` (valores dessas colunas na última linha da página
+    anterior). As colunas de ordenação voltam como _ordem_0, _ordem_1, ... para formar o próximo cursor.
+    `timeout_ms` substitui o statement_timeout padrão só nesta consulta.
+    """
+    conditions = list(where_clauses)
+    params = dict(params)
+    if cursor is not None:
+        placeholders = ", ".join(f":cursor_{i}" for i in range(len(order_columns)))
+        conditions.append(f"({', '.join(order_columns)}) > ({placeholders})")
+        params.update({f"cursor_{i}": value for i, value in enumerate(cursor)})
+    order_keys = ", ".join(f"{col} AS _ordem_{i}" for i, col in enumerate(order_columns))
+    query = f"SELECT {select_clause}, {order_keys} FROM {from_clause}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f" ORDER BY {', '.join(order_columns)} LIMIT :limite;"
+    params["limite"] = limit
+    return fetch_data(query, params, timeout_ms=timeout_ms)
+
+def display_keyset_table(key, select_clause, from_clause, order_columns, where_clauses=(), params=None,
+                         estimated_total=None, empty_message="Nenhum registro encontrado.", timeout_ms=None):
+    """Renderiza uma tabela paginada por cursor, com seletor de tamanho de página e navegação."""
+    params = params or {}
+    page_size = st.selectbox("Registros por página", PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    # Os cursores das páginas visitadas ficam na sessão; mudar o filtro ou o tamanho volta à primeira página
+    filtro = (tuple(where_clauses), tuple(sorted(params.items())), page_size)
+    if st.session_state.get(f"{key}_filtro") != filtro:
+        st.session_state[f"{key}_filtro"] = filtro
+        st.session_state[f"{key}_cursores"] = [None]
+    cursores = st.session_state[f"{key}_cursores"]
+
+    # Uma linha a mais indica se existe próxima página
+    df = fetch_keyset_page(select_clause, from_clause, order_columns, where_clauses, params, cursores[-1], page_size + 1,
+                           timeout_ms=timeout_ms)
+    has_next = len(df) > page_size
+    df = df.iloc[:page_size]
+    order_keys = [f"_ordem_{i}" for i in range(len(order_columns))]
+
+    if df.empty:
+        st.info(empty_message)
+    else:
+        st.dataframe(df.drop(columns=order_keys, errors="ignore"), use_container_width=True, hide_index=True)
+
+    # Valores nativos do Python (numpy.int64 não é aceito como parâmetro pelo psycopg2)
+    next_cursor = None
+    if has_next:
+        next_cursor = tuple(v.item() if hasattr(v, "item") else v for v in df.iloc[-1][order_keys])
+
+    nav = st.columns([1, 1, 4])
+    nav[0].button("◀ Anterior", key=f"{key}_anterior", disabled=len(cursores) == 1,
+                  on_click=lambda: cursores.pop())
+    nav[1].button("Próxima ▶", key=f"{key}_proxima", disabled=not has_next,
+                  on_click=lambda: cursores.append(next_cursor))
+    pagina = f"Página {len(cursores)}"
+    if estimated_total is not None and not where_clauses:
+        pagina += f" de ~{max(1, -(-estimated_total // page_size)):,} (~{estimated_total:,} registros)".replace(",", ".")
+    nav[2].caption(pagina)
+
+def export_table_csv(key, select_clause, from_clause, order_columns, where_clauses=(), params=None, file_name="dados.csv"):
+    """
+    Exporta o resultado filtrado (todas as páginas) em CSV, até EXPORT_MAX_ROWS linhas. As linhas vêm
+    em lotes de um cursor do lado do servidor (iter_data) e são escritas num arquivo temporário, sem
+    montar um DataFrame com o resultado todo. O CSV pronto, porém, é lido inteiro para o
+    st.download_button e fica na memória da sessão: por isso o limite de linhas.
+    Se a consulta falhar no meio (timeout, conexão perdida), nenhum arquivo é oferecido.
+    """
+    if not st.button("Exportar CSV", key=f"{key}_exportar"):
+        return
+    query = f"SELECT {select_clause} FROM {from_clause}"
+    if where_clauses:
+        query += f" WHERE {' AND '.join(where_clauses)}"
+    # Uma linha a mais indica que o resultado passa do limite
+    query += f" ORDER BY {', '.join(order_columns)} LIMIT :limite_exportacao;"
+    params = {**(params or {}), "limite_exportacao": EXPORT_MAX_ROWS + 1}
+
+    with st.spinner("Gerando arquivo..."), tempfile.TemporaryFile() as arquivo:
+        linhas = 0
+        try:
+            for chunk in iter_data(query, params, timeout_ms=REPORT_STATEMENT_TIMEOUT_MS):
+                chunk.to_csv(arquivo, header=linhas == 0, index=False, encoding="utf-8")
+                linhas += len(chunk)
+        except Exception as e:
+            logging.error(f"Exportação de '{from_clause}' interrompida após {linhas} linhas: {e}")
+            st.error(f"A exportação falhou e nenhum arquivo foi gerado: {e}")
+            return
+        if linhas > EXPORT_MAX_ROWS:
+            st.warning(f"O resultado passa de {EXPORT_MAX_ROWS:,} registros. Refine a busca para exportar.".replace(",", "."))
+            return
+        if not linhas:
+            st.info("Nenhum registro para exportar.")
+            return
+        arquivo.seek(0)
+        st.download_button(f"Baixar {linhas:,} registros".replace(",", "."), data=arquivo.read(),
+                           file_name=file_name, mime="text/csv", key=f"{key}_baixar")
+
 # --- FUNÇÕES DAS PÁGINAS ---
 
 def page_dashboard():
@@ -219,7 +281,7 @@ def page_dashboard():
     st.markdown("Análise de indicadores operacionais e de capacidade da rede de saúde.")
 
     # Chama as funções de busca que estão FORA desta função
-    dashboard_data = get_dashboard_data()
+    snapshot = get_dashboard_snapshot()
     df_hospitais = get_hospital_geo_data()
 
     tab_geral, tab_geo, tab_recursos = st.tabs([" Visão Geral ", " Análise Geográfica ", " Capacidade da Rede "])
@@ -229,12 +291,12 @@ def page_dashboard():
         st.header("Indicadores Chave de Performance (KPIs)")
         kpi_cols = st.columns(4)
         
-        kpi_cols[0].metric("Total de Pacientes", f"{dashboard_data.get('total_pacientes', 0):,}".replace(",", "."))
-        kpi_cols[1].metric("Médicos Ativos", f"{dashboard_data.get('total_medicos', 0):,}".replace(",", "."))
-        kpi_cols[2].metric("Hospitais Monitorados", dashboard_data.get('total_hospitais', 0))
+        kpi_cols[0].metric("Total de Pacientes", f"{snapshot.total_pacientes:,}".replace(",", "."))
+        kpi_cols[1].metric("Médicos Ativos", f"{snapshot.total_medicos:,}".replace(",", "."))
+        kpi_cols[2].metric("Hospitais Monitorados", snapshot.total_hospitais)
         
-        convenio_data = dashboard_data.get('convenio_df', pd.DataFrame())
-        total_pacientes_kpi = dashboard_data.get('total_pacientes', 0)
+        convenio_data = snapshot.convenio_df
+        total_pacientes_kpi = snapshot.total_pacientes
         if not convenio_data.empty and total_pacientes_kpi > 0:
             total_com_convenio = convenio_data.loc[convenio_data['convenio'] == True, 'total'].sum()
             percent_convenio = total_com_convenio / total_pacientes_kpi
@@ -247,10 +309,10 @@ def page_dashboard():
 
         with chart_cols[0]:
             st.subheader("Top 10 Diagnósticos (CID-10)")
-            df_cid = dashboard_data.get('top_cid_df', pd.DataFrame())
+            df_cid = snapshot.top_cid_df
             if not df_cid.empty:
-                fig = px.bar(df_cid, y='cid_completo', x='total_pacientes', orientation='h', 
-                             labels={'cid_completo': 'Diagnóstico (CID-10)', 'total_pacientes': 'Nº de Pacientes'}, text_auto=True, title="Diagnósticos Mais Frequentes")
+                fig = px.bar(df_cid, y='cid_descricao', x='total_pacientes', orientation='h', 
+                             labels={'cid_descricao': 'Diagnóstico (CID-10)', 'total_pacientes': 'Nº de Pacientes'}, text_auto=True, title="Diagnósticos Mais Frequentes")
                 fig.update_layout(yaxis={'categoryorder':'total ascending'})
                 st.plotly_chart(fig, use_container_width=True)
             else:
@@ -258,7 +320,7 @@ def page_dashboard():
             
         with chart_cols[1]:
             st.subheader("Perfil dos Pacientes")
-            genero_df = dashboard_data.get('genero_df', pd.DataFrame())
+            genero_df = snapshot.genero_df.copy()
             if not genero_df.empty:
                 genero_df['genero'] = genero_df['genero'].map({'M': 'Masculino', 'F': 'Feminino'}).fillna('Não especificado')
                 fig_genero = px.pie(genero_df, names='genero', values='total', title='Distribuição por Gênero', hole=0.4)
@@ -370,6 +432,8 @@ def page_upload():
                 )
 
                 st.success("**Pipeline de ETL concluído com sucesso!**")
+                # O pipeline acabou de recalcular as visões do dashboard: descarta os agregados em cache
+                st.cache_data.clear()
                 with st.expander("Ver Relatório de Processamento (Logs do Pipeline)"):
                     st.code(result.stdout, language='log')
 
@@ -402,35 +466,27 @@ def page_alocacao():
         st.markdown("A tabela abaixo mostra todos os médicos alocados, com detalhes sobre onde moram e onde trabalham.")
 
         with st.spinner("Carregando relatório de alocação de médicos..."):
-            # --- CONSULTA ATUALIZADA ---
-            query_medicos = """
-                SELECT
+            # --- CONSULTA ATUALIZADA (PAGINADA) ---
+            display_keyset_table(
+                key="alloc_med",
+                select_clause="""
                     m.nome_completo AS medico,
                     m.especialidade AS especialidade_medico,
                     mun_medico.nome AS municipio_medico,
                     h.nome AS hospital,
                     h.especialidades AS especialidades_hospital,
-                    mun_hospital.nome AS municipio_hospital
-                FROM
+                    mun_hospital.nome AS municipio_hospital""",
+                from_clause="""
                     medico_hospital_associacao AS mha
-                JOIN
-                    medicos AS m ON mha.medico_id = m.codigo
-                JOIN
-                    hospitais AS h ON mha.hospital_id = h.codigo
-                JOIN
-                    municipios AS mun_hospital ON h.municipio_id = mun_hospital.codigo_ibge
-                JOIN
-                    municipios AS mun_medico ON m.municipio_id = mun_medico.codigo_ibge
-                ORDER BY
-                    m.nome_completo, h.nome;
-            """
-            
-            medicos_alloc_df = fetch_data(query_medicos)
-
-            if not medicos_alloc_df.empty:
-                st.dataframe(medicos_alloc_df, use_container_width=True, hide_index=True)
-            else:
-                st.info("O processo de alocação automática ainda não associou médicos a hospitais.")
+                    JOIN medicos AS m ON mha.medico_id = m.codigo
+                    JOIN hospitais AS h ON mha.hospital_id = h.codigo
+                    JOIN municipios AS mun_hospital ON h.municipio_id = mun_hospital.codigo_ibge
+                    JOIN municipios AS mun_medico ON m.municipio_id = mun_medico.codigo_ibge""",
+                order_columns=["m.nome_completo", "h.nome", "mha.medico_id", "mha.hospital_id"],
+                estimated_total=get_estimated_rows("medico_hospital_associacao"),
+                empty_message="O processo de alocação automática ainda não associou médicos a hospitais.",
+                timeout_ms=REPORT_STATEMENT_TIMEOUT_MS
+            )
 
     # --- ABA: RELATÓRIO DE ALOCAÇÕES DE PACIENTES (SEM ALTERAÇÃO) ---
     with tab_pacientes:
@@ -438,31 +494,25 @@ def page_alocacao():
         st.markdown("A tabela abaixo mostra todos os pacientes que foram alocados a um hospital pelo sistema.")
 
         with st.spinner("Carregando relatório de alocação de pacientes..."):
-            query_pacientes = """
-                SELECT
+            # Total de alocados vem da visão de ocupação (exato na última carga), sem contar a tabela
+            ocupacao_df = get_hospital_data()
+            display_keyset_table(
+                key="alloc_pac",
+                select_clause="""
                     p.nome_completo AS paciente,
                     p.cpf,
                     p.cid_10,
                     h.nome AS hospital_alocado,
-                    mun.nome AS municipio_hospital
-                FROM
+                    mun.nome AS municipio_hospital""",
+                from_clause="""
                     pacientes AS p
-                JOIN
-                    hospitais AS h ON p.hospital_alocado_id = h.codigo
-                JOIN
-                    municipios AS mun ON h.municipio_id = mun.codigo_ibge
-                WHERE
-                    p.hospital_alocado_id IS NOT NULL
-                ORDER BY
-                    p.nome_completo;
-            """
-            
-            pacientes_alloc_df = fetch_data(query_pacientes)
-
-            if not pacientes_alloc_df.empty:
-                st.dataframe(pacientes_alloc_df, use_container_width=True, hide_index=True)
-            else:
-                st.info("O processo de alocação automática ainda não associou pacientes a hospitais.")
+                    JOIN hospitais AS h ON p.hospital_alocado_id = h.codigo
+                    JOIN municipios AS mun ON h.municipio_id = mun.codigo_ibge""",
+                order_columns=["p.nome_completo", "p.codigo"],
+                estimated_total=int(ocupacao_df['leitos_ocupados'].sum()) if not ocupacao_df.empty else None,
+                empty_message="O processo de alocação automática ainda não associou pacientes a hospitais.",
+                timeout_ms=REPORT_STATEMENT_TIMEOUT_MS
+            )
 
 def page_entidades():
     """
@@ -471,9 +521,9 @@ def page_entidades():
     """
 
     # --- Função Auxiliar Genérica ---
-    def display_table_data(title, table_name, select_clause, search_columns, search_label, order_by_column, key):
+    def display_table_data(title, table_name, select_clause, search_columns, search_label, order_by_column, key_column, key):
         """
-        Renderiza uma subseção completa para exibir dados de uma tabela.
+        Renderiza uma subseção completa para exibir dados de uma tabela, uma página por vez.
         
         Args:
             title (str): O título da subseção (ex: "Hospitais Cadastrados").
@@ -482,33 +532,36 @@ def page_entidades():
             search_columns (list): Lista de colunas para usar no filtro de busca (ex: ["nome", "cpf"]).
             search_label (str): O rótulo para a caixa de busca.
             order_by_column (str): A coluna para ordenar os resultados.
+            key_column (str): A chave primária, que desempata a ordenação no cursor da paginação.
             key (str): Uma chave única para o widget st.text_input.
         """
         st.subheader(title)
         search_term = st.text_input(search_label, key=key)
 
         with st.spinner(f"Carregando dados de {table_name}..."):
-            # Constrói a consulta base
-            query = f"SELECT {select_clause} FROM {table_name}"
-
-            # Adiciona o filtro de busca se um termo for inserido
-            if search_term:
-                # Cria uma condição ILIKE para cada coluna de busca
-                conditions = [f"{col} ILIKE '%{search_term.replace('%', '%%')}%'" for col in search_columns]
-                # Junta as condições com OR
-                query += f" WHERE {' OR '.join(conditions)}"
-            
-            # Adiciona a ordenação
-            query += f" ORDER BY {order_by_column};"
-
-            # Busca os dados
-            df = fetch_data(query)
-
-            # Exibe o resultado
-            if not df.empty:
-                st.dataframe(df, use_container_width=True, hide_index=True)
-            else:
-                st.info(f"Nenhum registro encontrado em '{table_name}' com o filtro atual.")
+            # Busca indexada (trigramas / prefixo de CPF); com termo, os resultados vêm por relevância
+            # Sem pg_trgm (banco criado antes de busca.sql e ainda sem carga), cai para ILIKE sem índice
+            where_clauses, params, search_order = build_search(search_term, search_columns, key_column, has_pg_trgm())
+
+            display_keyset_table(
+                key=f"{key}_tabela",
+                select_clause=select_clause,
+                from_clause=table_name,
+                order_columns=search_order or [order_by_column, key_column],
+                where_clauses=where_clauses,
+                params=params,
+                estimated_total=get_estimated_rows(table_name),
+                empty_message=f"Nenhum registro encontrado em '{table_name}' com o filtro atual."
+            )
+            export_table_csv(
+                key=f"{key}_tabela",
+                select_clause=select_clause,
+                from_clause=table_name,
+                order_columns=search_order or [order_by_column, key_column],
+                where_clauses=where_clauses,
+                params=params,
+                file_name=f"{table_name}.csv"
+            )
 
     # --- Layout Principal da Página ---
     st.title("Consulta de Entidades Cadastradas")
@@ -526,6 +579,7 @@ def page_entidades():
             search_columns=["nome"],
             search_label="Buscar Hospital por Nome",
             order_by_column="nome",
+            key_column="codigo",
             key="search_hosp"
         )
 
@@ -538,6 +592,7 @@ def page_entidades():
             search_columns=["nome_completo", "especialidade"],
             search_label="Buscar Médico por Nome ou Especialidade",
             order_by_column="nome_completo",
+            key_column="codigo",
             key="search_med"
         )
 
@@ -551,6 +606,7 @@ def page_entidades():
             search_columns=["nome_completo", "cpf"],
             search_label="Buscar Paciente por Nome ou CPF",
             order_by_column="nome_completo",
+            key_column="codigo",
             key="search_pac"
         )
 
@@ -563,6 +619,7 @@ def page_entidades():
             search_columns=["nome", "uf"],
             search_label="Buscar Estado por Nome ou Sigla",
             order_by_column="nome",
+            key_column="codigo_uf",
             key="search_est"
         )
 
@@ -575,6 +632,7 @@ def page_entidades():
             search_columns=["nome"],
             search_label="Buscar Município por Nome",
             order_by_column="nome",
+            key_column="codigo_ibge",
             key="search_mun"
         )
 
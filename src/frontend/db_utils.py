@@ -1,16 +1,46 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 import logging
+import time
 import toml # Importe a nova biblioteca
 import os   # Importe a biblioteca 'os' para manipulação de caminhos
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
 
 logging.basicConfig(level=logging.INFO)
 
-@st.cache_resource(ttl="10m")
+# --- Configuração do pool e dos limites (variáveis de ambiente do serviço dashboard) ---
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        logging.warning(f"{name} inválido. Usando {default}.")
+        return default
+
+# Conexões mantidas abertas e extras permitidas em picos (as threads do Streamlit compartilham o pool)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+# Espera máxima (s) por uma conexão livre antes de falhar, em vez de travar a página
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 10)
+# Conexões mais antigas que isso (s) são recicladas
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+# Tempo máximo de cada consulta no servidor (ms); 0 desativa
+DB_STATEMENT_TIMEOUT_MS = _env_int("DB_STATEMENT_TIMEOUT_MS", 15000)
+# Limite (ms) dos relatórios de alocação e das exportações, que leem e ordenam muitas linhas; 0 desativa
+REPORT_STATEMENT_TIMEOUT_MS = _env_int("REPORT_STATEMENT_TIMEOUT_MS", 60000)
+# Consultas acima deste tempo (ms) são registradas como lentas
+SLOW_QUERY_MS = _env_int("SLOW_QUERY_MS", 500)
+# Linhas por lote nos cursores do lado do servidor (iter_data)
+STREAM_CHUNK_SIZE = _env_int("DB_STREAM_CHUNK_SIZE", 10000)
+# Máximo de linhas numa exportação CSV (o arquivo pronto é entregue ao navegador a partir da memória)
+EXPORT_MAX_ROWS = _env_int("EXPORT_MAX_ROWS", 200000)
+
+@st.cache_resource
 def get_connection():
     """
-    Cria e retorna uma conexão com o banco de dados PostgreSQL.
+    Cria e retorna o engine (pool de conexões) do PostgreSQL, compartilhado por todas as sessões.
     Lê as credenciais de um arquivo secrets.toml localizado na mesma pasta.
     """
     try:
@@ -19,23 +49,36 @@ def get_connection():
         # --- LÓGICA MODIFICADA PARA ENCONTRAR O ARQUIVO ---
         # Pega o caminho absoluto do diretório onde este arquivo (db_utils.py) está
         current_dir = os.path.dirname(os.path.abspath(__file__))
-        
+
         # Constrói o caminho para o arquivo secrets.toml
         secrets_path = os.path.join(current_dir, ".streamlit", "secrets.toml")
-        
+
         # Lê e analisa (parse) o arquivo .toml
         secrets = toml.load(secrets_path)
         creds = secrets["connections"]["postgresql"]
         # --- FIM DA LÓGICA MODIFICADA ---
-        
+
         # O resto do código permanece o mesmo
         db_url = (
             f"{creds['dialect']}+{creds['driver']}://"
             f"{creds['username']}:{creds['password']}@"
             f"{creds['host']}:{creds['port']}/{creds['database']}"
         )
-        
-        engine = create_engine(db_url)
+
+        # pre_ping descarta conexões mortas (banco reiniciado) antes de entregá-las;
+        # o statement_timeout vale para toda conexão do pool
+        engine = create_engine(
+            db_url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args={
+                "application_name": "aps-dashboard",
+                "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+            },
+        )
         logging.info("Conexão com o banco de dados estabelecida com sucesso.")
         return engine
     except FileNotFoundError:
@@ -48,17 +91,33 @@ def get_connection():
         st.error(f"Erro ao conectar ao banco de dados. Verifique o arquivo secrets.toml.")
         return None
 
-def fetch_data(query: str) -> pd.DataFrame:
+def _log_timing(query: str, inicio: float, linhas: int):
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    resumo = " ".join(query.split())[:100]
+    if duracao_ms >= SLOW_QUERY_MS:
+        logging.warning(f"Consulta lenta ({duracao_ms:.0f} ms, {linhas} linhas): {resumo}...")
+    else:
+        logging.info(f"Consulta executada em {duracao_ms:.0f} ms ({linhas} linhas): {resumo}...")
+
+def _apply_timeout(connection, timeout_ms):
+    """statement_timeout só para a transação atual (sobrepõe o padrão do pool)."""
+    if timeout_ms is not None:
+        connection.execute(text("SELECT set_config('statement_timeout', :valor, true)"), {"valor": str(int(timeout_ms))})
+
+def fetch_data(query: str, params: dict = None, timeout_ms: int = None) -> pd.DataFrame:
     """
     Executa uma consulta SQL e retorna um DataFrame.
+    Parâmetros nomeados (:nome) vão em `params`, separados do SQL.
+    `timeout_ms` substitui o statement_timeout padrão só nesta consulta.
     """
     engine = get_connection()
     if engine:
         try:
-            logging.info(f"Executando a consulta: {query[:100]}...")
+            inicio = time.perf_counter()
             with engine.connect() as connection:
-                df = pd.read_sql(query, connection)
-            logging.info("Consulta executada com sucesso.")
+                _apply_timeout(connection, timeout_ms)
+                df = pd.read_sql(text(query), connection, params=params)
+            _log_timing(query, inicio, len(df))
             return df
         except Exception as e:
             logging.error(f"Erro ao executar a consulta: {e}")
@@ -67,20 +126,121 @@ def fetch_data(query: str) -> pd.DataFrame:
     else:
         return pd.DataFrame()
 
-def execute_query(query: str, params: dict = None):
+def iter_data(query: str, params: dict = None, chunksize: int = STREAM_CHUNK_SIZE, timeout_ms: int = None) -> Iterator[pd.DataFrame]:
+    """
+    Percorre um resultado grande em DataFrames de até `chunksize` linhas, por um cursor do lado
+    do servidor: cada lote é entregue assim que lido, sem juntar o resultado inteiro na memória.
+    Usado pelas exportações das tabelas de entidades (app.export_table_csv); a conexão volta ao pool no fim.
 
+    Ao contrário de fetch_data, erros não são engolidos: um timeout ou uma conexão perdida no meio
+    do resultado sobe para quem consome o gerador, que já pode ter recebido parte dos lotes.
+    """
+    engine = get_connection()
+    if not engine:
+        raise RuntimeError("Sem conexão com o banco de dados.")
+    inicio = time.perf_counter()
+    linhas = 0
+    with engine.connect() as connection:
+        _apply_timeout(connection, timeout_ms)
+        connection = connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(text(query), connection, params=params, chunksize=chunksize):
+            linhas += len(chunk)
+            yield chunk
+    _log_timing(query, inicio, linhas)
+
+def execute_query(query: str, params: dict = None):
+    """Executa uma consulta de modificação numa transação, com parâmetros nomeados (:nome)."""
     engine = get_connection()
     if engine:
         try:
-            with engine.connect() as connection:
-                trans = connection.begin() # Inicia uma transação
-                connection.execute(query, params)
-                trans.commit() # Confirma a transação
+            inicio = time.perf_counter()
+            with engine.begin() as connection: # Commit ao sair do bloco; rollback automático em caso de erro
+                result = connection.execute(text(query), params or {})
+            _log_timing(query, inicio, max(result.rowcount, 0))
             logging.info("Consulta de modificação executada com sucesso.")
             return True
         except Exception as e:
             logging.error(f"Erro ao executar a consulta de modificação: {e}")
             st.error(f"Erro na operação com o banco de dados: {e}")
-            # trans.rollback() # A transação é desfeita automaticamente ao sair do 'with' com erro
             return False
-    return False
\ No newline at end of file
+    return False
+
+# --- Snapshot do dashboard ---
+
+# Todas as métricas do painel numa única ida ao banco: cada CTE lê uma visão materializada
+# (src/pipeline/dashboard_views.py) e o resultado volta como um único objeto JSON.
+DASHBOARD_SNAPSHOT_SQL = """
+WITH totais AS (
+    SELECT total_pacientes, total_medicos, total_hospitais, atualizado_em FROM mv_dashboard_totais
+), genero AS (
+    SELECT COALESCE(json_agg(json_build_object('genero', genero, 'total', total) ORDER BY total DESC), '[]'::json) AS dados
+    FROM mv_pacientes_por_genero
+), convenio AS (
+    SELECT COALESCE(json_agg(json_build_object('convenio', convenio, 'total', total) ORDER BY total DESC), '[]'::json) AS dados
+    FROM mv_pacientes_por_convenio
+), top_cid AS (
+    SELECT COALESCE(json_agg(json_build_object('cid_descricao', cid_descricao, 'total_pacientes', total_pacientes)
+                             ORDER BY total_pacientes DESC, codigo), '[]'::json) AS dados
+    FROM (SELECT codigo, cid_descricao, total_pacientes FROM mv_pacientes_por_cid
+          ORDER BY total_pacientes DESC, codigo LIMIT :top_cid) c
+), medicos AS (
+    SELECT COALESCE(json_agg(json_build_object('num_hospitais', num_hospitais, 'total_medicos', total_medicos)
+                             ORDER BY num_hospitais), '[]'::json) AS dados
+    FROM mv_medicos_por_num_hospitais
+)
+SELECT json_build_object(
+    'totais', (SELECT row_to_json(totais) FROM totais),
+    'genero', (SELECT dados FROM genero),
+    'convenio', (SELECT dados FROM convenio),
+    'top_cid', (SELECT dados FROM top_cid),
+    'medicos_por_num_hospitais', (SELECT dados FROM medicos)
+) AS snapshot
+"""
+SNAPSHOT_TOP_CID = 10
+
+def _frame(registros, colunas: list) -> pd.DataFrame:
+    return pd.DataFrame(registros or [], columns=colunas)
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    """Métricas do painel lidas de uma só vez; compartilhado pelo dashboard e pelas funções de KPI."""
+    total_pacientes: int = 0
+    total_medicos: int = 0
+    total_hospitais: int = 0
+    # Momento do último refresh das visões (fim da última carga); None se o banco ainda não tem dados
+    atualizado_em: Optional[str] = None
+    genero_df: pd.DataFrame = field(default_factory=lambda: _frame(None, ["genero", "total"]))
+    convenio_df: pd.DataFrame = field(default_factory=lambda: _frame(None, ["convenio", "total"]))
+    top_cid_df: pd.DataFrame = field(default_factory=lambda: _frame(None, ["cid_descricao", "total_pacientes"]))
+    medicos_por_num_hospitais_df: pd.DataFrame = field(default_factory=lambda: _frame(None, ["num_hospitais", "total_medicos"]))
+
+    @classmethod
+    def from_json(cls, dados: dict) -> "DashboardSnapshot":
+        totais = dados.get("totais") or {}
+        return cls(
+            total_pacientes=int(totais.get("total_pacientes") or 0),
+            total_medicos=int(totais.get("total_medicos") or 0),
+            total_hospitais=int(totais.get("total_hospitais") or 0),
+            atualizado_em=totais.get("atualizado_em"),
+            genero_df=_frame(dados.get("genero"), ["genero", "total"]),
+            convenio_df=_frame(dados.get("convenio"), ["convenio", "total"]),
+            top_cid_df=_frame(dados.get("top_cid"), ["cid_descricao", "total_pacientes"]),
+            medicos_por_num_hospitais_df=_frame(dados.get("medicos_por_num_hospitais"), ["num_hospitais", "total_medicos"]),
+        )
+
+def fetch_dashboard_snapshot(top_cid: int = SNAPSHOT_TOP_CID) -> DashboardSnapshot:
+    """Lê todas as métricas do dashboard numa única consulta; snapshot vazio se o banco falhar."""
+    engine = get_connection()
+    if not engine:
+        return DashboardSnapshot()
+    try:
+        inicio = time.perf_counter()
+        with engine.connect() as connection:
+            dados = connection.execute(text(DASHBOARD_SNAPSHOT_SQL), {"top_cid": top_cid}).scalar_one()
+        _log_timing("snapshot do dashboard", inicio, 1)
+        # psycopg2 já converte json em dict
+        return DashboardSnapshot.from_json(dados or {})
+    except Exception as e:
+        logging.error(f"Erro ao buscar o snapshot do dashboard: {e}")
+        st.error(f"Erro ao buscar dados: {e}")
+        return DashboardSnapshot()
@@ -0,0 +1,53 @@
+# Busca de entidades do frontend: trigramas (pg_trgm) com ranking e atalho por prefixo de CPF.
+# A extensão, os índices GIN (gin_trgm_ops) e o de prefixo de CPF estão em src/pipeline/sql/busca.sql.
+
+import re
+
+# Termos mais curtos que um trigrama não usam o índice GIN: viram busca por prefixo
+MIN_TRIGRAM_LENGTH = 3
+CPF_COLUMN = "cpf"
+_CPF_SEPARADORES = re.compile(r"[.\-\s]")
+# Prefixo de CPF: 3 a 11 dígitos ASCII (str.isdigit aceitaria "²"); termos menores seguem a busca por texto
+_CPF_PREFIXO = re.compile(r"[0-9]{%d,11}" % MIN_TRIGRAM_LENGTH)
+
+def escape_like(term: str) -> str:
+    """Escapa os curingas do LIKE (%, _ e a barra de escape) para buscar o texto literal."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def build_search(term: str, search_columns: list, key_column: str, trigramas: bool = True):
+    """
+    Monta a busca de `term` nas colunas informadas, sempre com parâmetros nomeados.
+
+    Retorna (where_clauses, params, order_columns); order_columns é None quando a ordem
+    padrão da tabela deve ser mantida. Três caminhos:
+      - CPF: termo com 3 a 11 dígitos (pontos e traços ignorados) vira `cpf LIKE '123%'`,
+        servido pelo índice varchar_pattern_ops;
+      - termos curtos (< 3 caracteres): prefixo ILIKE nas colunas de texto;
+      - demais: `ILIKE '%termo%'` ou similaridade por palavra (`termo <% coluna`), ambos
+        servidos pelos índices de trigramas, com os resultados ordenados pela menor
+        distância (`termo <<-> coluna`, em float8) entre as colunas. Sem pg_trgm no banco
+        (`trigramas=False`), só o `ILIKE '%termo%'`, sem índice e na ordem padrão.
+    """
+    termo = (term or "").strip()
+    if not termo:
+        return [], {}, None
+
+    digitos = _CPF_SEPARADORES.sub("", termo)
+    if CPF_COLUMN in search_columns and _CPF_PREFIXO.fullmatch(digitos):
+        return [f"{CPF_COLUMN} LIKE :cpf_prefixo"], {"cpf_prefixo": f"{digitos}%"}, [CPF_COLUMN, key_column]
+
+    text_columns = [col for col in search_columns if col != CPF_COLUMN] or search_columns
+    if len(termo) < MIN_TRIGRAM_LENGTH:
+        conditions = " OR ".join(f"{col} ILIKE :prefixo" for col in text_columns)
+        return [f"({conditions})"], {"prefixo": f"{escape_like(termo)}%"}, None
+
+    if not trigramas:
+        conditions = " OR ".join(f"{col} ILIKE :padrao" for col in text_columns)
+        return [f"({conditions})"], {"padrao": f"%{escape_like(termo)}%"}, None
+
+    conditions = " OR ".join(f"{col} ILIKE :padrao OR :termo <% {col}" for col in text_columns)
+    distancias = [f":termo <<-> {col}" for col in text_columns]
+    distancia = distancias[0] if len(distancias) == 1 else f"LEAST({', '.join(distancias)})"
+    # <<-> devolve real (float4); em float8 o valor volta do Python idêntico e o cursor não repete empates
+    distancia = f"({distancia})::float8"
+    return [f"({conditions})"], {"termo": termo, "padrao": f"%{escape_like(termo)}%"}, [distancia, key_column]
@@ -3,13 +3,20 @@
 import logging
 import pandas as pd
 from lxml import etree
-from typing import Iterator, Dict
+from typing import Callable, Iterable, Iterator, Dict, Optional
+from openpyxl import load_workbook
 import json
 import hl7  # Biblioteca para HL7 v2
 
 # Remover import do fhir.resources que pode estar causando problemas
 # from fhir.resources.patient import Patient
 
+# --- Leitura em Streaming ---
+# Tamanho padrão dos chunks dos geradores (*_stream)
+DEFAULT_CHUNK_SIZE = 1000
+# Entidades lidas sempre como gerador de chunks, em qualquer formato de arquivo
+STREAMING_ENTITIES = {'pacientes'}
+
 # --- Definição das Colunas Canônicas ---
 CANONICAL_COLUMNS = {
     'hospitais': ['codigo', 'nome', 'municipio_id', 'especialidades', 'leitos_totais'],
@@ -102,58 +109,116 @@ def _ensure_canonical_schema(df: pd.DataFrame, entity_type: str) -> pd.DataFrame
     return df_copy[final_cols]
 
 # --- Adaptadores (Funções especialistas em ler cada formato) ---
+# Cada formato tem uma versão que devolve um DataFrame e uma versão *_stream que devolve
+# um gerador de DataFrames com até chunk_size linhas (mesmo contrato de from_xml_stream).
+
+def _apply_schema_map(df: pd.DataFrame, schema_map: dict, entity_type: str) -> pd.DataFrame:
+    """Renomeia as colunas pelo schema_map, mantém as mapeadas e garante o schema canônico."""
+    df = df.rename(columns=schema_map)
+    available_cols = [col for col in schema_map.values() if col in df.columns]
+    df_filtered = df[available_cols] if available_cols else df
+    return _ensure_canonical_schema(df_filtered, entity_type)
+
+def _raw_to_canonical(df_bruto: pd.DataFrame, schema_map: dict, entity_type: str) -> pd.DataFrame:
+    """Conformidade final dos adaptadores FHIR e HL7, que extraem os campos manualmente."""
+    if not df_bruto.empty and schema_map:
+        df_bruto = df_bruto.rename(columns=schema_map)
+    return _ensure_canonical_schema(df_bruto, entity_type)
+
+def _records_to_chunks(records: Iterable, chunk_size: int, to_dataframe: Callable[[list], pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Agrupa um iterador de registros em DataFrames de até chunk_size linhas."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield to_dataframe(chunk)
+            chunk = []
+    if chunk:
+        yield to_dataframe(chunk)
 
 def from_csv(filepath: str, schema_map: dict, entity_type: str) -> pd.DataFrame:
     try:
         df = pd.read_csv(filepath, on_bad_lines='warn', dtype=str)
-        df.rename(columns=schema_map, inplace=True)
-        available_cols = [col for col in schema_map.values() if col in df.columns]
-        df_filtered = df[available_cols] if available_cols else df
-        return _ensure_canonical_schema(df_filtered, entity_type)
+        return _apply_schema_map(df, schema_map, entity_type)
     except Exception as e:
         logging.error(f"Erro ao ler CSV {filepath}: {e}")
         return pd.DataFrame()
 
+def from_csv_stream(filepath: str, schema_map: dict, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    try:
+        for chunk_df in pd.read_csv(filepath, on_bad_lines='warn', dtype=str, chunksize=chunk_size):
+            yield _apply_schema_map(chunk_df, schema_map, entity_type)
+    except Exception as e:
+        logging.error(f"Erro ao ler CSV {filepath}: {e}")
+
 def from_excel(filepath: str, schema_map: dict, entity_type: str) -> pd.DataFrame:
     try:
         df = pd.read_excel(filepath, dtype=str, engine='openpyxl')
-        df.rename(columns=schema_map, inplace=True)
-        available_cols = [col for col in schema_map.values() if col in df.columns]
-        df_filtered = df[available_cols] if available_cols else df
-        return _ensure_canonical_schema(df_filtered, entity_type)
+        return _apply_schema_map(df, schema_map, entity_type)
     except Exception as e:
         logging.error(f"Erro ao ler Excel {filepath}: {e}")
         return pd.DataFrame()
 
+def _excel_cell_to_str(value):
+    """Converte uma célula para texto como o pd.read_excel(dtype=str) faria."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def from_excel_stream(filepath: str, schema_map: dict, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Lê a primeira planilha em modo read_only do openpyxl, linha a linha."""
+    try:
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(next(rows, ()))]
+            records = ([_excel_cell_to_str(v) for v in row] for row in rows if any(v is not None for v in row))
+            to_dataframe = lambda chunk: _apply_schema_map(pd.DataFrame(chunk, columns=header), schema_map, entity_type)
+            yield from _records_to_chunks(records, chunk_size, to_dataframe)
+        finally:
+            workbook.close()
+    except Exception as e:
+        logging.error(f"Erro ao ler Excel {filepath}: {e}")
+
+def _iter_json_records(filepath: str) -> Iterator[dict]:
+    """Lê um arquivo JSONL (cada linha é um JSON), ignorando linhas vazias ou inválidas."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:  # Ignora linhas vazias
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logging.warning(f"Linha JSON inválida ignorada: {line[:100]}... Erro: {e}")
+
+def _json_records_to_dataframe(records: list, schema_map: dict, entity_type: str) -> pd.DataFrame:
+    df = pd.DataFrame(records)
+    df = df.astype(str)  # Converte tudo para string
+    return _apply_schema_map(df, schema_map, entity_type)
+
 def from_json(filepath: str, schema_map: dict, entity_type: str) -> pd.DataFrame:
     try:
-        # Tenta ler como JSONL (cada linha é um JSON)
-        records = []
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:  # Ignora linhas vazias
-                    try:
-                        record = json.loads(line)
-                        records.append(record)
-                    except json.JSONDecodeError as e:
-                        logging.warning(f"Linha JSON inválida ignorada: {line[:100]}... Erro: {e}")
+        records = list(_iter_json_records(filepath))
         
         if not records:
             logging.warning(f"Nenhum registro JSON válido encontrado em {filepath}")
             return pd.DataFrame()
         
-        df = pd.DataFrame(records)
-        df = df.astype(str)  # Converte tudo para string
-        df.rename(columns=schema_map, inplace=True)
-        available_cols = [col for col in schema_map.values() if col in df.columns]
-        df_filtered = df[available_cols] if available_cols else df
-        return _ensure_canonical_schema(df_filtered, entity_type)
+        return _json_records_to_dataframe(records, schema_map, entity_type)
     except Exception as e:
         logging.error(f"Erro ao ler JSON {filepath}: {e}")
         return pd.DataFrame()
 
-def from_xml_stream(filepath: str, schema_map: dict, entity_type: str, tag: str, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+def from_json_stream(filepath: str, schema_map: dict, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    try:
+        to_dataframe = lambda chunk: _json_records_to_dataframe(chunk, schema_map, entity_type)
+        yield from _records_to_chunks(_iter_json_records(filepath), chunk_size, to_dataframe)
+    except Exception as e:
+        logging.error(f"Erro ao ler JSON {filepath}: {e}")
+
+def from_xml_stream(filepath: str, schema_map: dict, entity_type: str, tag: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
     records_chunk = []
     try:
         context = etree.iterparse(filepath, events=('end',), tag=tag)
@@ -166,12 +231,7 @@ def from_xml_stream(filepath: str, schema_map: dict, entity_type: str, tag: str,
             
             if len(records_chunk) >= chunk_size:
                 if records_chunk:
-                    chunk_df = pd.DataFrame(records_chunk)
-                    chunk_df.rename(columns=schema_map, inplace=True)
-                    available_cols = [col for col in schema_map.values() if col in chunk_df.columns]
-                    if available_cols:
-                        chunk_df = chunk_df[available_cols]
-                    yield _ensure_canonical_schema(chunk_df, entity_type)
+                    yield _apply_schema_map(pd.DataFrame(records_chunk), schema_map, entity_type)
                 records_chunk = []
             
             elem.clear()
@@ -182,130 +242,141 @@ def from_xml_stream(filepath: str, schema_map: dict, entity_type: str, tag: str,
         
     # Processa os registros restantes
     if records_chunk:
-        chunk_df = pd.DataFrame(records_chunk)
-        chunk_df.rename(columns=schema_map, inplace=True)
-        available_cols = [col for col in schema_map.values() if col in chunk_df.columns]
-        if available_cols:
-            chunk_df = chunk_df[available_cols]
-        yield _ensure_canonical_schema(chunk_df, entity_type)
+        yield _apply_schema_map(pd.DataFrame(records_chunk), schema_map, entity_type)
 
-def from_fhir_json(filepath: str, entity_type: str) -> pd.DataFrame:
-    """Lê dados FHIR sem dependência externa, usando parsing JSON manual"""
-    records = []
+def _parse_fhir_patient(data: dict) -> Optional[dict]:
+    """Extrai manualmente os campos de um recurso FHIR Patient (None para outros recursos)."""
+    if data.get('resourceType') != 'Patient': 
+        return None
+    
+    # Extração manual dos dados FHIR
+    record = {'id': data.get('id', '')}
+    
+    # Nome
+    if 'name' in data and data['name']:
+        name_parts = []
+        first_name = data['name'][0]
+        if 'given' in first_name and first_name['given']:
+            name_parts.extend(first_name['given'])
+        if 'family' in first_name:
+            name_parts.append(first_name['family'])
+        record['name'] = ' '.join(name_parts)
+    
+    # Gênero
+    record['gender'] = data.get('gender', '').upper()[:1] if data.get('gender') else None
+    
+    # Identificadores (CPF, etc.)
+    if 'identifier' in data:
+        for identifier in data['identifier']:
+            if identifier.get('system') == 'cpf':
+                record['identifier_cpf'] = identifier.get('value', '')
+    
+    return record
+
+def _iter_fhir_records(filepath: str) -> Iterator[dict]:
+    """Percorre o arquivo FHIR linha a linha, sem acumular os registros."""
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             for line in f:
                 try:
-                    data = json.loads(line.strip())
-                    if data.get('resourceType') != 'Patient': 
-                        continue
-                    
-                    # Extração manual dos dados FHIR
-                    record = {'id': data.get('id', '')}
-                    
-                    # Nome
-                    if 'name' in data and data['name']:
-                        name_parts = []
-                        first_name = data['name'][0]
-                        if 'given' in first_name and first_name['given']:
-                            name_parts.extend(first_name['given'])
-                        if 'family' in first_name:
-                            name_parts.append(first_name['family'])
-                        record['name'] = ' '.join(name_parts)
-                    
-                    # Gênero
-                    record['gender'] = data.get('gender', '').upper()[:1] if data.get('gender') else None
-                    
-                    # Identificadores (CPF, etc.)
-                    if 'identifier' in data:
-                        for identifier in data['identifier']:
-                            if identifier.get('system') == 'cpf':
-                                record['identifier_cpf'] = identifier.get('value', '')
-                    
-                    records.append(record)
-                    
+                    record = _parse_fhir_patient(json.loads(line.strip()))
+                    if record is not None:
+                        yield record
                 except Exception as e: 
                     logging.warning(f"Falha ao processar linha FHIR: {e}")
                     
     except Exception as e:
         logging.error(f"Erro ao ler arquivo FHIR {filepath}: {e}")
+
+def from_fhir_json(filepath: str, entity_type: str) -> pd.DataFrame:
+    """Lê dados FHIR sem dependência externa, usando parsing JSON manual"""
+    return pd.DataFrame(list(_iter_fhir_records(filepath)))
+
+def from_fhir_json_stream(filepath: str, schema_map: dict, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    to_dataframe = lambda chunk: _raw_to_canonical(pd.DataFrame(chunk), schema_map, entity_type)
+    yield from _records_to_chunks(_iter_fhir_records(filepath), chunk_size, to_dataframe)
+
+def _iter_hl7_messages(lines: Iterable[str]) -> Iterator[str]:
+    """Divide as linhas em mensagens HL7, iniciando uma nova a cada MSH no início da linha."""
+    current_message = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('MSH'):
+            if current_message:
+                yield '\n'.join(current_message)
+            current_message = [line]
+        else:
+            if current_message:  # Só adiciona se já temos um MSH
+                current_message.append(line)
     
-    return pd.DataFrame(records)
+    # Adicionar última mensagem
+    if current_message:
+        yield '\n'.join(current_message)
 
-def from_hl7(filepath: str, entity_type: str) -> pd.DataFrame:
-    """Lê mensagens HL7 e extrai os dados brutos que encontrar."""
-    records = []
+def _parse_hl7_message(msg_raw: str) -> Optional[dict]:
+    """Extrai os campos do segmento PID de uma mensagem HL7 (None se não houver)."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
+        msg = hl7.parse(msg_raw.replace('\n', '\r'))
+        
+        # Procurar pelo segmento PID
+        pid_segment = None
+        for segment in msg:
+            if str(segment[0]) == 'PID':
+                pid_segment = segment
+                break
+        
+        if not pid_segment:
+            logging.warning("Segmento esperado não encontrado ou campo vazio em uma mensagem HL7: 'No PID segments'")
+            return None
+        
+        if len(pid_segment) > 3:
+            # Extrair dados do PID de forma mais robusta
+            patient_id = str(pid_segment[3][0][0]) if pid_segment[3] and len(pid_segment[3][0]) > 0 else None
             
-            # Dividir mensagens por MSH no início da linha
-            messages_raw = []
-            lines = content.split('\n')
-            current_message = []
+            # Nome do paciente (PID.5) - formato: SOBRENOME^NOME
+            nome_completo = ""
+            if len(pid_segment) > 5 and pid_segment[5]:
+                nome_components = str(pid_segment[5][0][0]).split('^')
+                if len(nome_components) >= 2:
+                    # Formato: SOBRENOME^NOME -> NOME SOBRENOME
+                    nome_completo = f"{nome_components[1]} {nome_components[0]}".strip()
+                elif len(nome_components) == 1:
+                    nome_completo = nome_components[0].strip()
             
-            for line in lines:
-                line = line.strip()
-                if line.startswith('MSH'):
-                    if current_message:
-                        messages_raw.append('\n'.join(current_message))
-                    current_message = [line]
-                else:
-                    if current_message:  # Só adiciona se já temos um MSH
-                        current_message.append(line)
+            # Gênero (PID.8)
+            genero = str(pid_segment[8][0][0]) if len(pid_segment) > 8 and pid_segment[8] else None
             
-            # Adicionar última mensagem
-            if current_message:
-                messages_raw.append('\n'.join(current_message))
+            return {
+                'pid_3': patient_id,
+                'pid_5': nome_completo,
+                'pid_8': genero
+            }
             
-            for msg_raw in messages_raw:
+    except Exception as e:
+        logging.warning(f"Falha ao processar mensagem HL7: {e}")
+    return None
+
+def _iter_hl7_records(filepath: str) -> Iterator[dict]:
+    """Lê o arquivo HL7 linha a linha (sem carregá-lo inteiro) e produz um registro por mensagem."""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for msg_raw in _iter_hl7_messages(f):
                 if not msg_raw.strip():
                     continue
-                    
-                try:
-                    msg = hl7.parse(msg_raw.replace('\n', '\r'))
-                    
-                    # Procurar pelo segmento PID
-                    pid_segment = None
-                    for segment in msg:
-                        if str(segment[0]) == 'PID':
-                            pid_segment = segment
-                            break
-                    
-                    if not pid_segment:
-                        logging.warning("Segmento esperado não encontrado ou campo vazio em uma mensagem HL7: 'No PID segments'")
-                        continue
-                    
-                    if len(pid_segment) > 3:
-                        # Extrair dados do PID de forma mais robusta
-                        patient_id = str(pid_segment[3][0][0]) if pid_segment[3] and len(pid_segment[3][0]) > 0 else None
-                        
-                        # Nome do paciente (PID.5) - formato: SOBRENOME^NOME
-                        nome_completo = ""
-                        if len(pid_segment) > 5 and pid_segment[5]:
-                            nome_components = str(pid_segment[5][0][0]).split('^')
-                            if len(nome_components) >= 2:
-                                # Formato: SOBRENOME^NOME -> NOME SOBRENOME
-                                nome_completo = f"{nome_components[1]} {nome_components[0]}".strip()
-                            elif len(nome_components) == 1:
-                                nome_completo = nome_components[0].strip()
-                        
-                        # Gênero (PID.8)
-                        genero = str(pid_segment[8][0][0]) if len(pid_segment) > 8 and pid_segment[8] else None
-                        
-                        records.append({
-                            'pid_3': patient_id,
-                            'pid_5': nome_completo,
-                            'pid_8': genero
-                        })
-                        
-                except Exception as e:
-                    logging.warning(f"Falha ao processar mensagem HL7: {e}")
+                record = _parse_hl7_message(msg_raw)
+                if record is not None:
+                    yield record
                     
     except Exception as e:
         logging.error(f"Erro ao abrir arquivo HL7: {e}")
-    
-    return pd.DataFrame(records)
+
+def from_hl7(filepath: str, entity_type: str) -> pd.DataFrame:
+    """Lê mensagens HL7 e extrai os dados brutos que encontrar."""
+    return pd.DataFrame(list(_iter_hl7_records(filepath)))
+
+def from_hl7_stream(filepath: str, schema_map: dict, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    to_dataframe = lambda chunk: _raw_to_canonical(pd.DataFrame(chunk), schema_map, entity_type)
+    yield from _records_to_chunks(_iter_hl7_records(filepath), chunk_size, to_dataframe)
 
 # --- Orquestrador (A Fábrica que decide qual adaptador usar) ---
 
@@ -320,51 +391,61 @@ def get_file_format(filepath: str) -> str:
     if filepath_lower.endswith('.hl7'): return 'hl7'
     raise ValueError(f"Formato de arquivo não suportado para o caminho: {filepath}")
 
-def run(filepath: str, entity_type: str) -> pd.DataFrame | Iterator[pd.DataFrame]:
+def returns_stream(filepath: str, entity_type: str) -> bool:
+    """Indica se run() devolverá um gerador de chunks (XML sempre; entidades de streaming em qualquer formato)."""
+    return entity_type in STREAMING_ENTITIES or get_file_format(filepath) == 'xml'
+
+def run(filepath: str, entity_type: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame | Iterator[pd.DataFrame]:
     """
     Lê qualquer arquivo de qualquer entidade, traduz para o formato canônico e retorna
-    um DataFrame ou um gerador de DataFrames.
+    um DataFrame ou um gerador de DataFrames. Entidades em STREAMING_ENTITIES são sempre
+    lidas em chunks de até chunk_size registros, qualquer que seja o formato.
     """
     file_format = get_file_format(filepath)
     schema_map = SCHEMA_MAPS.get(entity_type, {}).get(file_format, {})
+    stream = entity_type in STREAMING_ENTITIES
 
     logging.info(f"Processando arquivo {filepath} (formato: {file_format}, entidade: {entity_type})")
 
     if file_format == 'csv':
+        if stream:
+            return from_csv_stream(filepath, schema_map, entity_type, chunk_size)
         return from_csv(filepath, schema_map, entity_type)
         
     elif file_format == 'excel':
+        if stream:
+            return from_excel_stream(filepath, schema_map, entity_type, chunk_size)
         return from_excel(filepath, schema_map, entity_type)
         
     elif file_format == 'json':
+        if stream:
+            return from_json_stream(filepath, schema_map, entity_type, chunk_size)
         return from_json(filepath, schema_map, entity_type)
         
     elif file_format == 'fhir':
         # O adaptador FHIR não usa o schema_map diretamente, mas a conformidade final sim
-        df_bruto = from_fhir_json(filepath, entity_type)
-        if not df_bruto.empty and schema_map:
-            df_bruto.rename(columns=schema_map, inplace=True)
-        return _ensure_canonical_schema(df_bruto, entity_type)
+        if stream:
+            return from_fhir_json_stream(filepath, schema_map, entity_type, chunk_size)
+        return _raw_to_canonical(from_fhir_json(filepath, entity_type), schema_map, entity_type)
         
     elif file_format == 'hl7':
         # O adaptador HL7 também não usa o schema_map diretamente
-        df_bruto = from_hl7(filepath, entity_type)
-        if not df_bruto.empty and schema_map:
-            df_bruto.rename(columns=schema_map, inplace=True)
-        return _ensure_canonical_schema(df_bruto, entity_type)
+        if stream:
+            return from_hl7_stream(filepath, schema_map, entity_type, chunk_size)
+        return _raw_to_canonical(from_hl7(filepath, entity_type), schema_map, entity_type)
         
     elif file_format == 'xml':
-        # O XML é o único caso que retorna um gerador
+        # O XML sempre retorna um gerador
         if entity_type == 'pacientes':
-            return from_xml_stream(filepath, schema_map, entity_type, tag='Paciente')
+            return from_xml_stream(filepath, schema_map, entity_type, tag='Paciente', chunk_size=chunk_size)
         elif entity_type == 'hospitais':
-            return from_xml_stream(filepath, schema_map, entity_type, tag='Hospital')
+            return from_xml_stream(filepath, schema_map, entity_type, tag='Hospital', chunk_size=chunk_size)
         elif entity_type == 'medicos':
-            return from_xml_stream(filepath, schema_map, entity_type, tag='Medico')
+            return from_xml_stream(filepath, schema_map, entity_type, tag='Medico', chunk_size=chunk_size)
         else:
             # Para outras entidades, tenta uma tag genérica
             tag_name = entity_type.rstrip('s').capitalize()  # Remove 's' do plural e capitaliza
-            return from_xml_stream(filepath, schema_map, entity_type, tag=tag_name)
+            return from_xml_stream(filepath, schema_map, entity_type, tag=tag_name, chunk_size=chunk_size)
     
     # Se nenhum dos 'if' acima corresponder, o formato não é suportado
-    raise NotImplementedError(f"Adaptador para o formato '{file_format}' não implementado.")
\ No newline at end of file
+    raise NotImplementedError(f"Adaptador para o formato '{file_format}' não implementado.")
@@ -1,5 +1,6 @@
 import logging
 from pipeline import extract, transform, load
+from pipeline.staged import get_pipeline_mode, stage_entity
 
 # Configuração básica de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -7,20 +8,33 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 def main():
     """Orquestra a execução do pipeline de ETL."""
     logging.info("Iniciando o pipeline de ETL de dados de saúde.")
+    # Modo em estágios: a leitura do XML e a transformação dos pacientes rodam em threads próprias,
+    # ligadas por filas limitadas, enquanto a thread principal grava no banco
+    staged = get_pipeline_mode() == 'staged'
+    stages = []
 
     # Etapa de Extração
     logging.info("--- Estágio 1: Extração ---")
     dataframes = extract.run()
+    if staged:
+        stages.append(stage_entity(dataframes, 'pacientes', 'leitura'))
 
     # Etapa de Transformação
     logging.info("--- Estágio 2: Transformação ---")
     transformed_data = transform.run(dataframes)
+    if staged:
+        stages.append(stage_entity(transformed_data, 'pacientes', 'transformação'))
+        logging.info("PIPELINE_MODE=staged: leitura, transformação e carga de pacientes em paralelo.")
 
     # Etapa de Carga
     logging.info("--- Estágio 3: Carga ---")
-    load.run(transformed_data)
+    try:
+        load.run(transformed_data)
+    finally:
+        for stage in stages:
+            if stage is not None: stage.close()
 
     logging.info("Pipeline de ETL concluído com sucesso.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,190 @@
+# src/pipeline/allocation_engine.py
+# Motor de alocação em lote de pacientes a hospitais (substitui o loop por paciente)
+
+import logging
+import random
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .spatial_index import HospitalSpatialIndex
+from .especialidades import ESPECIALIDADE_GERAL, VocabularioEspecialidades, tem_especialidade
+from .municipio_lookup import MunicipioLookup
+from .capacity import BedCapacity
+
+class HospitalAllocationEngine:
+    """
+    Aloca chunks inteiros de pacientes a hospitais usando NumPy.
+
+    O índice especialidade -> hospitais, os arrays de coordenadas e o índice espacial são
+    montados uma única vez; cada chunk é resolvido com consultas em lote ao índice espacial,
+    agrupadas por (município, especialidade exigida). A semântica é a da antiga alocação por paciente:
+    1. Com hospital especializado: o mais próximo (ou o primeiro, sem coordenadas do paciente).
+    2. Sem CID ou sem especializado: o hospital mais próximo de qualquer especialidade.
+    3. Sem coordenadas: um hospital geral aleatório (ou qualquer hospital).
+
+    Com `capacity` (BedCapacity), leitos_totais vira restrição rígida: cada etapa só usa
+    hospitais com leitos livres, preenchidos do mais próximo para o mais distante, e o
+    estado dos leitos segue de um chunk para o outro. Pacientes que não cabem no hospital
+    especializado vão para o mais próximo com leito (realocados por lotação); sem nenhum
+    leito disponível ficam sem hospital e são contados como excedentes.
+    """
+
+    def __init__(self, hospitals: List[Dict], municipios: MunicipioLookup, capacity: Optional[BedCapacity] = None):
+        self.codigos = np.array([h['codigo'] for h in hospitals], dtype=object)
+        self.latitudes = np.array([h.get('latitude') for h in hospitals], dtype=float)
+        self.longitudes = np.array([h.get('longitude') for h in hospitals], dtype=float)
+
+        # Especialidades internadas no vocabulário canônico, um bitset por hospital
+        self.vocabulario = VocabularioEspecialidades()
+        self.especialidade_bits = self.vocabulario.bitsets(h.get('especialidades', []) for h in hospitals)
+
+        # Índice especialidade normalizada -> posições dos hospitais (na ordem original)
+        self.especialidade_index = {spec: np.flatnonzero(tem_especialidade(self.especialidade_bits, spec_id))
+                                    for spec_id, spec in enumerate(self.vocabulario.nomes)}
+        self.general_positions = np.flatnonzero(self.vocabulario.contem(self.especialidade_bits, ESPECIALIDADE_GERAL))
+        self.general_hospitals_ids = list(self.codigos[self.general_positions])
+        self.spatial_index = HospitalSpatialIndex(self.latitudes, self.longitudes, self.especialidade_index)
+
+        # Coordenadas por código IBGE (tabela de consulta compartilhada, montada uma vez por execução)
+        self.municipios = municipios
+
+        self.capacity = capacity
+        self.capacity_stats = {'realocados_por_lotacao': 0, 'sem_leito': 0}
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def _lookup_coordinates(self, cod_municipio: pd.Series):
+        """Retorna arrays (posição do município, lat, lon) alinhados ao chunk; NaN onde não há coordenadas."""
+        return self.municipios.coordinates(cod_municipio)
+
+    def _nearest(self, codes: np.ndarray, lat: np.ndarray, lon: np.ndarray, especialidade=None, default: int = 0) -> np.ndarray:
+        """
+        Para cada linha, a posição do hospital mais próximo (da especialidade, se informada).
+        Consulta o índice espacial uma vez por município (codes = posições na MunicipioLookup).
+        Sem distância finita, usa `default` (o primeiro candidato, como o min() original
+        sobre distâncias infinitas).
+        """
+        _, first_idx, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        best, _ = self.spatial_index.nearest(lat[first_idx], lon[first_idx], k=1, especialidade=especialidade)
+        best = best[:, 0]
+        best[best < 0] = default
+        return best[inverse]
+
+    def allocate(self, cod_municipio: pd.Series, especialidade_norm: pd.Series) -> np.ndarray:
+        """
+        Aloca um chunk de pacientes.
+
+        Parâmetros:
+        - cod_municipio: código IBGE do município de cada paciente (nulo quando desconhecido)
+        - especialidade_norm: especialidade normalizada exigida pelo CID (nula quando sem CID)
+
+        Retorna um array com o código do hospital alocado (ou None) para cada paciente.
+        """
+        n = len(cod_municipio)
+        result = np.full(n, None, dtype=object)
+        if n == 0 or len(self.codigos) == 0:
+            return result
+        if self.capacity is not None:
+            return self._allocate_with_capacity(cod_municipio, especialidade_norm)
+
+        codes, lat, lon = self._lookup_coordinates(cod_municipio)
+        has_coords = ~np.isnan(lat)
+        required = especialidade_norm.to_numpy(dtype=object)
+        chosen = np.full(n, -1, dtype=np.int64)  # -1 = ainda sem hospital
+
+        # 1. Hospital especializado mais próximo, agrupado por especialidade
+        for spec in pd.unique(especialidade_norm.dropna()):
+            candidates = self.especialidade_index.get(spec)
+            if candidates is None:
+                continue
+            rows = np.flatnonzero(required == spec)
+            rows_with_coords = rows[has_coords[rows]]
+            chosen[rows[~has_coords[rows]]] = candidates[0]
+            if rows_with_coords.size:
+                chosen[rows_with_coords] = self._nearest(codes[rows_with_coords], lat[rows_with_coords], lon[rows_with_coords], spec, candidates[0])
+
+        # 2. Fallback: hospital mais próximo de qualquer especialidade
+        fallback = chosen < 0
+        if fallback.any():
+            logging.warning(f"{int(fallback.sum())} pacientes sem CID ou sem hospital especializado. Usando fallback.")
+        rows_with_coords = np.flatnonzero(fallback & has_coords)
+        if rows_with_coords.size:
+            chosen[rows_with_coords] = self._nearest(codes[rows_with_coords], lat[rows_with_coords], lon[rows_with_coords])
+
+        allocated = chosen >= 0
+        result[allocated] = self.codigos[chosen[allocated]]
+
+        # 3. Sem coordenadas: sorteio entre hospitais gerais (ou entre todos)
+        for row in np.flatnonzero(~allocated):
+            if self.general_hospitals_ids:
+                result[row] = random.choice(self.general_hospitals_ids)
+            else:
+                result[row] = random.choice(self.codigos)
+        return result
+
+    def _fill_nearest_by_municipio(self, rows: np.ndarray, codes: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                                   chosen: np.ndarray, especialidade=None):
+        """Preenche `chosen` para as linhas (com coordenadas), um município por vez, na ordem das linhas."""
+        _, inverse, counts = np.unique(codes[rows], return_inverse=True, return_counts=True)
+        grouped_rows = np.split(rows[np.argsort(inverse, kind='stable')], np.cumsum(counts)[:-1])
+        for group_rows in grouped_rows:
+            row = group_rows[0]
+            taken = self.capacity.fill_nearest(self.spatial_index, lat[row], lon[row], len(group_rows), especialidade)
+            chosen[group_rows[:len(taken)]] = taken
+
+    def _allocate_with_capacity(self, cod_municipio: pd.Series, especialidade_norm: pd.Series) -> np.ndarray:
+        """Versão de allocate com leitos_totais como restrição rígida (ver docstring da classe)."""
+        n = len(cod_municipio)
+        result = np.full(n, None, dtype=object)
+        codes, lat, lon = self._lookup_coordinates(cod_municipio)
+        has_coords = ~np.isnan(lat)
+        required = especialidade_norm.to_numpy(dtype=object)
+        chosen = np.full(n, -1, dtype=np.int64)
+        wanted_specialist = np.zeros(n, dtype=bool)
+
+        # 1. Hospitais especializados com leito, do mais próximo para o mais distante
+        for spec in pd.unique(especialidade_norm.dropna()):
+            candidates = self.especialidade_index.get(spec)
+            if candidates is None:
+                continue
+            rows = np.flatnonzero(required == spec)
+            wanted_specialist[rows] = True
+            rows_with_coords = rows[has_coords[rows]]
+            if rows_with_coords.size:
+                self._fill_nearest_by_municipio(rows_with_coords, codes, lat, lon, chosen, spec)
+            rows_without_coords = rows[~has_coords[rows]]
+            taken = self.capacity.fill_in_order(candidates, len(rows_without_coords))
+            chosen[rows_without_coords[:len(taken)]] = taken
+
+        realocados = int((wanted_specialist & (chosen < 0)).sum())
+
+        # 2. Hospital mais próximo com leito, de qualquer especialidade
+        rows_with_coords = np.flatnonzero((chosen < 0) & has_coords)
+        if rows_with_coords.size:
+            self._fill_nearest_by_municipio(rows_with_coords, codes, lat, lon, chosen)
+
+        # 3. Sem coordenadas: sorteio entre hospitais gerais com leito (ou entre todos com leito)
+        all_positions = np.arange(len(self.codigos), dtype=np.int64)
+        for row in np.flatnonzero((chosen < 0) & ~has_coords):
+            position = self.capacity.take_random(self.general_positions)
+            chosen[row] = position if position >= 0 else self.capacity.take_random(all_positions)
+
+        allocated = chosen >= 0
+        result[allocated] = self.codigos[chosen[allocated]]
+        sem_leito = int((~allocated).sum())
+        self.capacity_stats['realocados_por_lotacao'] += realocados
+        self.capacity_stats['sem_leito'] += sem_leito
+        if realocados:
+            logging.warning(f"{realocados} pacientes realocados por lotação do hospital especializado.")
+        if sem_leito:
+            logging.warning(f"{sem_leito} pacientes sem hospital: não há leitos livres disponíveis (excedente).")
+        return result
+
+    def capacity_report(self) -> Dict[str, int]:
+        """Resumo acumulado da alocação com capacidade (vazio no modo sem restrição de leitos)."""
+        if self.capacity is None:
+            return {}
+        return {**self.capacity_stats,
+                'leitos_ocupados': self.capacity.occupied(),
+                'hospitais_lotados': self.capacity.full_hospitals()}
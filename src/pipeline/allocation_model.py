@@ -0,0 +1,221 @@
+# src/pipeline/allocation_model.py
+# Modelo de alocação pré-processado (especialidades, coordenadas, índice espacial) persistido em disco
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .spatial_index import HospitalSpatialIndex
+from .municipio_lookup import MunicipioLookup
+from .capacity import parse_leitos
+from .especialidades import VocabularioEspecialidades, normalizar_lista, parse_especialidades
+
+# Versão do formato em disco: mudar sempre que o conteúdo ou a forma dos arrays mudar
+MODEL_VERSION = 2
+DEFAULT_MODEL_DIR = 'data/cache/allocation_model'
+META_FILE = 'meta.json'
+
+# Colunas que entram no hash (e no modelo); colunas ausentes são ignoradas
+HOSPITAL_KEY_COLUMNS = ['codigo', 'especialidades', 'municipio_id', 'leitos_totais']
+MUNICIPIO_KEY_COLUMNS = ['codigo_ibge', 'latitude', 'longitude', 'codigo_uf']
+
+# Modelos já abertos neste processo, por chave (os mais antigos saem ao passar do limite)
+MAX_OPEN_MODELS = 4
+_open_models: Dict[str, 'AllocationModel'] = {}
+
+def get_model_dir() -> str:
+    """Diretório dos modelos persistidos (ALLOCATION_MODEL_DIR); vazio desativa a persistência."""
+    return os.getenv('ALLOCATION_MODEL_DIR', DEFAULT_MODEL_DIR).strip()
+
+def _hash_frame(digest, df: pd.DataFrame, columns: List[str]):
+    columns = [c for c in columns if c in df.columns]
+    digest.update(json.dumps(columns).encode())
+    for column in columns:
+        values = df[column]
+        digest.update(str(values.dtype).encode())
+        try:
+            hashed = pd.util.hash_pandas_object(values, index=False)
+        except TypeError:
+            # Colunas com listas (especialidades) não são hasheáveis diretamente
+            hashed = pd.util.hash_pandas_object(values.astype(str), index=False)
+        digest.update(hashed.to_numpy().tobytes())
+
+def model_key(hospitais_df: pd.DataFrame, municipios_df: pd.DataFrame) -> str:
+    """Hash das colunas relevantes das tabelas de hospitais e municípios (mais a versão do formato)."""
+    digest = hashlib.sha256(f'v{MODEL_VERSION}'.encode())
+    _hash_frame(digest, hospitais_df, HOSPITAL_KEY_COLUMNS)
+    _hash_frame(digest, municipios_df, MUNICIPIO_KEY_COLUMNS)
+    return digest.hexdigest()[:32]
+
+class AllocationModel:
+    """
+    Estado imutável usado pelo PatientAllocationSystem, em arrays (posição i = hospital_ids[i]):
+    especialidades normalizadas (IDs do vocabulário canônico, em formato CSR e em bitset),
+    município, leitos, coordenadas, o índice espacial dos hospitais e a tabela de municípios.
+
+    save() grava cada array num .npy e o restante num meta.json; open() mapeia os .npy em
+    memória (mmap_mode='r'), de modo que abrir um modelo já calculado não refaz nenhum
+    pré-processamento e só lê do disco as páginas realmente consultadas.
+    """
+
+    def __init__(self, key: str, hospital_ids: list, especialidades_originais: List[list],
+                 vocabulario: VocabularioEspecialidades, arrays: Dict[str, np.ndarray], grid_keys: List[Optional[str]]):
+        self.key = key
+        self.hospital_ids = hospital_ids
+        self.especialidades_originais = especialidades_originais
+        self.vocabulario = vocabulario
+        self.arrays = arrays
+        self.especialidade_bits = arrays['especialidade_bits']
+        self.grid_keys = grid_keys
+
+        self.municipio_ids = arrays['municipio_ids']
+        self.municipio_validos = arrays['municipio_validos']
+        self.leitos_totais = arrays['leitos_totais']
+        self.spatial_index = HospitalSpatialIndex.from_arrays(grid_keys, arrays)
+        ufs = arrays['municipio_ufs']
+        self.municipio_lookup = MunicipioLookup.from_arrays(
+            arrays['municipio_codes'], arrays['municipio_latitudes'], arrays['municipio_longitudes'],
+            np.where(ufs >= 0, ufs.astype(object), None))
+
+    def __len__(self):
+        return len(self.hospital_ids)
+
+    @classmethod
+    def build(cls, hospitais_df: pd.DataFrame, municipios_df: pd.DataFrame, key: Optional[str] = None) -> 'AllocationModel':
+        """Pré-processa as tabelas (o que o PatientAllocationSystem fazia a cada construção)."""
+        key = key or model_key(hospitais_df, municipios_df)
+        hospitais = hospitais_df.reset_index(drop=True)
+        if 'codigo' not in hospitais.columns:
+            hospitais = hospitais.assign(codigo=None)
+
+        # Mesma semântica dos dicionários originais: um hospital por código, na ordem da primeira
+        # ocorrência, com os dados da última
+        codigos = hospitais['codigo'].drop_duplicates()
+        ultimos = hospitais.drop_duplicates(subset=['codigo'], keep='last').set_index('codigo').reindex(codigos)
+
+        originais = [parse_especialidades(v) for v in (ultimos['especialidades'] if 'especialidades' in ultimos.columns
+                                                        else [None] * len(ultimos))]
+        normalizadas = [normalizar_lista(specs) for specs in originais]
+
+        vocabulario = VocabularioEspecialidades()
+        especialidade_bits = vocabulario.bitsets(originais)
+        spec_offsets = np.cumsum([0] + [len(specs) for specs in normalizadas]).astype(np.int64)
+        spec_codes = np.array([vocabulario.id(spec) for specs in normalizadas for spec in specs], dtype=np.int32)
+
+        municipio_ids = pd.to_numeric(ultimos['municipio_id'] if 'municipio_id' in ultimos.columns
+                                      else pd.Series(np.nan, index=ultimos.index), errors='coerce')
+        municipio_validos = municipio_ids.notna().to_numpy()
+        leitos = parse_leitos(ultimos['leitos_totais'] if 'leitos_totais' in ultimos.columns else [None] * len(ultimos))
+
+        lookup = MunicipioLookup(municipios_df)
+        # Coordenadas do hospital = coordenadas do seu município (merge original: vale o último município repetido)
+        coords = municipios_df[['codigo_ibge', 'latitude', 'longitude']].copy() if len(municipios_df) else \
+            pd.DataFrame(columns=['codigo_ibge', 'latitude', 'longitude'])
+        coords['codigo_ibge'] = pd.to_numeric(coords['codigo_ibge'], errors='coerce')
+        coords = coords.dropna(subset=['codigo_ibge']).drop_duplicates(subset=['codigo_ibge'], keep='last').set_index('codigo_ibge')
+        coords = coords.reindex(municipio_ids.to_numpy())
+        latitudes = pd.to_numeric(coords['latitude'], errors='coerce').to_numpy(dtype=float)
+        longitudes = pd.to_numeric(coords['longitude'], errors='coerce').to_numpy(dtype=float)
+
+        grid_keys, index_arrays = HospitalSpatialIndex(latitudes, longitudes, normalizadas).to_arrays()
+        arrays = dict(index_arrays)
+        arrays.update({
+            'spec_offsets': spec_offsets,
+            'spec_codes': spec_codes,
+            'especialidade_bits': especialidade_bits,
+            'municipio_ids': municipio_ids.fillna(0).to_numpy(dtype=np.int64),
+            'municipio_validos': municipio_validos,
+            'leitos_totais': leitos,
+            'municipio_codes': lookup.codes,
+            'municipio_latitudes': lookup.latitudes,
+            'municipio_longitudes': lookup.longitudes,
+            'municipio_ufs': np.array([-1 if uf is None else uf for uf in lookup.ufs], dtype=np.int64),
+        })
+        return cls(key, codigos.tolist(), originais, vocabulario, arrays, grid_keys)
+
+    def especialidades_normalizadas(self, position: int) -> List[str]:
+        offsets, codes = self.arrays['spec_offsets'], self.arrays['spec_codes']
+        return [self.vocabulario.nomes[c] for c in codes[offsets[position]:offsets[position + 1]]]
+
+    def municipio_id(self, position: int):
+        return int(self.municipio_ids[position]) if self.municipio_validos[position] else None
+
+    def save(self, directory: str) -> str:
+        """Grava o modelo em directory/<key>/ (escrita atômica: diretório temporário + rename)."""
+        target = os.path.join(directory, self.key)
+        if os.path.isdir(target):
+            return target
+        os.makedirs(directory, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f'.{self.key}-', dir=directory)
+        try:
+            for name, array in self.arrays.items():
+                np.save(os.path.join(staging, f'{name}.npy'), np.asarray(array))
+            meta = {
+                'version': MODEL_VERSION,
+                'key': self.key,
+                'hospital_ids': self.hospital_ids,
+                'especialidades_originais': self.especialidades_originais,
+                'vocabulario': self.vocabulario.nomes,
+                'grid_keys': self.grid_keys,
+                'arrays': sorted(self.arrays),
+            }
+            with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+            os.rename(staging, target)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+        return target
+
+    @classmethod
+    def open(cls, path: str) -> 'AllocationModel':
+        """Abre um modelo gravado por save(); os arrays ficam memory-mapped (somente leitura)."""
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != MODEL_VERSION:
+            raise ValueError(f"Modelo de alocação em '{path}' tem versão {meta.get('version')}, esperada {MODEL_VERSION}")
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in meta['arrays']}
+        return cls(meta['key'], meta['hospital_ids'], meta['especialidades_originais'],
+                   VocabularioEspecialidades(meta['vocabulario']), arrays, meta['grid_keys'])
+
+def load_allocation_model(hospitais_df: pd.DataFrame, municipios_df: pd.DataFrame,
+                          model_dir: Optional[str] = None) -> AllocationModel:
+    """
+    Modelo para as tabelas informadas: reaproveita o já aberto neste processo, senão abre o
+    gravado em disco com a mesma chave, senão constrói e grava. Qualquer mudança nas tabelas
+    muda a chave, então um modelo desatualizado nunca é reutilizado.
+    """
+    key = model_key(hospitais_df, municipios_df)
+    if key in _open_models:
+        return _open_models[key]
+
+    model_dir = get_model_dir() if model_dir is None else model_dir
+    path = os.path.join(model_dir, key) if model_dir else None
+    model = None
+    if path and os.path.isdir(path):
+        try:
+            model = AllocationModel.open(path)
+            logging.info(f"Modelo de alocação {key} carregado de '{path}'.")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Modelo de alocação em '{path}' inválido ({e}); reconstruindo.")
+            shutil.rmtree(path, ignore_errors=True)
+
+    if model is None:
+        model = AllocationModel.build(hospitais_df, municipios_df, key)
+        if path:
+            try:
+                model = AllocationModel.open(model.save(model_dir))
+                logging.info(f"Modelo de alocação {key} gravado em '{path}'.")
+            except OSError as e:
+                logging.warning(f"Não foi possível gravar o modelo de alocação em '{model_dir}': {e}")
+
+    _open_models[key] = model
+    while len(_open_models) > MAX_OPEN_MODELS:
+        del _open_models[next(iter(_open_models))]
+    return model
@@ -0,0 +1,292 @@
+# src/pipeline/allocation_service.py
+# Serviço HTTP (asyncio) de alocação de pacientes: POST /allocate com os índices sempre em memória
+
+import asyncio
+import json
+import logging
+import os
+import time
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text
+from .load import get_database_engine
+from .patient_allocation import PatientAllocationSystem
+from .cid_especialidades import get_tabela_cid
+from .ddl import aplicar_sql
+
+# Canal do NOTIFY disparado pelos triggers de hospitais/municipios (src/pipeline/sql/notificacao_alocacao.sql)
+CANAL_ALTERACOES = 'alocacao_dados_alterados'
+# Espera após uma notificação antes de recarregar: agrupa o TRUNCATE + COPY de uma carga inteira
+REFRESH_DEBOUNCE_SECONDS = 2.0
+RECONNECT_SECONDS = 5.0
+
+DEFAULT_TOP_K = 3
+MAX_TOP_K = 20
+DEFAULT_MAX_DISTANCE_KM = 50
+MAX_DISTANCE_KM = 1000
+MAX_BATCH_SIZE = 1000
+MAX_BODY_BYTES = 1024 * 1024
+
+SQL_HOSPITAIS = "SELECT codigo::text AS codigo, especialidades, municipio_id, leitos_totais FROM hospitais ORDER BY codigo"
+SQL_MUNICIPIOS = """
+    SELECT codigo_ibge, ST_Y(localizacao) AS latitude, ST_X(localizacao) AS longitude, codigo_uf
+    FROM municipios ORDER BY codigo_ibge
+"""
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+def get_service_address() -> Tuple[str, int]:
+    """Endereço do serviço (ALLOCATION_SERVICE_HOST / ALLOCATION_SERVICE_PORT)."""
+    return os.getenv('ALLOCATION_SERVICE_HOST', '0.0.0.0'), int(os.getenv('ALLOCATION_SERVICE_PORT', '8600'))
+
+class RequestError(Exception):
+    """Requisição inválida: vira uma resposta HTTP com o status informado."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class AllocationService:
+    """
+    Mantém um PatientAllocationSystem carregado e responde consultas de alocação pontuais.
+
+    Os hospitais e municípios são lidos do banco na partida e recarregados quando os
+    triggers de hospitais/municipios publicam um NOTIFY. A recarga roda fora do event loop
+    e troca o sistema de uma vez só: as requisições em andamento continuam com o anterior.
+    Como o modelo de alocação é indexado pelo hash das tabelas, uma notificação sem
+    mudança efetiva nos dados reaproveita o modelo já aberto.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else get_database_engine()
+        self.system: Optional[PatientAllocationSystem] = None
+        self.loaded_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+
+    def _read_tables(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        with self.engine.connect() as conn:
+            hospitais = pd.read_sql(text(SQL_HOSPITAIS), conn)
+            municipios = pd.read_sql(text(SQL_MUNICIPIOS), conn)
+            # Deixa a tabela CID -> especialidade pronta para as consultas pontuais
+            get_tabela_cid(pd.read_sql(text("SELECT codigo FROM cid10"), conn)['codigo'])
+        return hospitais, municipios
+
+    def _build_system(self) -> PatientAllocationSystem:
+        hospitais, municipios = self._read_tables()
+        system = PatientAllocationSystem()
+        if not system.load_data(hospitais, municipios):
+            raise RuntimeError("Falha ao carregar dados no sistema de alocação")
+        return system
+
+    async def refresh(self):
+        """Relê as tabelas e troca o sistema de alocação em uso."""
+        async with self._refresh_lock:
+            inicio = time.perf_counter()
+            self.system = await asyncio.to_thread(self._build_system)
+            self.loaded_at = time.time()
+            logging.info(f"Índices de alocação atualizados em {time.perf_counter() - inicio:.2f}s "
+                         f"({len(self.system.hospital_ids)} hospitais, modelo {self.system.model.key}).")
+
+    # --- Atualização por LISTEN/NOTIFY ---
+
+    def _ensure_triggers(self):
+        with self.engine.begin() as conn:
+            aplicar_sql(conn, 'notificacao_alocacao.sql')
+
+    def _open_listen_connection(self):
+        raw_conn = self.engine.raw_connection()
+        raw_conn.detach()
+        conn = raw_conn.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CANAL_ALTERACOES}")
+        return conn
+
+    async def watch_changes(self):
+        """Escuta o canal de alterações e recarrega os índices; reconecta se a conexão cair."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.to_thread(self._ensure_triggers)
+                conn = await asyncio.to_thread(self._open_listen_connection)
+            except Exception as e:
+                logging.warning(f"Falha ao escutar alterações no banco: {e}. Nova tentativa em {RECONNECT_SECONDS}s.")
+                await asyncio.sleep(RECONNECT_SECONDS)
+                continue
+
+            notified = asyncio.Event()
+            lost: List[Exception] = []
+            fd = conn.fileno()
+
+            def on_readable():
+                try:
+                    conn.poll()
+                except Exception as e:
+                    # Conexão perdida: o socket continuaria "legível" para sempre
+                    lost.append(e)
+                    loop.remove_reader(fd)
+                if conn.notifies:
+                    conn.notifies.clear()
+                notified.set()
+
+            loop.add_reader(fd, on_readable)
+            try:
+                # Alterações feitas enquanto não havia LISTEN ativo não geram notificação
+                if self.system is not None:
+                    notified.set()
+                while True:
+                    await notified.wait()
+                    await asyncio.sleep(REFRESH_DEBOUNCE_SECONDS)
+                    if lost:
+                        raise lost[0]
+                    notified.clear()
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Escuta de alterações interrompida: {e}. Reconectando em {RECONNECT_SECONDS}s.")
+                await asyncio.sleep(RECONNECT_SECONDS)
+            finally:
+                loop.remove_reader(fd)
+                conn.close()
+
+    # --- Alocação ---
+
+    @staticmethod
+    def _parse_options(payload: Dict) -> Tuple[int, float]:
+        try:
+            k = int(payload.get('k', DEFAULT_TOP_K))
+            max_distance_km = float(payload.get('max_distance_km', DEFAULT_MAX_DISTANCE_KM))
+        except (TypeError, ValueError):
+            raise RequestError(400, "'k' e 'max_distance_km' devem ser numéricos")
+        if not 1 <= k <= MAX_TOP_K:
+            raise RequestError(400, f"'k' deve estar entre 1 e {MAX_TOP_K}")
+        if not 0 < max_distance_km <= MAX_DISTANCE_KM:
+            raise RequestError(400, f"'max_distance_km' deve estar entre 0 e {MAX_DISTANCE_KM}")
+        return k, max_distance_km
+
+    def _allocate_one(self, paciente, k: int, max_distance_km: float) -> Dict:
+        if not isinstance(paciente, dict):
+            raise RequestError(400, "Cada paciente deve ser um objeto JSON")
+        hospitais = self.system.find_best_hospitals(paciente, max_distance_km=max_distance_km, max_results=k)
+        return {'codigo': paciente.get('codigo'), 'hospitais': hospitais}
+
+    def allocate(self, payload) -> Dict:
+        """
+        Um paciente ({"cid_10": ..., "cod_municipio": ...}) ou um lote ({"pacientes": [...]}),
+        com 'k' e 'max_distance_km' opcionais. Retorna os k melhores hospitais de cada paciente.
+        """
+        if self.system is None:
+            raise RequestError(503, "Índices de alocação ainda não carregados")
+        if not isinstance(payload, dict):
+            raise RequestError(400, "O corpo deve ser um objeto JSON")
+        k, max_distance_km = self._parse_options(payload)
+
+        if 'pacientes' not in payload:
+            return self._allocate_one(payload, k, max_distance_km)
+        pacientes = payload['pacientes']
+        if not isinstance(pacientes, list):
+            raise RequestError(400, "'pacientes' deve ser uma lista")
+        if len(pacientes) > MAX_BATCH_SIZE:
+            raise RequestError(413, f"Lote acima do limite de {MAX_BATCH_SIZE} pacientes")
+        return {'resultados': [self._allocate_one(p, k, max_distance_km) for p in pacientes]}
+
+    def health(self) -> Dict:
+        return {
+            'status': 'ok' if self.system is not None else 'carregando',
+            'hospitais': len(self.system.hospital_ids) if self.system is not None else 0,
+            'modelo': self.system.model.key if self.system is not None else None,
+            'atualizado_em': self.loaded_at,
+        }
+
+    # --- HTTP ---
+
+    def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            if method != 'GET':
+                raise RequestError(405, "Use GET em /health")
+            return 200, self.health()
+        if path == '/allocate':
+            if method != 'POST':
+                raise RequestError(405, "Use POST em /allocate")
+            try:
+                payload = json.loads(body or b'null')
+            except ValueError:
+                raise RequestError(400, "JSON inválido")
+            return 200, self.allocate(payload)
+        raise RequestError(404, f"Rota não encontrada: {path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Laço HTTP/1.1 mínimo (com keep-alive) de uma conexão."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, path, version = lines[0].split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1'
+                              else headers.get('connection', '').lower() == 'keep-alive')
+
+                try:
+                    length = int(headers.get('content-length', '0'))
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise RequestError(413, f"Corpo acima de {MAX_BODY_BYTES} bytes")
+                    body = await reader.readexactly(length) if length > 0 else b''
+                    status, response = self.dispatch(method.upper(), path, body)
+                except RequestError as e:
+                    status, response = e.status, {'erro': str(e)}
+                except ValueError:
+                    status, response, keep_alive = 400, {'erro': "Content-Length inválido"}, False
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    logging.exception(f"Erro ao processar {method} {path}: {e}")
+                    status, response = 500, {'erro': 'Erro interno'}
+
+                data = json.dumps(response, ensure_ascii=False, default=str).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, watch: bool = True):
+        """Carrega os índices, sobe o servidor e (opcionalmente) escuta alterações no banco."""
+        while self.system is None:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.warning(f"Não foi possível carregar os índices de alocação: {e}. Nova tentativa em {RECONNECT_SECONDS}s.")
+                await asyncio.sleep(RECONNECT_SECONDS)
+
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f"Serviço de alocação ouvindo em http://{host}:{port} (POST /allocate, GET /health).")
+        watcher = asyncio.create_task(self.watch_changes()) if watch else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+def run():
+    host, port = get_service_address()
+    asyncio.run(AllocationService().serve(host, port))
@@ -0,0 +1,84 @@
+# src/pipeline/bulk_copy.py
+# Carga em massa via COPY ... FROM STDIN (psycopg2 copy_expert)
+
+import io
+import logging
+import math
+import uuid
+import numpy as np
+import pandas as pd
+
+# Marcador de nulo no CSV enviado ao COPY (distingue NULL de string vazia)
+COPY_NULL = '\\N'
+
+def _pg_array_literal(values) -> str:
+    """Converte uma lista Python no literal de array do PostgreSQL (ex.: TEXT[] -> {"a","b"})."""
+    elements = []
+    for value in values:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            elements.append('NULL')
+        else:
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+            elements.append(f'"{escaped}"')
+    return '{' + ','.join(elements) + '}'
+
+def _encode_value(value):
+    """Codifica um valor de coluna object no formato texto aceito pelo COPY."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return _pg_array_literal(value)
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 't' if value else 'f'
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, 'wkt'):
+        # Geometrias (ex.: shapely) viram WKT; a coluna GEOMETRY(Point, 4326) aplica o SRID
+        return value.wkt
+    return value
+
+def _encode_column(series: pd.Series) -> pd.Series:
+    """Prepara uma coluna inteira para o CSV do COPY, preservando nulos."""
+    if pd.api.types.is_bool_dtype(series.dtype):
+        # bool e boolean (anulável): True/False -> t/f, pd.NA -> NULL
+        return series.map({True: 't', False: 'f'}).astype(object).where(series.notna(), None)
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.dropna()
+        if not values.empty and (values % 1 == 0).all():
+            # Inteiros que viraram float por causa de NaN (ex.: 335.0) quebram colunas INT
+            return series.astype('Int64')
+        return series
+    if series.dtype == object:
+        return series.map(_encode_value)
+    return series
+
+def dataframe_to_copy_buffer(df: pd.DataFrame) -> io.StringIO:
+    """Serializa o DataFrame em CSV (sem cabeçalho) pronto para COPY ... FROM STDIN."""
+    encoded = pd.DataFrame({col: _encode_column(df[col]) for col in df.columns}, index=df.index)
+    buffer = io.StringIO()
+    encoded.to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+    return buffer
+
+def copy_dataframe(cursor, df: pd.DataFrame, table_name: str):
+    """Executa o COPY FROM STDIN do DataFrame num cursor psycopg2 (sem commit)."""
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    cursor.copy_expert(sql, dataframe_to_copy_buffer(df))
+
+def copy_dataframe_to_table(engine, df: pd.DataFrame, table_name: str):
+    """
+    Carrega o DataFrame na tabela com COPY FROM STDIN numa única transação.
+    Em caso de erro a transação é desfeita e a exceção é propagada.
+    """
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cursor:
+            copy_dataframe(cursor, df, table_name)
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+    logging.debug(f"COPY de {len(df)} registros para '{table_name}' concluído.")
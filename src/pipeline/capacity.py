@@ -0,0 +1,87 @@
+# src/pipeline/capacity.py
+# Controle de leitos disponíveis por hospital para a alocação com restrição de capacidade
+
+import random
+import numpy as np
+import pandas as pd
+from typing import Optional
+from .spatial_index import HospitalSpatialIndex
+from .utils import haversine_vectorized
+
+def parse_leitos(values) -> np.ndarray:
+    """Converte leitos_totais em inteiros; valores ausentes, inválidos ou negativos contam como 0 leitos."""
+    leitos = pd.to_numeric(pd.Series(list(values), dtype=object), errors='coerce').fillna(0).clip(lower=0)
+    return leitos.to_numpy(dtype=np.int64)
+
+class BedCapacity:
+    """
+    Contadores de leitos restantes por hospital (posição i = i-ésimo hospital da lista).
+
+    O estado é mantido entre chunks: cada paciente alocado consome um leito e um hospital
+    lotado deixa de receber pacientes até o fim da execução.
+    """
+
+    def __init__(self, leitos_totais):
+        self.total = parse_leitos(leitos_totais)
+        self.remaining = self.total.copy()
+
+    def __len__(self):
+        return len(self.total)
+
+    def _take(self, candidates: np.ndarray, count: int) -> np.ndarray:
+        """Ocupa até `count` leitos percorrendo os candidatos na ordem dada; retorna uma posição por leito."""
+        available = self.remaining[candidates]
+        already_taken = np.cumsum(available) - available
+        taken = np.clip(count - already_taken, 0, available)
+        self.remaining[candidates] -= taken
+        return np.repeat(candidates, taken)
+
+    def fill_in_order(self, candidates, count: int) -> np.ndarray:
+        """Aloca `count` pacientes nos candidatos, na ordem dada, respeitando os leitos restantes."""
+        candidates = np.asarray(candidates, dtype=np.int64)
+        if count <= 0 or not len(candidates):
+            return np.array([], dtype=np.int64)
+        return self._take(candidates, count)
+
+    def fill_nearest(self, spatial_index: HospitalSpatialIndex, lat: float, lon: float, count: int,
+                     especialidade: Optional[str] = None) -> np.ndarray:
+        """
+        Aloca `count` pacientes de um mesmo ponto nos hospitais mais próximos com leitos livres
+        (da especialidade, se informada), na ordem (distância, posição).
+
+        Primeiro tenta os k vizinhos do índice espacial; se eles não tiverem leitos suficientes
+        (hospitais próximos lotados), calcula a distância só até os hospitais com leito livre.
+        """
+        if count <= 0:
+            return np.array([], dtype=np.int64)
+        indexed = spatial_index.count(especialidade)
+        k = min(max(count, 8), indexed)
+        if k:
+            nearest, _ = spatial_index.nearest([lat], [lon], k=k, especialidade=especialidade)
+            nearest = nearest[0][nearest[0] >= 0]
+            if self.remaining[nearest].sum() >= count or k == indexed:
+                return self._take(nearest, count)
+
+        candidates = spatial_index.positions(especialidade)
+        free = candidates[self.remaining[candidates] > 0]
+        if not len(free):
+            return np.array([], dtype=np.int64)
+        distances = haversine_vectorized(lat, lon, spatial_index.latitudes[free], spatial_index.longitudes[free])
+        return self._take(free[np.lexsort((free, distances))], count)
+
+    def take_random(self, candidates) -> int:
+        """Sorteia um candidato com leito livre e ocupa o leito; -1 se todos estiverem lotados."""
+        candidates = np.asarray(candidates, dtype=np.int64)
+        free = candidates[self.remaining[candidates] > 0] if len(candidates) else candidates
+        if not len(free):
+            return -1
+        chosen = random.choice(free)
+        self.remaining[chosen] -= 1
+        return int(chosen)
+
+    def full_hospitals(self) -> int:
+        """Quantidade de hospitais com leitos cadastrados que ficaram lotados."""
+        return int(((self.total > 0) & (self.remaining == 0)).sum())
+
+    def occupied(self) -> int:
+        return int((self.total - self.remaining).sum())
@@ -0,0 +1,105 @@
+# src/pipeline/checkpoint.py
+# Checkpoints da carga em chunks: retomar a carga de pacientes do último chunk gravado
+
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, Iterator, Optional
+from sqlalchemy import text
+from .ddl import aplicar_sql
+
+# Criada por src/pipeline/sql/pipeline_estado.sql
+CHECKPOINT_TABLE = 'pipeline_estado'
+BLOCO_HASH = 1 << 20
+
+def get_load_checkpoint() -> bool:
+    """Carga de pacientes com checkpoints (LOAD_CHECKPOINT): 'on' retoma do último chunk gravado."""
+    return os.getenv('LOAD_CHECKPOINT', 'off').strip().lower() in ('on', 'true', '1', 'sim')
+
+def hash_fontes(paths: Iterable[str], chunk_size: int) -> str:
+    """Hash do conteúdo dos arquivos, na ordem, e do tamanho de chunk (as posições dependem dele)."""
+    digest = hashlib.sha256(f'chunk_size={chunk_size}'.encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            while bloco := f.read(BLOCO_HASH):
+                digest.update(bloco)
+    return digest.hexdigest()
+
+class CargaRetomavel:
+    """
+    Checkpoint de uma carga em chunks. A posição é contada em chunks da fonte (um chunk
+    transformado por chunk lido, inclusive os vazios); cada chunk gravado atualiza a linha
+    da carga em pipeline_estado na mesma transação dos dados, então a posição registrada
+    nunca passa do que de fato foi commitado.
+
+    Uma nova execução com a mesma fonte (mesmo hash) pula os `pular` primeiros chunks antes
+    da transformação: eles são lidos do arquivo, mas não são transformados, alocados nem gravados.
+    Por isso a carga não retoma com ALLOCATION_MODE=capacity: os leitos ocupados pelos pacientes
+    já gravados não entrariam na conta (load.run reinicia o checkpoint nesse modo).
+    """
+
+    def __init__(self, carga: str, fonte_hash: str):
+        self.carga = carga
+        self.fonte_hash = fonte_hash
+        # Definido pela carga antes de consumir o gerador
+        self.pular = 0
+
+    def filtrar(self, chunks: Iterator) -> Iterator:
+        """Gerador dos chunks da fonte a partir da posição `pular` (lida no primeiro next)."""
+        for posicao, chunk in enumerate(chunks):
+            if posicao >= self.pular:
+                yield chunk
+
+    def preparar(self, engine, reiniciar: bool = False) -> Optional[bool]:
+        """
+        Lê o estado salvo: True se a carga deve ser retomada (ajusta `pular`), False se deve
+        começar do zero (estado reiniciado) e None se esta fonte já foi carregada por completo.
+
+        O checkpoint só vale se a tabela da carga (de mesmo nome) ainda tem exatamente as linhas
+        registradas: um TRUNCATE ... CASCADE de uma tabela pai, por exemplo, o invalida.
+        Com `reiniciar`, o estado é descartado sem consulta.
+        """
+        with engine.begin() as conn:
+            aplicar_sql(conn, 'pipeline_estado.sql')
+            estado = conn.execute(text(f"SELECT fonte_hash, chunks_concluidos, registros_concluidos, concluida "
+                                       f"FROM {CHECKPOINT_TABLE} WHERE carga = :carga"), {'carga': self.carga}).mappings().first()
+            if not reiniciar and estado is not None and estado['fonte_hash'] == self.fonte_hash:
+                registros = conn.execute(text(f"SELECT count(*) FROM {self.carga}")).scalar()
+                if registros == estado['registros_concluidos']:
+                    if estado['concluida']:
+                        return None
+                    self.pular = estado['chunks_concluidos']
+                    return True
+                logging.warning(f"Checkpoint de '{self.carga}' registra {estado['registros_concluidos']} linhas, mas a tabela "
+                                f"tem {registros}. O checkpoint foi descartado e a carga recomeça do zero.")
+            conn.execute(text(f"""
+                INSERT INTO {CHECKPOINT_TABLE} (carga, fonte_hash) VALUES (:carga, :fonte_hash)
+                ON CONFLICT (carga) DO UPDATE SET fonte_hash = EXCLUDED.fonte_hash, chunks_concluidos = 0,
+                    registros_concluidos = 0, concluida = FALSE, atualizado_em = now()
+            """), {'carga': self.carga, 'fonte_hash': self.fonte_hash})
+        self.pular = 0
+        return False
+
+    def registrar(self, conn, chunks_concluidos: int, registros: int = 0, concluida: bool = False):
+        """Grava a posição na transação `conn` (a mesma do chunk)."""
+        conn.execute(text(f"""
+            UPDATE {CHECKPOINT_TABLE}
+            SET chunks_concluidos = :chunks, registros_concluidos = registros_concluidos + :registros,
+                concluida = :concluida, atualizado_em = now()
+            WHERE carga = :carga AND fonte_hash = :fonte_hash
+        """), {'chunks': chunks_concluidos, 'registros': registros, 'concluida': concluida,
+               'carga': self.carga, 'fonte_hash': self.fonte_hash})
+
+# Cargas retomáveis deste processo, registradas na extração e usadas na carga
+_cargas: Dict[str, CargaRetomavel] = {}
+
+def registrar_fonte(carga: str, paths: Iterable[str], chunks: Iterator, chunk_size: int) -> Iterator:
+    """Registra a fonte da carga e devolve o gerador de chunks que pula os já gravados."""
+    retomavel = CargaRetomavel(carga, hash_fontes(paths, chunk_size))
+    _cargas[carga] = retomavel
+    logging.info(f"Checkpoint ativo para '{carga}' (fonte {retomavel.fonte_hash[:12]}).")
+    return retomavel.filtrar(chunks)
+
+def get_carga_retomavel(carga: str) -> Optional[CargaRetomavel]:
+    return _cargas.get(carga)
@@ -0,0 +1,168 @@
+# src/pipeline/cid_especialidades.py
+# Tabela pré-calculada CID-10 -> especialidade, compartilhada por transform, load e alocação
+
+import hashlib
+import logging
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional
+from .especialidades import VocabularioEspecialidades
+
+# Mudar sempre que a regra abaixo mudar (invalida as tabelas em cache)
+REGRA_VERSAO = 1
+DEFAULT_CACHE_DIR = 'data/cache/cid_especialidades'
+ESPECIALIDADE_PADRAO = 'Clínica Geral'
+
+# Especialidade por capítulo (primeira letra do código)
+CID_CAPITULO_ESPECIALIDADE_MAP = {
+    'A': 'Infectologia', 'B': 'Infectologia', 'C': 'Oncologia', 'D': 'Oncologia',
+    'E': 'Endocrinologia', 'F': 'Psiquiatria', 'G': 'Neurologia', 'H': 'Oftalmologia',
+    'I': 'Cardiologia', 'J': 'Pneumologia', 'K': 'Gastroenterologia', 'L': 'Dermatologia',
+    'M': 'Ortopedia', 'N': 'Nefrologia', 'O': 'Ginecologia', 'P': 'Pediatria',
+    'Q': 'Genética Médica', 'R': 'Clínica Geral', 'S': 'Traumatologia', 'T': 'Traumatologia',
+    'U': 'Infectologia', 'V': 'Medicina de Emergência', 'W': 'Medicina de Emergência',
+    'X': 'Medicina de Emergência', 'Y': 'Medicina de Emergência', 'Z': 'Clínica Geral'
+}
+# Subfaixas com especialidade própria: (letra, início, fim) do número de dois dígitos após a letra
+CID_FAIXAS_ESPECIALIDADE = [
+    ('D', 50, 89, 'Hematologia'),           # D50-D89: Doenças do sangue
+    ('H', 60, 95, 'Otorrinolaringologia'),  # H60-H95: Doenças do ouvido
+]
+
+# Todas as especialidades possíveis, em ordem fixa: o ID de cada uma é o mesmo em qualquer processo
+ESPECIALIDADES_CID = list(dict.fromkeys([ESPECIALIDADE_PADRAO] + list(CID_CAPITULO_ESPECIALIDADE_MAP.values())
+                                        + [faixa[3] for faixa in CID_FAIXAS_ESPECIALIDADE]))
+
+def get_cache_dir() -> str:
+    """Diretório das tabelas em cache (CID_CACHE_DIR); vazio desativa o cache em disco."""
+    return os.getenv('CID_CACHE_DIR', DEFAULT_CACHE_DIR).strip()
+
+def calcular_especialidades(codigos: pd.Series) -> pd.Series:
+    """Aplica a regra CID -> especialidade a uma coluna inteira de códigos (texto), sem laço por linha."""
+    codigos = codigos.astype(str)
+    letras = codigos.str[:1].str.upper()
+    especialidades = letras.map(CID_CAPITULO_ESPECIALIDADE_MAP).fillna(ESPECIALIDADE_PADRAO)
+    digitos = codigos.str[1:3]
+    numeros = pd.to_numeric(digitos.where((codigos.str.len() >= 3) & digitos.str.isdigit()), errors='coerce')
+    for letra, inicio, fim, especialidade in CID_FAIXAS_ESPECIALIDADE:
+        especialidades[(letras == letra) & numeros.between(inicio, fim)] = especialidade
+    return especialidades
+
+class TabelaCidEspecialidade:
+    """
+    Código CID-10 -> ID da especialidade (no vocabulário fixo ESPECIALIDADES_CID).
+
+    Montada uma vez a partir dos códigos da tabela cid10 (ou da saída de read_excel_cid10) e
+    gravada em disco; depois, mapear uma coluna inteira de cid_10 é um factorize + consulta
+    por código distinto. Códigos que não estavam na tabela (CIDs criados dinamicamente) são
+    calculados na primeira vez que aparecem e passam a fazer parte dela.
+    """
+
+    def __init__(self, codigos: Iterable = ()):
+        self.vocabulario = VocabularioEspecialidades(ESPECIALIDADES_CID)
+        self.nomes_normalizados = np.array(self.vocabulario.nomes, dtype=object)
+        self.nomes = np.array(ESPECIALIDADES_CID, dtype=object)
+        self._indice_nomes = pd.Index(ESPECIALIDADES_CID)
+        self._ids: Dict[str, int] = {}
+        self.adicionar(codigos)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, codigo) -> bool:
+        return codigo in self._ids
+
+    def adicionar(self, codigos: Iterable):
+        """Inclui na tabela os códigos (texto, não vazios) que ainda não estão nela."""
+        novos = pd.Series([c for c in pd.unique(pd.Series(list(codigos), dtype=object))
+                           if isinstance(c, str) and c and c not in self._ids], dtype=object)
+        if len(novos):
+            ids = self._indice_nomes.get_indexer(calcular_especialidades(novos))
+            self._ids.update(zip(novos.tolist(), ids.tolist()))
+
+    def ids(self, cid_10: pd.Series) -> np.ndarray:
+        """ID da especialidade de cada linha (-1 onde o CID é nulo)."""
+        codes, uniques = pd.factorize(pd.Series(cid_10, copy=False))
+        uniques = [c if isinstance(c, str) else str(c) for c in uniques]
+        self.adicionar(uniques)
+        ids_distintos = np.array([self._ids.get(c, 0) if c else 0 for c in uniques] + [-1], dtype=np.int64)
+        return ids_distintos[codes]
+
+    def _mapear(self, cid_10: pd.Series, nomes: np.ndarray) -> pd.Series:
+        cid_10 = pd.Series(cid_10, copy=False)
+        ids = self.ids(cid_10)
+        resultado = np.where(ids >= 0, nomes[np.maximum(ids, 0)], None)
+        return pd.Series(resultado, index=cid_10.index, dtype=object)
+
+    def especialidades(self, cid_10: pd.Series) -> pd.Series:
+        """Especialidade (ex.: 'Cardiologia') de cada linha; None onde o CID é nulo."""
+        return self._mapear(cid_10, self.nomes)
+
+    def especialidades_normalizadas(self, cid_10: pd.Series) -> pd.Series:
+        """Especialidade normalizada (ex.: 'cardiologia') de cada linha; None onde o CID é nulo."""
+        return self._mapear(cid_10, self.nomes_normalizados)
+
+    def especialidade(self, codigo) -> str:
+        """Especialidade de um único código (consulta O(1) para códigos já conhecidos)."""
+        if not isinstance(codigo, str) or not codigo:
+            return ESPECIALIDADE_PADRAO
+        if codigo not in self._ids:
+            self.adicionar([codigo])
+        return ESPECIALIDADES_CID[self._ids[codigo]]
+
+    # --- Cache em disco ---
+
+    @staticmethod
+    def _chave(codigos: np.ndarray) -> str:
+        digest = hashlib.sha256(f'v{REGRA_VERSAO}'.encode())
+        digest.update('\n'.join(codigos.tolist()).encode('utf-8'))
+        return digest.hexdigest()[:32]
+
+    @classmethod
+    def carregar(cls, codigos: Iterable, cache_dir: Optional[str] = None) -> 'TabelaCidEspecialidade':
+        """Tabela para os códigos informados, lida do cache em disco quando já calculada."""
+        codigos = np.array(sorted({c for c in codigos if isinstance(c, str) and c}), dtype=str)
+        cache_dir = get_cache_dir() if cache_dir is None else cache_dir
+        caminho = os.path.join(cache_dir, f'{cls._chave(codigos)}.npz') if cache_dir and len(codigos) else None
+
+        if caminho and os.path.exists(caminho):
+            try:
+                with np.load(caminho, allow_pickle=False) as dados:
+                    tabela = cls()
+                    tabela._ids = dict(zip(dados['codigos'].tolist(), dados['ids'].tolist()))
+                return tabela
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Tabela CID -> especialidade em cache inválida ({e}); recalculando.")
+
+        tabela = cls(codigos)
+        if caminho:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                fd, temporario = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, codigos=codigos, ids=np.array([tabela._ids[c] for c in codigos.tolist()], dtype=np.int16))
+                os.replace(temporario, caminho)
+            except OSError as e:
+                logging.warning(f"Não foi possível gravar a tabela CID -> especialidade em '{cache_dir}': {e}")
+        return tabela
+
+# Tabela do processo, compartilhada por transform, load e PatientAllocationSystem
+_tabela_compartilhada: Optional[TabelaCidEspecialidade] = None
+
+def get_tabela_cid(codigos: Optional[Iterable] = None) -> TabelaCidEspecialidade:
+    """
+    Tabela compartilhada do processo. Na primeira chamada com `codigos` ela é carregada (do
+    cache em disco, se possível); nas seguintes, os códigos novos são acrescentados.
+    """
+    global _tabela_compartilhada
+    if _tabela_compartilhada is None:
+        _tabela_compartilhada = TabelaCidEspecialidade.carregar(codigos) if codigos is not None else TabelaCidEspecialidade()
+    elif codigos is not None:
+        _tabela_compartilhada.adicionar(codigos)
+    return _tabela_compartilhada
+
+def get_especialidade_from_cid(cid_code: str) -> str:
+    """Mapeia um código CID-10 para a especialidade médica (via tabela compartilhada)."""
+    return get_tabela_cid().especialidade(cid_code)
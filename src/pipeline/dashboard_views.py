@@ -0,0 +1,47 @@
+# src/pipeline/dashboard_views.py
+# Visões materializadas com os agregados do dashboard, recalculadas ao fim de cada carga
+
+import logging
+import time
+from sqlalchemy import text
+from .ddl import aplicar_sql
+
+# Ordem de refresh; cada visão tem um índice único (exigido pelo REFRESH ... CONCURRENTLY)
+DASHBOARD_VIEWS = [
+    'mv_dashboard_totais',
+    'mv_pacientes_por_genero',
+    'mv_pacientes_por_convenio',
+    'mv_pacientes_por_cid',
+    'mv_ocupacao_hospitais',
+    'mv_medicos_por_num_hospitais',
+]
+
+def ensure_dashboard_views(engine):
+    """Cria as visões materializadas do dashboard (src/pipeline/sql/dashboard_views.sql; idempotente)."""
+    with engine.begin() as conn:
+        aplicar_sql(conn, 'dashboard_views.sql')
+
+def refresh_dashboard_views(engine):
+    """
+    Recalcula as visões do dashboard. Com CONCURRENTLY as leituras do dashboard não ficam
+    bloqueadas durante o refresh; se ele não for possível, cai para o REFRESH comum.
+    Falhas aqui não interrompem a carga: o dashboard só fica com os agregados anteriores.
+    """
+    inicio = time.perf_counter()
+    try:
+        ensure_dashboard_views(engine)
+    except Exception as e:
+        logging.error(f"Não foi possível criar as visões do dashboard: {e}")
+        return
+    for view in DASHBOARD_VIEWS:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+        except Exception as e:
+            logging.warning(f"REFRESH CONCURRENTLY falhou para '{view}': {e}. Usando REFRESH comum.")
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"REFRESH MATERIALIZED VIEW {view}"))
+            except Exception as e:
+                logging.error(f"Erro ao atualizar a visão '{view}': {e}")
+    logging.info(f"Visões do dashboard atualizadas em {time.perf_counter() - inicio:.2f}s.")
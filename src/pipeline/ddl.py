@@ -0,0 +1,20 @@
+# src/pipeline/ddl.py
+# DDL das funções de alocação, dos checkpoints, das visões do dashboard e dos índices de busca: fonte única em src/pipeline/sql/
+
+import os
+from sqlalchemy import text
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+
+def ler_sql(nome: str) -> str:
+    """
+    Conteúdo de src/pipeline/sql/<nome>. Os mesmos arquivos rodam na criação do banco
+    (docker-entrypoint-initdb.d, ver docker-compose.yml) e são reaplicados pelo pipeline,
+    então todo comando neles precisa ser idempotente.
+    """
+    with open(os.path.join(SQL_DIR, nome), encoding='utf-8') as f:
+        return f.read()
+
+def aplicar_sql(conn, nome: str):
+    """Executa o arquivo inteiro na conexão `conn` (na transação de quem chama)."""
+    conn.execute(text(ler_sql(nome)))
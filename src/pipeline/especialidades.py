@@ -0,0 +1,106 @@
+# src/pipeline/especialidades.py
+# Vocabulário canônico de especialidades: normalização única, IDs inteiros e bitsets por hospital
+
+import functools
+import numpy as np
+from typing import Dict, Iterable, List
+
+# Mesma regra da função SQL normalizar_especialidade (src/pipeline/sql/alocacao.sql)
+_SEM_ACENTOS = str.maketrans('ãáàâéêíîóôõúûç', 'aaaaeeiiooouuc')
+BITS_POR_PALAVRA = 64
+# Especialidade dos hospitais gerais (destino dos pacientes sem localização)
+ESPECIALIDADE_GERAL = 'clinica geral'
+
+@functools.lru_cache(maxsize=4096)
+def _normalizar(especialidade: str) -> str:
+    return especialidade.lower().strip().translate(_SEM_ACENTOS)
+
+def normalizar_especialidade(especialidade: str) -> str:
+    """
+    Normaliza nomes de especialidades para facilitar comparação (minúsculas, sem acentos).
+    Memoizada: cada texto distinto é normalizado uma única vez por processo.
+    """
+    if not isinstance(especialidade, str):
+        return ""
+    return _normalizar(especialidade)
+
+def parse_especialidades(especialidades) -> list:
+    """Lista de especialidades de um hospital: aceita lista, literal de array do Postgres ('{a,b}') ou texto."""
+    if isinstance(especialidades, str):
+        if especialidades.startswith('{') and especialidades.endswith('}'):
+            # Remove chaves e aspas, divide por vírgula
+            especialidades = especialidades.strip('{}').replace('"', '').split(',')
+        else:
+            especialidades = [especialidades]
+    if isinstance(especialidades, (tuple, np.ndarray)):
+        especialidades = list(especialidades)
+    if not isinstance(especialidades, list):
+        especialidades = []
+    return especialidades
+
+def normalizar_lista(especialidades) -> List[str]:
+    """Especialidades normalizadas de um hospital, na ordem original, ignorando vazias e não-texto."""
+    return [normalizar_especialidade(e) for e in parse_especialidades(especialidades) if isinstance(e, str) and e.strip()]
+
+class VocabularioEspecialidades:
+    """
+    Interna cada especialidade normalizada num ID inteiro pequeno (0, 1, 2, ... na ordem em que
+    aparecem) e representa o conjunto de especialidades de cada hospital como um bitset:
+    uma matriz uint64 (hospitais x palavras), com o bit `id` ligado se o hospital atende a
+    especialidade. Testar "o hospital tem a especialidade X" vira um AND bit a bit, para
+    todos os hospitais de uma vez.
+
+    Os IDs só valem dentro do vocabulário que os gerou; bitsets e vocabulário andam juntos.
+    """
+
+    def __init__(self, especialidades: Iterable[str] = ()):
+        self._ids: Dict[str, int] = {}
+        self.nomes: List[str] = []
+        for especialidade in especialidades:
+            self.intern(especialidade)
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def __contains__(self, especialidade) -> bool:
+        return self.id(especialidade) >= 0
+
+    def intern(self, especialidade) -> int:
+        """ID da especialidade (normalizada), criando-o se for nova; -1 para vazia."""
+        normalizada = normalizar_especialidade(especialidade)
+        if not normalizada:
+            return -1
+        especialidade_id = self._ids.get(normalizada)
+        if especialidade_id is None:
+            especialidade_id = self._ids[normalizada] = len(self.nomes)
+            self.nomes.append(normalizada)
+        return especialidade_id
+
+    def id(self, especialidade) -> int:
+        """ID de uma especialidade já conhecida (-1 se vazia ou desconhecida), sem criar novos."""
+        return self._ids.get(normalizar_especialidade(especialidade), -1)
+
+    @property
+    def palavras(self) -> int:
+        return max(1, -(-len(self.nomes) // BITS_POR_PALAVRA))
+
+    def bitsets(self, listas: Iterable) -> np.ndarray:
+        """Bitset (uint64, hospitais x palavras) de cada lista de especialidades, internando as novas."""
+        ids_por_hospital = [[self.intern(e) for e in normalizar_lista(lista)] for lista in listas]
+        bits = np.zeros((len(ids_por_hospital), self.palavras), dtype=np.uint64)
+        linhas = np.repeat(np.arange(len(ids_por_hospital)), [len(ids) for ids in ids_por_hospital])
+        ids = np.array([i for ids in ids_por_hospital for i in ids], dtype=np.int64)
+        np.bitwise_or.at(bits, (linhas, ids // BITS_POR_PALAVRA),
+                         np.left_shift(np.uint64(1), (ids % BITS_POR_PALAVRA).astype(np.uint64)))
+        return bits
+
+    def contem(self, bitsets: np.ndarray, especialidade) -> np.ndarray:
+        """Máscara booleana dos hospitais (linhas do bitset) que têm a especialidade."""
+        return tem_especialidade(bitsets, self.id(especialidade))
+
+def tem_especialidade(bitsets: np.ndarray, especialidade_id: int) -> np.ndarray:
+    """Máscara booleana das linhas do bitset com o bit `especialidade_id` ligado (False para ID -1)."""
+    palavra, bit = divmod(especialidade_id, BITS_POR_PALAVRA)
+    if especialidade_id < 0 or palavra >= bitsets.shape[1]:
+        return np.zeros(bitsets.shape[0], dtype=bool)
+    return (bitsets[:, palavra] & np.uint64(1 << bit)) != 0
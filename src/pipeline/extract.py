@@ -2,10 +2,38 @@ import logging
 import pandas as pd
 from typing import Dict, Iterator
 from ingestion import converter
-from .extract_utils import read_excel_cid10
+from .extract_utils import read_excel_cid10, ChunkChain
+from .checkpoint import get_load_checkpoint, registrar_fonte
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 import json
 import os
 
+# Entidades consumidas em streaming pelo transform: múltiplos arquivos são encadeados, não concatenados
+STREAMING_ENTITIES = converter.STREAMING_ENTITIES
+
+def get_extract_workers() -> int:
+    """Número de processos para a extração (EXTRACT_WORKERS). 1 = serial; 0 ou negativo = todos os núcleos."""
+    try:
+        workers = int(os.getenv('EXTRACT_WORKERS', '1'))
+    except ValueError:
+        logging.warning("EXTRACT_WORKERS inválido. Usando extração serial.")
+        return 1
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def ingest_file(entity_type: str, path: str) -> pd.DataFrame | Iterator:
+    """Lê um único arquivo. Função de módulo para poder ser executada em outro processo."""
+    if entity_type == 'cid10':
+        return read_excel_cid10(path)
+    return converter.run(path, entity_type)
+
+def is_streaming_source(entity_type: str, path: str) -> bool:
+    """Fontes que o conversor devolve como gerador: não podem ir para o pool de processos."""
+    try:
+        return entity_type != 'cid10' and converter.returns_stream(path, entity_type)
+    except ValueError:
+        return False
+
 def run() -> Dict:
     """
     Orquestra a extração de dados. Opera em dois modos:
@@ -47,29 +75,55 @@ def run() -> Dict:
         ]
 
     # --- Lógica de processamento (comum aos dois modos) ---
-    dataframes: Dict[str, pd.DataFrame | Iterator] = {}
+    existing_files = []
     for entity_type, path in files_to_process:
         if not os.path.exists(path):
             logging.warning(f"Arquivo '{path}' não encontrado. Pulando.")
             continue
-            
-        logging.info(f"Ingerindo dados para '{entity_type}' do arquivo '{path}'...")
-        try:
-            if entity_type == 'cid10':
-                df_or_iter = read_excel_cid10(path)
-            else:
-                df_or_iter = converter.run(path, entity_type)
+        existing_files.append((entity_type, path))
 
-            if entity_type in dataframes:
-                current_data = dataframes[entity_type]
-                new_data = df_or_iter
-                if isinstance(current_data, Iterator): current_data = pd.concat(list(current_data), ignore_index=True)
-                if isinstance(new_data, Iterator): new_data = pd.concat(list(new_data), ignore_index=True)
-                dataframes[entity_type] = pd.concat([current_data, new_data], ignore_index=True)
-            else:
-                dataframes[entity_type] = df_or_iter
-        except Exception as e:
-            logging.error(f"Falha ao ingerir o arquivo '{path}': {e}", exc_info=True)
+    # Modo paralelo: os arquivos que geram DataFrames são lidos num pool de processos.
+    # Geradores (XML em streaming) continuam no processo principal, pois são preguiçosos.
+    workers = min(get_extract_workers(), len(existing_files))
+    if workers > 1:
+        logging.info(f"Extração paralela com {workers} processos.")
+
+    dataframes: Dict[str, pd.DataFrame | Iterator] = {}
+    with (ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()) as pool:
+        futures = [pool.submit(ingest_file, entity_type, path) if pool and not is_streaming_source(entity_type, path) else None
+                   for entity_type, path in existing_files]
+
+        # A junção segue sempre a ordem da lista de arquivos, independentemente de qual termina primeiro
+        for (entity_type, path), future in zip(existing_files, futures):
+            merge_into(dataframes, entity_type, path, future)
+
+    # Com checkpoints, a carga de pacientes pode retomar do último chunk gravado desta mesma fonte
+    if get_load_checkpoint() and isinstance(dataframes.get('pacientes'), Iterator):
+        fontes = [path for entity_type, path in existing_files if entity_type == 'pacientes']
+        dataframes['pacientes'] = registrar_fonte('pacientes', fontes, dataframes['pacientes'], converter.DEFAULT_CHUNK_SIZE)
     
     logging.info("Etapa de extração concluída.")
-    return dataframes
\ No newline at end of file
+    return dataframes
+
+def merge_into(dataframes: Dict, entity_type: str, path: str, future=None):
+    """Lê (ou aguarda a leitura de) um arquivo e o junta aos dados já extraídos da mesma entidade."""
+    logging.info(f"Ingerindo dados para '{entity_type}' do arquivo '{path}'...")
+    try:
+        df_or_iter = future.result() if future is not None else ingest_file(entity_type, path)
+
+        current_data = dataframes.get(entity_type)
+        streaming = isinstance(current_data, Iterator) or isinstance(df_or_iter, Iterator)
+        if entity_type in dataframes and entity_type in STREAMING_ENTITIES and streaming:
+            # Encadeia as fontes sem materializar: o pico de memória continua limitado a um chunk
+            chain = current_data if isinstance(current_data, ChunkChain) else ChunkChain(current_data)
+            chain.append(df_or_iter)
+            dataframes[entity_type] = chain
+        elif entity_type in dataframes:
+            new_data = df_or_iter
+            if isinstance(current_data, Iterator): current_data = pd.concat(list(current_data), ignore_index=True)
+            if isinstance(new_data, Iterator): new_data = pd.concat(list(new_data), ignore_index=True)
+            dataframes[entity_type] = pd.concat([current_data, new_data], ignore_index=True)
+        else:
+            dataframes[entity_type] = df_or_iter
+    except Exception as e:
+        logging.error(f"Falha ao ingerir o arquivo '{path}': {e}", exc_info=True)
@@ -1,6 +1,40 @@
 import pandas as pd
 import logging
 import re
+from collections import deque
+from typing import Iterator
+
+class ChunkChain(Iterator[pd.DataFrame]):
+    """
+    Iterador preguiçoso que encadeia várias fontes de uma mesma entidade, na ordem em que
+    foram adicionadas. Cada fonte pode ser um DataFrame (entregue como um único chunk) ou
+    um gerador de chunks; nenhuma fonte é materializada antes de ser consumida.
+    """
+
+    def __init__(self, *sources):
+        self._sources = deque()
+        self._current = None
+        for source in sources:
+            self.append(source)
+
+    def append(self, source):
+        """Adiciona uma fonte ao final da cadeia."""
+        self._sources.append(source)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> pd.DataFrame:
+        while True:
+            if self._current is None:
+                if not self._sources:
+                    raise StopIteration
+                source = self._sources.popleft()
+                self._current = iter([source]) if isinstance(source, pd.DataFrame) else iter(source)
+            try:
+                return next(self._current)
+            except StopIteration:
+                self._current = None
 
 def read_excel_cid10(filepath: str) -> pd.DataFrame:
     # ... (cole aqui a função read_excel_cid10 completa do seu extract.py original)
@@ -0,0 +1,80 @@
+# src/pipeline/incremental.py
+# Carga incremental: staging em tabela temporária + INSERT ... ON CONFLICT DO UPDATE
+
+import logging
+import pandas as pd
+from typing import Dict
+from .bulk_copy import copy_dataframe
+
+# Chave de conflito (PRIMARY KEY) de cada tabela que aceita carga incremental
+UPSERT_KEYS = {
+    'estados': 'codigo_uf',
+    'municipios': 'codigo_ibge',
+    'cid10': 'codigo',
+    'hospitais': 'codigo',
+    'medicos': 'codigo',
+}
+
+def _quote(column: str) -> str:
+    return f'"{column}"'
+
+def build_upsert_sql(table_name: str, stage_name: str, columns: list, key_column: str) -> str:
+    """
+    Monta o INSERT ... SELECT da tabela de staging com ON CONFLICT na chave.
+
+    Só atualiza linhas cujo hash de conteúdo (md5 da linha com as colunas carregadas)
+    difere do registro atual; RETURNING (xmax = 0) distingue inserções de atualizações.
+    """
+    column_list = ', '.join(_quote(c) for c in columns)
+    update_columns = [c for c in columns if c != key_column]
+    if not update_columns:
+        conflict_action = "DO NOTHING"
+    else:
+        assignments = ', '.join(f"{_quote(c)} = EXCLUDED.{_quote(c)}" for c in update_columns)
+        current_hash = f"md5(ROW({', '.join(f't.{_quote(c)}' for c in update_columns)})::text)"
+        new_hash = f"md5(ROW({', '.join(f'EXCLUDED.{_quote(c)}' for c in update_columns)})::text)"
+        conflict_action = f"DO UPDATE SET {assignments} WHERE {current_hash} IS DISTINCT FROM {new_hash}"
+    return f"""
+        INSERT INTO {table_name} AS t ({column_list})
+        SELECT {column_list} FROM {stage_name}
+        ON CONFLICT ({_quote(key_column)}) {conflict_action}
+        RETURNING (xmax = 0) AS inserido
+    """
+
+def upsert_dataframe(engine, df: pd.DataFrame, table_name: str, key_column: str = None) -> Dict[str, int]:
+    """
+    Carrega o DataFrame de forma incremental, sem TRUNCATE.
+
+    As linhas são copiadas (COPY) para uma tabela temporária com a mesma estrutura da
+    tabela de destino e aplicadas com um único INSERT ... ON CONFLICT, tudo na mesma
+    transação. Retorna as contagens de registros inseridos, atualizados e inalterados.
+    """
+    key_column = key_column or UPSERT_KEYS[table_name]
+    if df.empty:
+        return {'inseridos': 0, 'atualizados': 0, 'inalterados': 0}
+
+    # Chaves repetidas no mesmo upload: prevalece a última ocorrência
+    df = df.drop_duplicates(subset=[key_column], keep='last')
+    stage_name = f"stage_{table_name}"
+    columns = list(df.columns)
+
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {stage_name} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+            copy_dataframe(cursor, df, stage_name)
+            cursor.execute(build_upsert_sql(table_name, stage_name, columns, key_column))
+            results = [row[0] for row in cursor.fetchall()]
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    inseridos = sum(1 for inserido in results if inserido)
+    atualizados = len(results) - inseridos
+    counts = {'inseridos': inseridos, 'atualizados': atualizados, 'inalterados': len(df) - len(results)}
+    logging.info(f"Carga incremental de '{table_name}': {counts['inseridos']} inseridos, "
+                 f"{counts['atualizados']} atualizados, {counts['inalterados']} inalterados.")
+    return counts
@@ -4,10 +4,19 @@
 import logging
 import pandas as pd
 from sqlalchemy import create_engine, text
-from typing import Iterator, Dict
+from typing import Iterator, Dict, Optional
 import os
-import math # <-- IMPORTAÇÃO NECESSÁRIA ADICIONADA AQUI
-from .utils import haversine_distance
+import time
+from .medico_matcher import MedicoHospitalMatcher
+from .especialidades import normalizar_especialidade
+from .cid_especialidades import get_tabela_cid
+from .checkpoint import CargaRetomavel, get_carga_retomavel
+from .ddl import aplicar_sql
+from .dashboard_views import refresh_dashboard_views
+from .bulk_copy import copy_dataframe, copy_dataframe_to_table
+from .incremental import UPSERT_KEYS, upsert_dataframe
+from .sql_allocation import get_allocation_engine, ensure_sql_functions, alocar_medicos_postgis, inserir_pacientes_postgis
+from .transform import get_allocation_mode
 
 # --- Funções de Configuração e Auxiliares ---
 
@@ -23,57 +32,134 @@ def clear_table(engine, table_name: str):
         logging.info(f"Tabela '{table_name}' limpa com sucesso.")
     except Exception as e: logging.warning(f"Erro ao limpar tabela '{table_name}': {e}")
 
+def get_load_method() -> str:
+    """Método de gravação: 'copy' (COPY FROM STDIN, padrão) ou 'insert' (to_sql com INSERT multi-linha)."""
+    return os.getenv('LOAD_METHOD', 'copy').strip().lower()
+
+def get_load_mode() -> str:
+    """Modo de carga: 'full' (TRUNCATE + recarga, padrão) ou 'incremental' (upsert por hash de conteúdo)."""
+    return os.getenv('LOAD_MODE', 'full').strip().lower()
+
+def ensure_search_indexes(engine):
+    """
+    Extensão pg_trgm e índices da busca do frontend (src/pipeline/sql/busca.sql; idempotente).
+    Falhas não interrompem a carga: sem pg_trgm o frontend cai para ILIKE sem índice.
+    """
+    try:
+        with engine.begin() as conn:
+            aplicar_sql(conn, 'busca.sql')
+    except Exception as e:
+        logging.error(f"Não foi possível criar os índices de busca (pg_trgm): {e}")
+
+def write_dataframe(engine, df: pd.DataFrame, table_name: str):
+    """Grava o DataFrame com o método configurado; se o COPY falhar, refaz com to_sql."""
+    if get_load_method() == 'copy':
+        try:
+            copy_dataframe_to_table(engine, df, table_name)
+            return
+        except Exception as e:
+            logging.warning(f"COPY falhou para '{table_name}': {e}. Usando to_sql como fallback.")
+    df.to_sql(table_name, engine, if_exists='append', index=False, method='multi')
+
+def write_dataframe_in_transaction(conn, df: pd.DataFrame, table_name: str):
+    """
+    Como write_dataframe, mas dentro de uma transação já aberta (conexão SQLAlchemy).
+    O COPY roda num SAVEPOINT: se falhar, só ele é desfeito e o to_sql segue na mesma transação.
+    """
+    if get_load_method() == 'copy':
+        try:
+            with conn.begin_nested():
+                with conn.connection.cursor() as cursor:
+                    copy_dataframe(cursor, df, table_name)
+            return
+        except Exception as e:
+            logging.warning(f"COPY falhou para '{table_name}': {e}. Usando to_sql como fallback.")
+    df.to_sql(table_name, conn, if_exists='append', index=False, method='multi')
+
+def prepare_array_columns(df: pd.DataFrame, array_columns: list = None) -> pd.DataFrame:
+    if not array_columns: return df
+    df_copy = df.copy()
+    for col in array_columns:
+        if col in df_copy.columns: df_copy[col] = df_copy[col].apply(lambda x: x if isinstance(x, list) else [])
+    return df_copy
+
 def load_dataframe_to_table(engine, df: pd.DataFrame, table_name: str, array_columns: list = None):
     if df.empty: return
     try:
-        if array_columns:
-            df_copy = df.copy()
-            for col in array_columns:
-                if col in df_copy.columns: df_copy[col] = df_copy[col].apply(lambda x: x if isinstance(x, list) else [])
-            df = df_copy
-        df.to_sql(table_name, engine, if_exists='append', index=False, method='multi')
+        df = prepare_array_columns(df, array_columns)
+        write_dataframe(engine, df, table_name)
         logging.info(f"Tabela '{table_name}' carregada com {len(df)} registros.")
     except Exception as e: logging.error(f"Erro ao carregar a tabela '{table_name}': {e}"); raise
 
-def get_especialidade_from_cid(codigo: str) -> str:
-    if not isinstance(codigo, str) or not codigo: return "Clínica Geral"
-    letra = codigo[0]
-    CID_CAPITULO_ESPECIALIDADE_MAP = {
-        'A': 'Infectologia', 'B': 'Infectologia', 'C': 'Oncologia', 'D00-D48': 'Oncologia', 
-        'D50-D89': 'Hematologia', 'E': 'Endocrinologia', 'F': 'Psiquiatria', 'G': 'Neurologia', 
-        'H00-H59': 'Oftalmologia', 'H60-H95': 'Otorrinolaringologia', 'I': 'Cardiologia', 
-        'J': 'Pneumologia', 'K': 'Gastroenterologia', 'L': 'Dermatologia', 'M': 'Ortopedia', 
-        'N': 'Nefrologia', 'O': 'Ginecologia', 'P': 'Pediatria', 'Q': 'Genética Médica'
-    }
-    if letra == 'D' and len(codigo) > 2:
-        try: num = int(codigo[1:3]); return 'Hematologia' if 50 <= num <= 89 else 'Oncologia'
-        except ValueError: pass
-    if letra == 'H' and len(codigo) > 2:
-        try: num = int(codigo[1:3]); return 'Oftalmologia' if 0 <= num <= 59 else 'Otorrinolaringologia'
-        except ValueError: pass
-    return CID_CAPITULO_ESPECIALIDADE_MAP.get(letra, "Clínica Geral")
+# --- Funções de Carga Especializadas ---
 
+# CIDs novos de um chunk num único comando; ON CONFLICT torna a criação idempotente
+SQL_INSERIR_CIDS = """
+    INSERT INTO cid10 (codigo, descricao, especialidade)
+    SELECT * FROM unnest(CAST(:codigos AS TEXT[]), CAST(:descricoes AS TEXT[]), CAST(:especialidades AS TEXT[]))
+    ON CONFLICT (codigo) DO NOTHING
+"""
 
-# --- Funções de Carga Especializadas ---
+def write_pacientes_chunk(engine, chunk: pd.DataFrame, novos_cids: Optional[pd.DataFrame], alocar_no_banco: bool,
+                          checkpoint: Optional[CargaRetomavel] = None, posicao: int = 0) -> int:
+    """
+    Grava os CIDs novos (se houver) e o chunk de pacientes numa única transação: se a carga do
+    chunk falhar, os CIDs criados para ele também são desfeitos. Com checkpoint, a posição
+    (chunks da fonte já consumidos) é gravada na mesma transação. Retorna quantos CIDs foram criados.
+    """
+    with engine.begin() as conn:
+        criados = 0
+        if novos_cids is not None and not novos_cids.empty:
+            criados = conn.execute(text(SQL_INSERIR_CIDS), {
+                'codigos': novos_cids['codigo'].tolist(),
+                'descricoes': novos_cids['descricao'].tolist(),
+                'especialidades': novos_cids['especialidade'].tolist(),
+            }).rowcount
+        if alocar_no_banco:
+            with conn.connection.cursor() as cursor:
+                inserir_pacientes_postgis(cursor, chunk)
+        else:
+            write_dataframe_in_transaction(conn, chunk, 'pacientes')
+        if checkpoint is not None:
+            checkpoint.registrar(conn, posicao, len(chunk))
+    return criados
 
-def load_pacientes_with_dynamic_cids(engine, data_generator: Iterator[pd.DataFrame]):
+def load_pacientes_with_dynamic_cids(engine, data_generator: Iterator[pd.DataFrame], checkpoint: Optional[CargaRetomavel] = None):
     cids_in_db = set(pd.read_sql("SELECT codigo FROM cid10", engine)['codigo'])
+    tabela_cid = get_tabela_cid(cids_in_db)
     chunk_num = 0
+    # Com o motor PostGIS, o hospital é escolhido no próprio INSERT ... SELECT de cada chunk
+    alocar_no_banco = get_allocation_engine() == 'postgis'
+    if alocar_no_banco:
+        ensure_sql_functions(engine)
+        logging.info("Pacientes serão alocados no banco (PostGIS) durante a carga.")
+    inicio = time.perf_counter()
+    # Posição na fonte (chunks consumidos, inclusive vazios); no checkpoint, os pulados já contam
+    posicao = checkpoint.pular if checkpoint is not None else 0
     try:
         for chunk in data_generator:
+            posicao += 1
             if chunk.empty: continue
             chunk_num += 1
             cids_in_chunk = set(chunk['cid_10'].dropna().unique())
             new_cids_to_create = cids_in_chunk - cids_in_db
+            new_cids_df = None
             if new_cids_to_create:
-                logging.warning(f"Novos CIDs detectados: {new_cids_to_create}. Criando-os no banco de dados.")
-                new_cid_records = [{'codigo': code, 'descricao': f'CID (código {code}) - Criado Automaticamente', 'especialidade': get_especialidade_from_cid(code)} for code in new_cids_to_create]
-                new_cids_df = pd.DataFrame(new_cid_records)
-                new_cids_df.to_sql('cid10', engine, if_exists='append', index=False, method='multi')
-                cids_in_db.update(new_cids_to_create)
+                logging.warning(f"Novos CIDs detectados: {new_cids_to_create}. Criando-os junto com o chunk {chunk_num}.")
+                novos = pd.Series(sorted(new_cids_to_create), dtype=object)
+                new_cids_df = pd.DataFrame({'codigo': novos, 'descricao': 'CID (código ' + novos + ') - Criado Automaticamente',
+                                            'especialidade': tabela_cid.especialidades(novos)})
             logging.info(f"Carregando chunk {chunk_num} de pacientes ({len(chunk)} registros)...")
-            chunk.to_sql('pacientes', engine, if_exists='append', index=False, method='multi')
-        logging.info("Carga em streaming para 'pacientes' concluída.")
+            criados = write_pacientes_chunk(engine, chunk, new_cids_df, alocar_no_banco, checkpoint, posicao)
+            if new_cids_to_create:
+                # Menos que o detectado: outro processo criou o código antes (ON CONFLICT DO NOTHING)
+                logging.info(f"{criados} de {len(new_cids_to_create)} CIDs novos inseridos em cid10 com o chunk {chunk_num}.")
+            # Só depois do commit: um chunk que falhou não deixa CIDs para trás
+            cids_in_db.update(new_cids_to_create)
+        if checkpoint is not None:
+            with engine.begin() as conn:
+                checkpoint.registrar(conn, posicao, concluida=True)
+        logging.info(f"Carga em streaming para 'pacientes' concluída em {time.perf_counter() - inicio:.2f}s.")
     except Exception as e: logging.error(f"Erro na carga em chunks para 'pacientes': {e}"); raise
 
 def alocar_e_carregar_medicos(engine):
@@ -107,156 +193,50 @@ def alocar_e_carregar_medicos(engine):
         logging.warning("Não há médicos ou hospitais suficientes para fazer a alocação. Pulando esta etapa.")
         return
     
-    # Normalizar especialidades
-    def normalizar_especialidade(espec):
-        """Normaliza nomes de especialidades para matching mais flexível"""
-        if not isinstance(espec, str):
-            return ""
-        return espec.strip().lower().replace('ã', 'a').replace('í', 'i').replace('ó', 'o')
-    
-    # Aplicar normalização
-    medicos_df['especialidade_norm'] = medicos_df['especialidade'].apply(normalizar_especialidade)
-    
-    # Pré-processar especialidades dos hospitais
-    hospitais_processados = []
-    for _, hospital in hospitais_df.iterrows():
-        esp_list = hospital['especialidades']
-        if isinstance(esp_list, str):
-            # Se veio como string, converte para lista
-            esp_list = esp_list.strip('{}').replace('"', '').split(',')
-        elif not isinstance(esp_list, list):
-            esp_list = []
-        
-        # Normalizar cada especialidade
-        esp_norm = [normalizar_especialidade(e) for e in esp_list if e and e.strip()]
-        
-        hospital_dict = hospital.to_dict()
-        hospital_dict['especialidades_norm'] = esp_norm
-        hospitais_processados.append(hospital_dict)
-    
-    logging.info(f"Processadas especialidades para {len(hospitais_processados)} hospitais")
-    
-    # Criar mapeamento por município para busca eficiente
-    hospitais_por_municipio = {}
-    for hospital in hospitais_processados:
-        municipio_id = hospital['municipio_id']
-        if municipio_id not in hospitais_por_municipio:
-            hospitais_por_municipio[municipio_id] = []
-        hospitais_por_municipio[municipio_id].append(hospital)
-    
-    associacoes = []
-    medicos_sem_alocacao = 0
-    
-    for _, medico in medicos_df.iterrows():
-        medico_id = medico['codigo']
-        medico_espec_norm = medico['especialidade_norm']
-        medico_municipio_id = medico['municipio_id']
-        medico_lat = medico['latitude']
-        medico_lon = medico['longitude']
-        
-        if not medico_espec_norm:
-            medicos_sem_alocacao += 1
-            continue
-
-        candidatos = []
-        
-        # ETAPA 1: Busca no mesmo município com especialidade compatível
-        hospitais_locais = hospitais_por_municipio.get(medico_municipio_id, [])
-        for hospital in hospitais_locais:
-            if medico_espec_norm in hospital['especialidades_norm']:
-                distancia = haversine_distance(medico_lat, medico_lon, 
-                                             hospital['latitude'], hospital['longitude'])
-                candidatos.append({
-                    'hospital_id': hospital['codigo'], 
-                    'distancia': distancia,
-                    'prioridade': 1  # Mesma cidade + especialidade = prioridade máxima
-                })
-
-        # ETAPA 2: Se não encontrou, busca no mesmo município sem filtro de especialidade
-        if len(candidatos) < 3:
-            for hospital in hospitais_locais:
-                if hospital['codigo'] not in [c['hospital_id'] for c in candidatos]:
-                    distancia = haversine_distance(medico_lat, medico_lon, 
-                                                 hospital['latitude'], hospital['longitude'])
-                    candidatos.append({
-                        'hospital_id': hospital['codigo'], 
-                        'distancia': distancia,
-                        'prioridade': 2  # Mesma cidade = prioridade média
-                    })
-
-        # ETAPA 3: Busca em municípios próximos (até 30km) com especialidade compatível
-        if len(candidatos) < 3:
-            for hospital in hospitais_processados:
-                if (hospital['municipio_id'] != medico_municipio_id and 
-                    hospital['codigo'] not in [c['hospital_id'] for c in candidatos]):
-                    
-                    distancia = haversine_distance(medico_lat, medico_lon, 
-                                                 hospital['latitude'], hospital['longitude'])
-                    
-                    if distancia <= 30:  # Apenas hospitais próximos
-                        if medico_espec_norm in hospital['especialidades_norm']:
-                            candidatos.append({
-                                'hospital_id': hospital['codigo'], 
-                                'distancia': distancia,
-                                'prioridade': 3  # Próximo + especialidade = prioridade baixa
-                            })
-
-        # ETAPA 4: Se ainda não tem 3, busca próximos sem filtro de especialidade
-        if len(candidatos) < 3:
-            for hospital in hospitais_processados:
-                if (hospital['municipio_id'] != medico_municipio_id and 
-                    hospital['codigo'] not in [c['hospital_id'] for c in candidatos]):
-                    
-                    distancia = haversine_distance(medico_lat, medico_lon, 
-                                                 hospital['latitude'], hospital['longitude'])
-                    
-                    if distancia <= 30:  # Apenas hospitais próximos
-                        candidatos.append({
-                            'hospital_id': hospital['codigo'], 
-                            'distancia': distancia,
-                            'prioridade': 4  # Próximo = prioridade mínima
-                        })
-
-        # SELEÇÃO FINAL: Ordena por prioridade e depois por distância
-        if candidatos:
-            # Ordenar por prioridade (menor = melhor) e depois por distância
-            candidatos.sort(key=lambda x: (x['prioridade'], x['distancia']))
-            
-            # Seleciona até 3 melhores candidatos
-            for candidato in candidatos[:3]:
-                associacoes.append({
-                    'medico_id': medico_id, 
-                    'hospital_id': candidato['hospital_id']
-                })
-        else:
-            medicos_sem_alocacao += 1
+    # Normalização canônica (a mesma da alocação de pacientes); os hospitais são internados no matcher
+    medicos_df['especialidade_norm'] = medicos_df['especialidade'].map(normalizar_especialidade)
 
-    logging.info(f"Criadas {len(associacoes)} associações médico-hospital")
+    # Índices por município/especialidade e espacial, montados uma vez para todos os médicos
+    matcher = MedicoHospitalMatcher(hospitais_df)
+    logging.info(f"Processadas especialidades para {len(hospitais_df)} hospitais ({len(matcher.vocabulario)} especialidades distintas)")
+    associacoes_df = matcher.match(medicos_df)
+    medicos_com_alocacao = associacoes_df['medico_id'].nunique()
+    medicos_sem_alocacao = len(medicos_df) - medicos_com_alocacao
+
+    logging.info(f"Criadas {len(associacoes_df)} associações médico-hospital")
     logging.info(f"{medicos_sem_alocacao} médicos não puderam ser alocados")
 
-    if not associacoes:
+    if associacoes_df.empty:
         logging.warning("Nenhuma associação médico-hospital pôde ser criada.")
         return
 
     # Salvar associações
-    associacoes_df = pd.DataFrame(associacoes)
     clear_table(engine, 'medico_hospital_associacao')
     load_dataframe_to_table(engine, associacoes_df, 'medico_hospital_associacao')
     
     # Log de estatísticas finais
-    medicos_com_alocacao = len(set(a['medico_id'] for a in associacoes))
-    hospitais_com_medicos = len(set(a['hospital_id'] for a in associacoes))
+    hospitais_com_medicos = associacoes_df['hospital_id'].nunique()
     
     logging.info(f"Estatísticas finais:")
     logging.info(f"- {medicos_com_alocacao} médicos alocados (de {len(medicos_df)} elegíveis)")
     logging.info(f"- {hospitais_com_medicos} hospitais receberam médicos")
-    logging.info(f"- {len(associacoes)} associações totais criadas")
+    logging.info(f"- {len(associacoes_df)} associações totais criadas")
 
 # --- Função Principal de Carga ---
 
+# Tabelas cujo TRUNCATE ... CASCADE também esvazia pacientes (chaves estrangeiras diretas ou via municipios)
+PACIENTES_TABELAS_PAI = {'estados', 'municipios', 'cid10', 'hospitais'}
+
 def run(dataframes: Dict[str, pd.DataFrame | Iterator]):
     logging.info("Iniciando a etapa de carga inteligente e segura...")
     engine = get_database_engine()
+    ensure_search_indexes(engine)
+    incremental = get_load_mode() == 'incremental'
+    if incremental:
+        logging.info("MODO INCREMENTAL: tabelas cadastrais serão atualizadas via upsert, sem TRUNCATE.")
+    tabelas_alteradas = set()
+    # Tabelas esvaziadas nesta execução (o TRUNCATE ... CASCADE dos pais também esvazia pacientes)
+    tabelas_truncadas = set()
 
     # A ordem de carga é crucial e deve ser mantida
     load_order = ['estados', 'municipios', 'cid10', 'hospitais', 'medicos']
@@ -274,13 +254,22 @@ def run(dataframes: Dict[str, pd.DataFrame | Iterator]):
             elif isinstance(data, Iterator):
                 is_valid_data = True
 
-            if is_valid_data:
+            array_cols = ['especialidades'] if table_name == 'hospitais' else []
+            if is_valid_data and incremental and isinstance(data, pd.DataFrame) and table_name in UPSERT_KEYS:
+                logging.info(f"Novos dados para '{table_name}' detectados. Iniciando carga incremental...")
+                try:
+                    contagens = upsert_dataframe(engine, prepare_array_columns(data, array_cols), table_name)
+                except Exception as e: logging.error(f"Erro na carga incremental da tabela '{table_name}': {e}"); raise
+                if contagens['inseridos'] or contagens['atualizados']:
+                    tabelas_alteradas.add(table_name)
+            elif is_valid_data:
                 logging.info(f"Novos dados para '{table_name}' detectados. Iniciando recarga...")
                 clear_table(engine, table_name)
+                tabelas_alteradas.add(table_name)
+                tabelas_truncadas.add(table_name)
                 
                 # A lógica de carga original é mantida
                 if isinstance(data, pd.DataFrame):
-                    array_cols = ['especialidades'] if table_name == 'hospitais' else []
                     load_dataframe_to_table(engine, data, table_name, array_cols)
             else:
                 logging.warning(f"Dados para '{table_name}' fornecidos, mas estão vazios. Nenhuma ação será tomada.")
@@ -291,20 +280,50 @@ def run(dataframes: Dict[str, pd.DataFrame | Iterator]):
     # Usa a sua função customizada, mas apenas se dados de pacientes foram enviados
     if 'pacientes' in dataframes:
         logging.info("Novos dados para 'pacientes' detectados. Iniciando recarga com criação dinâmica de CIDs...")
-        clear_table(engine, 'pacientes')
         pacientes_generator = dataframes.get('pacientes')
+        checkpoint = get_carga_retomavel('pacientes')
+        # Se um pai de pacientes foi truncado, a tabela já foi esvaziada pelo CASCADE: o checkpoint não vale mais
+        pais_truncados = tabelas_truncadas & PACIENTES_TABELAS_PAI
+        if checkpoint is not None and pais_truncados:
+            logging.info(f"Tabelas {sorted(pais_truncados)} foram recarregadas; o checkpoint de pacientes será reiniciado.")
+        # Com limite de leitos, a transformação parte de todos os leitos livres: retomar deixaria os pacientes
+        # já gravados fora da conta e lotaria hospitais além de leitos_totais. A carga recomeça do zero.
+        capacidade = get_allocation_mode() == 'capacity' and get_allocation_engine() != 'postgis'
+        if checkpoint is not None and capacidade:
+            logging.info("ALLOCATION_MODE=capacity: os leitos são contados desde o primeiro paciente; o checkpoint de pacientes será reiniciado.")
+        retomar = checkpoint.preparar(engine, reiniciar=bool(pais_truncados) or capacidade) if checkpoint is not None else False
+        if retomar is None:
+            logging.info("Esta fonte de pacientes já foi carregada por completo (checkpoint). A tabela será preservada.")
+            pacientes_generator = None
+        elif retomar:
+            logging.warning(f"Retomando a carga de pacientes após o chunk {checkpoint.pular} (checkpoint); sem TRUNCATE.")
+        else:
+            clear_table(engine, 'pacientes')
         if pacientes_generator:
             # Sua função original é chamada aqui, preservando a funcionalidade
-            load_pacientes_with_dynamic_cids(engine, pacientes_generator)
+            load_pacientes_with_dynamic_cids(engine, pacientes_generator, checkpoint)
 
     # --- Tratamento Inteligente para Alocação de Médicos ---
     # A realocação só é necessária se os dados que a influenciam (médicos, hospitais, municípios) mudaram.
-    if 'medicos' in dataframes or 'hospitais' in dataframes or 'municipios' in dataframes:
+    # No modo incremental, "mudaram" significa que o upsert inseriu ou atualizou alguma linha.
+    tabelas_alocacao = {'medicos', 'hospitais', 'municipios'}
+    if incremental:
+        precisa_realocar = bool(tabelas_alocacao & tabelas_alteradas)
+    else:
+        precisa_realocar = any(t in dataframes for t in tabelas_alocacao)
+    if precisa_realocar:
         logging.info("Alterações em médicos, hospitais ou municípios detectadas. Executando a realocação de médicos...")
-        # Sua função original é chamada aqui, preservando a funcionalidade
-        alocar_e_carregar_medicos(engine)
+        inicio = time.perf_counter()
+        if get_allocation_engine() == 'postgis':
+            alocar_medicos_postgis(engine)
+        else:
+            # Sua função original é chamada aqui, preservando a funcionalidade
+            alocar_e_carregar_medicos(engine)
+        logging.info(f"Alocação de médicos ({get_allocation_engine()}) concluída em {time.perf_counter() - inicio:.2f}s.")
     else:
         logging.info("Nenhuma alteração em médicos, hospitais ou municípios. A alocação de médicos existente será preservada.")
-    
+
+    # Agregados do dashboard: recalculados uma vez por carga, em vez de a cada acesso ao painel
+    refresh_dashboard_views(engine)
     engine.dispose()
     logging.info("Etapa de carga concluída.")
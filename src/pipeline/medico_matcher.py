@@ -0,0 +1,104 @@
+# src/pipeline/medico_matcher.py
+# Associação médico -> hospitais (até 3 por médico) com índices e operações em array
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+from .spatial_index import HospitalSpatialIndex
+from .utils import haversine_vectorized
+from .especialidades import VocabularioEspecialidades, tem_especialidade
+
+# Raio das etapas 3 e 4 (municípios vizinhos)
+RAIO_VIZINHANCA_KM = 30
+MAX_HOSPITAIS_POR_MEDICO = 3
+
+class MedicoHospitalMatcher:
+    """
+    Escolhe até 3 hospitais por médico, com as quatro prioridades da alocação original:
+    1. Mesmo município, com a especialidade do médico.
+    2. Mesmo município, sem filtro de especialidade.
+    3. Outro município a até 30 km, com a especialidade (só se ainda faltarem candidatos).
+    4. Outro município a até 30 km, sem filtro de especialidade (idem).
+    Dentro de cada prioridade vale a menor distância; empates ficam com a ordem dos hospitais.
+
+    Os hospitais são indexados uma única vez por município, com as especialidades num bitset
+    do vocabulário canônico (o filtro por especialidade é um teste de bit), e as etapas 3 e 4
+    consultam o índice espacial. Como as coordenadas do médico são as do
+    seu município, o resultado depende só de (município, especialidade normalizada): cada par
+    distinto é resolvido uma vez e o resultado vale para todos os médicos do grupo.
+    """
+
+    def __init__(self, hospitais_df: pd.DataFrame):
+        self.codigos = hospitais_df['codigo'].to_numpy(dtype=object)
+        self.municipios = hospitais_df['municipio_id'].to_numpy()
+        self.latitudes = pd.to_numeric(hospitais_df['latitude'], errors='coerce').to_numpy(dtype=float)
+        self.longitudes = pd.to_numeric(hospitais_df['longitude'], errors='coerce').to_numpy(dtype=float)
+        self.vocabulario = VocabularioEspecialidades()
+        self.especialidade_bits = self.vocabulario.bitsets(hospitais_df['especialidades'])
+
+        # Buckets: município -> posições, na ordem original
+        por_municipio: Dict[object, List[int]] = {}
+        for pos, municipio_id in enumerate(self.municipios):
+            por_municipio.setdefault(municipio_id, []).append(pos)
+        self.por_municipio = {k: np.array(v, dtype=np.int64) for k, v in por_municipio.items()}
+
+        por_especialidade = {spec: np.flatnonzero(tem_especialidade(self.especialidade_bits, spec_id))
+                             for spec_id, spec in enumerate(self.vocabulario.nomes)}
+        self.indice_espacial = HospitalSpatialIndex(self.latitudes, self.longitudes, por_especialidade)
+        # Vizinhos sem filtro de especialidade (etapa 4) dependem só do município: uma consulta por município
+        self._vizinhos_por_municipio: Dict[object, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _vizinhos(self, lat: float, lon: float, municipio_id, especialidade=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Hospitais de outros municípios a até 30 km, ordenados por (distância, posição)."""
+        posicoes, distancias = self.indice_espacial.query_radius(lat, lon, RAIO_VIZINHANCA_KM, especialidade=especialidade)
+        outros = self.municipios[posicoes] != municipio_id
+        return posicoes[outros], distancias[outros]
+
+    def _top_hospitais(self, municipio_id, especialidade: str, lat: float, lon: float) -> np.ndarray:
+        """Posições dos até 3 melhores hospitais para um par (município, especialidade)."""
+        locais = self.por_municipio.get(municipio_id, np.array([], dtype=np.int64))
+        com_especialidade = tem_especialidade(self.especialidade_bits[locais], self.vocabulario.id(especialidade))
+
+        posicoes = [locais]
+        distancias = [haversine_vectorized(lat, lon, self.latitudes[locais], self.longitudes[locais])]
+        prioridades = [np.where(com_especialidade, 1, 2)]
+
+        total = len(locais)
+        if total < MAX_HOSPITAIS_POR_MEDICO:
+            pos3, dist3 = self._vizinhos(lat, lon, municipio_id, especialidade)
+            posicoes.append(pos3); distancias.append(dist3); prioridades.append(np.full(len(pos3), 3))
+            total += len(pos3)
+            if total < MAX_HOSPITAIS_POR_MEDICO:
+                if municipio_id not in self._vizinhos_por_municipio:
+                    self._vizinhos_por_municipio[municipio_id] = self._vizinhos(lat, lon, municipio_id)
+                pos4, dist4 = self._vizinhos_por_municipio[municipio_id]
+                novos = ~np.isin(pos4, pos3)
+                posicoes.append(pos4[novos]); distancias.append(dist4[novos]); prioridades.append(np.full(int(novos.sum()), 4))
+
+        posicoes = np.concatenate(posicoes)
+        distancias = np.concatenate(distancias)
+        prioridades = np.concatenate(prioridades)
+        # Ordenação por (prioridade, distância); empates mantêm a ordem de inclusão dos candidatos
+        ordem = np.lexsort((np.arange(len(posicoes)), distancias, prioridades))
+        return posicoes[ordem[:MAX_HOSPITAIS_POR_MEDICO]]
+
+    def match(self, medicos_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Recebe os médicos (codigo, especialidade_norm, municipio_id, latitude, longitude) e
+        retorna as associações (medico_id, hospital_id), na ordem dos médicos e do ranking.
+        Médicos sem especialidade normalizada ficam sem associação.
+        """
+        medicos = medicos_df[medicos_df['especialidade_norm'].fillna('') != '']
+        grupos = medicos.drop_duplicates(subset=['municipio_id', 'especialidade_norm'])
+
+        hospitais_por_grupo = {}
+        for municipio_id, especialidade, lat, lon in zip(grupos['municipio_id'], grupos['especialidade_norm'],
+                                                         grupos['latitude'], grupos['longitude']):
+            hospitais_por_grupo[(municipio_id, especialidade)] = list(self.codigos[self._top_hospitais(municipio_id, especialidade, lat, lon)])
+
+        chaves = zip(medicos['municipio_id'], medicos['especialidade_norm'])
+        associacoes = pd.DataFrame({
+            'medico_id': medicos['codigo'].to_numpy(),
+            'hospital_id': [hospitais_por_grupo[chave] for chave in chaves],
+        }).explode('hospital_id')
+        return associacoes.dropna(subset=['hospital_id']).reset_index(drop=True)
@@ -0,0 +1,95 @@
+# src/pipeline/municipio_lookup.py
+# Tabela de consulta de municípios: código IBGE -> (latitude, longitude, UF)
+
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+
+class MunicipioLookup:
+    """
+    Índice imutável dos municípios, montado uma vez por execução.
+
+    Os códigos IBGE ficam ordenados num array NumPy, com latitude, longitude e UF em
+    arrays paralelos. Consultas de um único código usam um dicionário (O(1)); consultas
+    de um chunk inteiro usam np.searchsorted, sem varrer o DataFrame de municípios.
+    Códigos repetidos mantêm a primeira ocorrência, como o filtro por máscara original.
+    """
+
+    def __init__(self, municipios_df: Optional[pd.DataFrame]):
+        if municipios_df is None or municipios_df.empty or 'codigo_ibge' not in municipios_df.columns:
+            municipios_df = pd.DataFrame(columns=['codigo_ibge'])
+
+        df = municipios_df.copy()
+        df['codigo_ibge'] = pd.to_numeric(df['codigo_ibge'], errors='coerce')
+        df = df.dropna(subset=['codigo_ibge']).drop_duplicates(subset=['codigo_ibge'])
+        df = df.sort_values('codigo_ibge', kind='stable')
+
+        self.codes = df['codigo_ibge'].to_numpy(dtype=np.int64)
+        self.latitudes = self._float_column(df, 'latitude')
+        self.longitudes = self._float_column(df, 'longitude')
+        self.ufs = (pd.to_numeric(df['codigo_uf'], errors='coerce').astype('Int64').to_numpy(dtype=object, na_value=None)
+                    if 'codigo_uf' in df.columns else np.full(len(df), None, dtype=object))
+        self._finish()
+
+    @classmethod
+    def from_arrays(cls, codes: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray,
+                    ufs: np.ndarray) -> 'MunicipioLookup':
+        """Recria o índice a partir de arrays já ordenados por código (ex.: modelo persistido em disco)."""
+        lookup = cls.__new__(cls)
+        lookup.codes, lookup.latitudes, lookup.longitudes, lookup.ufs = codes, latitudes, longitudes, ufs
+        lookup._finish()
+        return lookup
+
+    def _finish(self):
+        for array in (self.codes, self.latitudes, self.longitudes, self.ufs):
+            if array.flags.writeable:
+                array.flags.writeable = False
+        self._positions = {int(code): pos for pos, code in enumerate(self.codes.tolist())}
+
+    @staticmethod
+    def _float_column(df: pd.DataFrame, column: str) -> np.ndarray:
+        if column not in df.columns:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, codigo_ibge) -> bool:
+        return self.position(codigo_ibge) >= 0
+
+    def position(self, codigo_ibge) -> int:
+        """Posição do município nos arrays (-1 se o código não existir)."""
+        try:
+            return self._positions.get(codigo_ibge, -1)
+        except TypeError:
+            return -1
+
+    def get(self, codigo_ibge) -> Optional[Tuple[float, float, Optional[int]]]:
+        """(latitude, longitude, codigo_uf) de um município, ou None se não houver coordenadas."""
+        pos = self.position(codigo_ibge)
+        if pos < 0 or np.isnan(self.latitudes[pos]) or np.isnan(self.longitudes[pos]):
+            return None
+        return float(self.latitudes[pos]), float(self.longitudes[pos]), self.ufs[pos]
+
+    def positions(self, codigos) -> np.ndarray:
+        """Consulta em lote: posição de cada código (-1 para nulos ou códigos desconhecidos)."""
+        values = pd.to_numeric(pd.Series(codigos, copy=False), errors='coerce').to_numpy(dtype=float)
+        result = np.full(len(values), -1, dtype=np.int64)
+        valid = ~np.isnan(values) & (values % 1 == 0)
+        if not valid.any() or not len(self.codes):
+            return result
+        wanted = values[valid].astype(np.int64)
+        found = np.minimum(np.searchsorted(self.codes, wanted), len(self.codes) - 1)
+        result[valid] = np.where(self.codes[found] == wanted, found, -1)
+        return result
+
+    def coordinates(self, codigos) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Consulta em lote: (posições, latitudes, longitudes), com NaN onde não há coordenadas."""
+        pos = self.positions(codigos)
+        found = pos >= 0
+        lat = np.full(len(pos), np.nan)
+        lon = np.full(len(pos), np.nan)
+        lat[found] = self.latitudes[pos[found]]
+        lon[found] = self.longitudes[pos[found]]
+        return pos, lat, lon
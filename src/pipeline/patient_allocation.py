@@ -6,6 +6,10 @@ import pandas as pd
 import numpy as np
 from typing import Dict, List, Tuple, Optional
 import math
+from .capacity import BedCapacity
+from .especialidades import normalizar_especialidade, tem_especialidade
+from .cid_especialidades import get_especialidade_from_cid, get_tabela_cid
+from .allocation_model import AllocationModel, load_allocation_model
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
@@ -32,112 +36,41 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     
     return R * c
 
-def get_especialidade_from_cid(cid_code: str) -> str:
-    """
-    Mapeia códigos CID-10 para especialidades médicas
-    """
-    if not isinstance(cid_code, str) or not cid_code:
-        return "Clínica Geral"
-    
-    # Pega a primeira letra do CID
-    letra = cid_code[0].upper()
-    
-    # Mapeamento CID-10 para especialidades
-    cid_especialidades = {
-        'A': 'Infectologia',      # A00-B99: Doenças infecciosas
-        'B': 'Infectologia',
-        'C': 'Oncologia',         # C00-D48: Neoplasias
-        'D': 'Oncologia',         # D00-D48: Neoplasias / D50-D89: Sangue
-        'E': 'Endocrinologia',    # E00-E90: Endócrinas, nutricionais
-        'F': 'Psiquiatria',       # F00-F99: Transtornos mentais
-        'G': 'Neurologia',        # G00-G99: Sistema nervoso
-        'H': 'Oftalmologia',      # H00-H59: Olho / H60-H95: Ouvido
-        'I': 'Cardiologia',       # I00-I99: Sistema circulatório
-        'J': 'Pneumologia',       # J00-J99: Sistema respiratório
-        'K': 'Gastroenterologia', # K00-K93: Sistema digestivo
-        'L': 'Dermatologia',      # L00-L99: Pele e tecido subcutâneo
-        'M': 'Ortopedia',         # M00-M99: Sistema osteomuscular
-        'N': 'Nefrologia',        # N00-N99: Sistema geniturinário
-        'O': 'Ginecologia',       # O00-O99: Gravidez, parto
-        'P': 'Pediatria',         # P00-P96: Período perinatal
-        'Q': 'Genética Médica',   # Q00-Q99: Malformações congênitas
-        'R': 'Clínica Geral',     # R00-R99: Sintomas não classificados
-        'S': 'Traumatologia',     # S00-T98: Lesões e traumatismos
-        'T': 'Traumatologia',
-        'V': 'Medicina de Emergência', # V01-Y98: Causas externas
-        'W': 'Medicina de Emergência',
-        'X': 'Medicina de Emergência',
-        'Y': 'Medicina de Emergência',
-        'Z': 'Clínica Geral'      # Z00-Z99: Contatos com serviços
-    }
-    
-    # Casos especiais para subcategorias do D e H
-    if letra == 'D' and len(cid_code) >= 3:
-        try:
-            numero = int(cid_code[1:3])
-            if 50 <= numero <= 89:
-                return 'Hematologia'  # Doenças do sangue
-        except ValueError:
-            pass
-    
-    if letra == 'H' and len(cid_code) >= 3:
-        try:
-            numero = int(cid_code[1:3])
-            if 60 <= numero <= 95:
-                return 'Otorrinolaringologia'  # Doenças do ouvido
-        except ValueError:
-            pass
-    
-    return cid_especialidades.get(letra, 'Clínica Geral')
-
-def normalizar_especialidade(especialidade: str) -> str:
-    """
-    Normaliza nomes de especialidades para facilitar comparação
-    """
-    if not isinstance(especialidade, str):
-        return ""
-    
-    # Converte para minúsculas e remove acentos básicos
-    normalized = especialidade.lower().strip()
-    replacements = {
-        'ã': 'a', 'á': 'a', 'à': 'a', 'â': 'a',
-        'é': 'e', 'ê': 'e',
-        'í': 'i', 'î': 'i',
-        'ó': 'o', 'ô': 'o', 'õ': 'o',
-        'ú': 'u', 'û': 'u',
-        'ç': 'c'
-    }
-    
-    for old, new in replacements.items():
-        normalized = normalized.replace(old, new)
-    
-    return normalized
-
 class PatientAllocationSystem:
     """
     Sistema inteligente de alocação de pacientes a hospitais
+
+    Com respect_capacity=True, leitos_totais é uma restrição rígida: cada paciente vai para o
+    melhor candidato que ainda tem leito livre, e os leitos ocupados continuam contando nos
+    lotes seguintes. Pacientes com candidatos, mas todos lotados, saem com sem_leito=True.
     """
     
-    def __init__(self):
+    def __init__(self, respect_capacity: bool = False):
         self.hospitais_df = None
         self.municipios_df = None
         self.pacientes_df = None
-        self.hospital_especialidades_map = {}
-        self.hospital_coordinates_map = {}
+        self.model = None
+        self.hospital_ids = []
+        self.spatial_index = None
+        self.municipio_lookup = None
+        self.respect_capacity = respect_capacity
+        self.capacity = None
+        self.hospital_positions = {}
+        self._hospital_especialidades_map = None
+        self._hospital_coordinates_map = None
         
-    def load_data(self, hospitais_df: pd.DataFrame, municipios_df: pd.DataFrame) -> bool:
+    def load_data(self, hospitais_df: pd.DataFrame, municipios_df: pd.DataFrame,
+                  model: Optional[AllocationModel] = None) -> bool:
         """
         Carrega dados de hospitais e municípios
+
+        O pré-processamento (especialidades, coordenadas e índice espacial) vem do modelo
+        persistido para essas tabelas (ver allocation_model), calculado só na primeira vez.
         """
         try:
             self.hospitais_df = hospitais_df.copy()
             self.municipios_df = municipios_df.copy()
-            
-            # Preprocessar especialidades dos hospitais
-            self._preprocess_hospital_specialties()
-            
-            # Preprocessar coordenadas
-            self._preprocess_coordinates()
+            self.use_model(model or load_allocation_model(self.hospitais_df, self.municipios_df))
             
             logging.info(f"Sistema carregado com {len(self.hospitais_df)} hospitais e {len(self.municipios_df)} municípios")
             return True
@@ -146,56 +79,52 @@ class PatientAllocationSystem:
             logging.error(f"Erro ao carregar dados: {e}")
             return False
     
-    def _preprocess_hospital_specialties(self):
+    def use_model(self, model: AllocationModel) -> 'PatientAllocationSystem':
         """
-        Preprocessa as especialidades dos hospitais para facilitar busca
+        Usa um modelo já pré-processado (ex.: AllocationModel.open(caminho) para simulações
+        interativas, sem os DataFrames). Os leitos, se respect_capacity, começam todos livres.
         """
-        for _, hospital in self.hospitais_df.iterrows():
-            hospital_id = hospital['codigo']
-            especialidades = hospital.get('especialidades', [])
-            
-            # Converte string para lista se necessário
-            if isinstance(especialidades, str):
-                if especialidades.startswith('{') and especialidades.endswith('}'):
-                    # Remove chaves e aspas, divide por vírgula
-                    especialidades = especialidades.strip('{}').replace('"', '').split(',')
-                else:
-                    especialidades = [especialidades]
-            
-            if not isinstance(especialidades, list):
-                especialidades = []
-            
-            # Normaliza especialidades
-            normalized_specs = [normalizar_especialidade(spec) for spec in especialidades if spec and spec.strip()]
-            
-            self.hospital_especialidades_map[hospital_id] = {
-                'original': especialidades,
-                'normalized': normalized_specs,
-                'municipio_id': hospital.get('municipio_id')
-            }
+        self.model = model
+        self.hospital_ids = model.hospital_ids
+        self.spatial_index = model.spatial_index
+        self.municipio_lookup = model.municipio_lookup
+        self._hospital_especialidades_map = None
+        self._hospital_coordinates_map = None
+        if self.respect_capacity:
+            self.hospital_positions = {h_id: pos for pos, h_id in enumerate(self.hospital_ids)}
+            self.capacity = BedCapacity(model.leitos_totais)
+        return self
     
-    def _preprocess_coordinates(self):
-        """
-        Preprocessa coordenadas dos hospitais baseado nos municípios
-        """
-        # Merge hospitais com coordenadas dos municípios
-        hospitais_coords = pd.merge(
-            self.hospitais_df,
-            self.municipios_df[['codigo_ibge', 'latitude', 'longitude']],
-            left_on='municipio_id',
-            right_on='codigo_ibge',
-            how='left'
-        )
-        
-        for _, row in hospitais_coords.iterrows():
-            hospital_id = row['codigo']
-            self.hospital_coordinates_map[hospital_id] = {
-                'latitude': row.get('latitude'),
-                'longitude': row.get('longitude'),
-                'municipio_id': row.get('municipio_id')
-            }
+    @property
+    def hospital_especialidades_map(self) -> Dict:
+        """Especialidades por hospital (montado sob demanda a partir do modelo)."""
+        if self._hospital_especialidades_map is None:
+            self._hospital_especialidades_map = {
+                h_id: {
+                    'original': self.model.especialidades_originais[pos],
+                    'normalized': self.model.especialidades_normalizadas(pos),
+                    'municipio_id': self.model.municipio_id(pos),
+                    'leitos_totais': int(self.model.leitos_totais[pos])
+                }
+                for pos, h_id in enumerate(self.hospital_ids)
+            } if self.model is not None else {}
+        return self._hospital_especialidades_map
+    
+    @property
+    def hospital_coordinates_map(self) -> Dict:
+        """Coordenadas por hospital (montado sob demanda a partir do modelo)."""
+        if self._hospital_coordinates_map is None:
+            self._hospital_coordinates_map = {
+                h_id: {
+                    'latitude': float(self.spatial_index.latitudes[pos]),
+                    'longitude': float(self.spatial_index.longitudes[pos]),
+                    'municipio_id': self.model.municipio_id(pos)
+                }
+                for pos, h_id in enumerate(self.hospital_ids)
+            } if self.model is not None else {}
+        return self._hospital_coordinates_map
     
-    def find_best_hospitals(self, patient_data: Dict, max_distance_km: float = 50, max_results: int = 3) -> List[Dict]:
+    def find_best_hospitals(self, patient_data: Dict, max_distance_km: float = 50, max_results: Optional[int] = 3) -> List[Dict]:
         """
         Encontra os melhores hospitais para um paciente baseado em:
         1. Especialidade compatível com CID-10
@@ -223,24 +152,20 @@ class PatientAllocationSystem:
         
         candidates = []
         
-        # Analisa cada hospital
-        for hospital_id, hospital_data in self.hospital_especialidades_map.items():
-            hospital_coords = self.hospital_coordinates_map.get(hospital_id)
-            
-            if not hospital_coords or pd.isna(hospital_coords['latitude']):
-                continue
-            
-            # Calcula distância
-            distance = haversine_distance(
-                patient_coords['latitude'], patient_coords['longitude'],
-                hospital_coords['latitude'], hospital_coords['longitude']
-            )
-            
-            if distance > max_distance_km:
-                continue
-            
-            # Verifica especialidade
-            has_specialty = required_specialty_norm in hospital_data['normalized']
+        # Hospitais dentro do raio máximo (consulta ao índice espacial)
+        positions, distances = self.spatial_index.query_radius(
+            patient_coords['latitude'], patient_coords['longitude'], max_distance_km
+        )
+        
+        # Analisa cada hospital próximo, na ordem original (mantém o desempate da ordenação)
+        order = np.argsort(positions)
+        positions, distances = positions[order], distances[order]
+        specialty_flags = tem_especialidade(self.model.especialidade_bits[positions], self.model.vocabulario.id(required_specialty_norm))
+        for position, distance, has_specialty in zip(positions, distances, specialty_flags):
+            hospital_id = self.hospital_ids[position]
+            hospital_municipio = self.model.municipio_id(position)
+            distance = float(distance)
+            has_specialty = bool(has_specialty)
             
             # Prioridade baseada em especialidade e distância
             if has_specialty:
@@ -251,7 +176,7 @@ class PatientAllocationSystem:
                 score = 500 - distance   # Penalização por não ter especialidade
             
             # Bonus se for no mesmo município
-            if hospital_data['municipio_id'] == patient_municipio:
+            if hospital_municipio == patient_municipio:
                 score += 100
             
             candidates.append({
@@ -261,7 +186,7 @@ class PatientAllocationSystem:
                 'required_specialty': required_specialty,
                 'priority': priority,
                 'score': score,
-                'municipio_id': hospital_data['municipio_id']
+                'municipio_id': hospital_municipio
             })
         
         # Ordena por prioridade (especialidade) e depois por score (distância)
@@ -270,24 +195,27 @@ class PatientAllocationSystem:
         # Retorna os melhores candidatos
         return candidates[:max_results]
     
+    def _reserve_first_with_beds(self, candidates: List[Dict]) -> List[Dict]:
+        """Ocupa um leito no primeiro candidato com vaga; retorna a lista a partir dele (vazia se todos lotados)."""
+        for i, candidate in enumerate(candidates):
+            position = self.hospital_positions[candidate['hospital_id']]
+            if self.capacity.remaining[position] > 0:
+                self.capacity.remaining[position] -= 1
+                return candidates[i:]
+        return []
+    
     def _get_patient_coordinates(self, municipio_id) -> Optional[Dict]:
         """
         Busca coordenadas do município do paciente
         """
         if pd.isna(municipio_id):
             return None
-            
-        municipio_data = self.municipios_df[self.municipios_df['codigo_ibge'] == municipio_id]
         
-        if municipio_data.empty:
-            return None
-        
-        row = municipio_data.iloc[0]
-        lat, lon = row.get('latitude'), row.get('longitude')
-        
-        if pd.isna(lat) or pd.isna(lon):
+        coords = self.municipio_lookup.get(municipio_id)
+        if coords is None:
             return None
         
+        lat, lon, _ = coords
         return {'latitude': lat, 'longitude': lon}
     
     def allocate_patients_batch(self, pacientes_df: pd.DataFrame) -> pd.DataFrame:
@@ -298,11 +226,22 @@ class PatientAllocationSystem:
         
         logging.info(f"Iniciando alocação para {len(pacientes_df)} pacientes")
         
+        # Registra de uma vez (vetorizado) os CIDs do lote na tabela CID -> especialidade
+        if 'cid_10' in pacientes_df.columns:
+            get_tabela_cid(pacientes_df['cid_10'])
+        
         for idx, patient in pacientes_df.iterrows():
             patient_data = patient.to_dict()
+            sem_leito = False
             
             # Busca melhores hospitais
-            best_hospitals = self.find_best_hospitals(patient_data)
+            if self.capacity is not None:
+                # Todos os candidatos do raio, em ordem; fica o primeiro que ainda tem leito livre
+                candidates = self.find_best_hospitals(patient_data, max_results=None)
+                best_hospitals = self._reserve_first_with_beds(candidates)
+                sem_leito = bool(candidates) and not best_hospitals
+            else:
+                best_hospitals = self.find_best_hospitals(patient_data)
             
             if best_hospitals:
                 # Aloca no melhor hospital disponível
@@ -337,6 +276,8 @@ class PatientAllocationSystem:
                     'same_municipio': False
                 }
             
+            if self.capacity is not None:
+                result['sem_leito'] = sem_leito
             results.append(result)
         
         results_df = pd.DataFrame(results)
@@ -350,13 +291,19 @@ class PatientAllocationSystem:
         logging.info(f"- {allocated_count}/{len(results_df)} pacientes alocados ({allocated_count/len(results_df)*100:.1f}%)")
         logging.info(f"- {with_specialty_count} alocações com especialidade compatível ({with_specialty_count/allocated_count*100:.1f}%)" if allocated_count > 0 else "")
         logging.info(f"- {same_city_count} alocações no mesmo município ({same_city_count/allocated_count*100:.1f}%)" if allocated_count > 0 else "")
+        if self.capacity is not None:
+            overflow_count = int(results_df['sem_leito'].sum())
+            if overflow_count:
+                logging.warning(f"- {overflow_count} pacientes excedentes: todos os hospitais candidatos estão lotados")
+            logging.info(f"- {self.capacity.occupied()} leitos ocupados, {self.capacity.full_hospitals()} hospitais lotados (acumulado)")
         
         return results_df
 
 # Função de uso simplificado
 def allocate_patients_to_hospitals(pacientes_df: pd.DataFrame, 
                                  hospitais_df: pd.DataFrame, 
-                                 municipios_df: pd.DataFrame) -> pd.DataFrame:
+                                 municipios_df: pd.DataFrame,
+                                 respect_capacity: bool = False) -> pd.DataFrame:
     """
     Função principal para alocar pacientes a hospitais
     
@@ -364,13 +311,14 @@ def allocate_patients_to_hospitals(pacientes_df: pd.DataFrame,
     - pacientes_df: DataFrame com dados dos pacientes (deve ter: codigo, nome_completo, cid_10, cod_municipio)
     - hospitais_df: DataFrame com dados dos hospitais (deve ter: codigo, especialidades, municipio_id)
     - municipios_df: DataFrame com municípios (deve ter: codigo_ibge, latitude, longitude)
+    - respect_capacity: se True, usa leitos_totais dos hospitais como limite de pacientes
     
     Retorna:
     - DataFrame com resultados da alocação
     """
     
     # Inicializa o sistema
-    allocation_system = PatientAllocationSystem()
+    allocation_system = PatientAllocationSystem(respect_capacity)
     
     # Carrega dados
     if not allocation_system.load_data(hospitais_df, municipios_df):
@@ -0,0 +1,245 @@
+# src/pipeline/spatial_index.py
+# Índice espacial em grade (lat/lon) para consultas de hospitais próximos
+
+import math
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from .utils import haversine_vectorized
+
+EARTH_RADIUS_KM = 6371
+# Tamanho da célula da grade em graus (~55 km no equador)
+DEFAULT_CELL_SIZE_DEG = 0.5
+# Máximo de consultas por bloco da matriz de distâncias (limita a memória)
+QUERY_BLOCK_SIZE = 512
+
+# Arrays de cada grade, na ordem usada por to_arrays()/from_arrays()
+_GRID_POINT_ARRAYS = ('positions', 'sorted_positions')
+_GRID_CELL_ARRAYS = ('starts', 'ends', 'cell_i', 'cell_j')
+
+class _GridBuckets:
+    """Agrupa as posições de um conjunto de pontos por célula da grade."""
+
+    def __init__(self, positions: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray, cell_size_deg: float):
+        cell_i = np.floor(latitudes[positions] / cell_size_deg).astype(np.int64)
+        cell_j = np.floor(longitudes[positions] / cell_size_deg).astype(np.int64)
+        order = np.lexsort((positions, cell_j, cell_i))
+        self.positions = positions[order]
+        self.sorted_positions = np.sort(positions)
+        cell_i, cell_j = cell_i[order], cell_j[order]
+
+        # Uma entrada por célula ocupada: (i, j) e o intervalo [início, fim) em self.positions
+        boundaries = np.flatnonzero((np.diff(cell_i) != 0) | (np.diff(cell_j) != 0)) + 1
+        self.starts = np.concatenate(([0], boundaries)) if len(order) else np.array([], dtype=np.int64)
+        self.ends = np.concatenate((boundaries, [len(order)])) if len(order) else np.array([], dtype=np.int64)
+        self.cell_i = cell_i[self.starts]
+        self.cell_j = cell_j[self.starts]
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> '_GridBuckets':
+        """Recria a grade a partir de arrays já calculados (podem ser memory-mapped)."""
+        grid = cls.__new__(cls)
+        for name in _GRID_POINT_ARRAYS + _GRID_CELL_ARRAYS:
+            setattr(grid, name, arrays[name])
+        return grid
+
+    def __len__(self):
+        return len(self.positions)
+
+    def in_cells(self, i_min: int, i_max: int, j_min: int, j_max: int) -> np.ndarray:
+        """Posições (em ordem crescente) de todos os pontos das células no intervalo."""
+        selected = np.flatnonzero((self.cell_i >= i_min) & (self.cell_i <= i_max) &
+                                  (self.cell_j >= j_min) & (self.cell_j <= j_max))
+        if len(selected) == len(self.starts):
+            return self.sorted_positions
+        if not len(selected):
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate([self.positions[self.starts[c]:self.ends[c]] for c in selected]))
+
+class HospitalSpatialIndex:
+    """
+    Índice espacial em grade para consultas de k vizinhos mais próximos e por raio.
+
+    Os pontos são distribuídos em células de cell_size_deg graus; cada consulta examina
+    apenas as células que intersectam a caixa envolvente do raio de busca e calcula a
+    distância haversine exata só para esses pontos. Há uma grade por especialidade
+    normalizada, de modo que o filtro por especialidade não percorre hospitais de outras.
+
+    Os resultados vêm ordenados por (distância, posição), reproduzindo o desempate das
+    varreduras lineares originais (primeiro hospital da lista em caso de empate).
+    """
+
+    def __init__(self, latitudes, longitudes,
+                 especialidades: Optional[Union[List[Iterable[str]], Dict[str, np.ndarray]]] = None,
+                 cell_size_deg: float = DEFAULT_CELL_SIZE_DEG):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_size_deg = cell_size_deg
+        self.cell_size_km = math.radians(cell_size_deg) * EARTH_RADIUS_KM
+
+        valid = ~np.isnan(self.latitudes) & ~np.isnan(self.longitudes)
+        valid_positions = np.flatnonzero(valid)
+        self._grids: Dict[Optional[str], _GridBuckets] = {None: self._build_grid(valid_positions)}
+
+        if isinstance(especialidades, dict):
+            # Já agrupado: especialidade -> posições dos hospitais que a atendem
+            for spec, positions in especialidades.items():
+                positions = np.asarray(positions, dtype=np.int64)
+                positions = positions[valid[positions]]
+                if len(positions):
+                    self._grids[spec] = self._build_grid(positions)
+        elif especialidades is not None:
+            positions_by_spec: Dict[str, List[int]] = {}
+            for pos in valid_positions:
+                for spec in set(especialidades[pos]):
+                    positions_by_spec.setdefault(spec, []).append(pos)
+            for spec, positions in positions_by_spec.items():
+                self._grids[spec] = self._build_grid(np.array(positions, dtype=np.int64))
+
+    def to_arrays(self) -> Tuple[List[Optional[str]], Dict[str, np.ndarray]]:
+        """
+        Estado do índice em arrays planos, para persistir em disco: as grades são concatenadas
+        e os offsets 'grid_points'/'grid_cells' delimitam cada uma. Retorna (especialidades, arrays),
+        com a grade geral (None) sempre em primeiro.
+        """
+        keys = [None] + sorted(k for k in self._grids if k is not None)
+        grids = [self._grids[k] for k in keys]
+        arrays = {
+            'latitudes': self.latitudes,
+            'longitudes': self.longitudes,
+            'grid_points': np.cumsum([0] + [len(g.positions) for g in grids]).astype(np.int64),
+            'grid_cells': np.cumsum([0] + [len(g.starts) for g in grids]).astype(np.int64),
+        }
+        for name in _GRID_POINT_ARRAYS + _GRID_CELL_ARRAYS:
+            arrays[name] = np.concatenate([np.asarray(getattr(g, name), dtype=np.int64) for g in grids])
+        return keys, arrays
+
+    @classmethod
+    def from_arrays(cls, especialidades: List[Optional[str]], arrays: Dict[str, np.ndarray],
+                    cell_size_deg: float = DEFAULT_CELL_SIZE_DEG) -> 'HospitalSpatialIndex':
+        """Inverso de to_arrays(): as grades viram fatias (views) dos arrays, sem cópia."""
+        index = cls.__new__(cls)
+        index.latitudes = arrays['latitudes']
+        index.longitudes = arrays['longitudes']
+        index.cell_size_deg = cell_size_deg
+        index.cell_size_km = math.radians(cell_size_deg) * EARTH_RADIUS_KM
+        points, cells = arrays['grid_points'], arrays['grid_cells']
+        index._grids = {}
+        for i, key in enumerate(especialidades):
+            grid_arrays = {name: arrays[name][points[i]:points[i + 1]] for name in _GRID_POINT_ARRAYS}
+            grid_arrays.update({name: arrays[name][cells[i]:cells[i + 1]] for name in _GRID_CELL_ARRAYS})
+            index._grids[key] = _GridBuckets.from_arrays(grid_arrays)
+        return index
+
+    def _build_grid(self, positions: np.ndarray) -> _GridBuckets:
+        return _GridBuckets(positions.astype(np.int64), self.latitudes, self.longitudes, self.cell_size_deg)
+
+    def __len__(self):
+        return len(self._grids[None])
+
+    def count(self, especialidade: Optional[str] = None) -> int:
+        """Quantidade de pontos indexados (com coordenadas) da especialidade, ou de todos."""
+        grid = self._grid_for(especialidade)
+        return len(grid) if grid is not None else 0
+
+    def positions(self, especialidade: Optional[str] = None) -> np.ndarray:
+        """Posições (em ordem crescente) dos pontos indexados da especialidade, ou de todos."""
+        grid = self._grid_for(especialidade)
+        return grid.sorted_positions if grid is not None else np.array([], dtype=np.int64)
+
+    def _candidates(self, grid: _GridBuckets, lat_min: float, lat_max: float, lon_abs_lat: float, lon_min: float,
+                    lon_max: float, radius_km: float) -> np.ndarray:
+        """Pontos da grade dentro da caixa envolvente do raio em torno do retângulo de consultas."""
+        # Pequena folga para que pontos exatamente na borda do raio não fiquem fora por arredondamento
+        angular = radius_km / EARTH_RADIUS_KM * (1 + 1e-9) + 1e-12
+        dlat = math.degrees(angular)
+        box_lat_min, box_lat_max = lat_min - dlat, lat_max + dlat
+        if angular >= math.pi / 2 or box_lat_max >= 90 or box_lat_min <= -90:
+            # O raio alcança um polo (ou meio globo): a caixa cobre todas as longitudes
+            box_lon_min, box_lon_max = -math.inf, math.inf
+        else:
+            ratio = math.sin(angular) / math.cos(math.radians(lon_abs_lat))
+            dlon = 180.0 if ratio >= 1 else math.degrees(math.asin(ratio))
+            box_lon_min, box_lon_max = lon_min - dlon, lon_max + dlon
+            if box_lon_min < -180 or box_lon_max > 180:
+                box_lon_min, box_lon_max = -math.inf, math.inf
+
+        to_cell = lambda value: math.floor(value / self.cell_size_deg) if math.isfinite(value) else value
+        return grid.in_cells(to_cell(box_lat_min), to_cell(box_lat_max), to_cell(box_lon_min), to_cell(box_lon_max))
+
+    def _grid_for(self, especialidade: Optional[str]) -> Optional[_GridBuckets]:
+        return self._grids.get(especialidade)
+
+    def query_radius(self, lat: float, lon: float, radius_km: float,
+                     especialidade: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Retorna (posições, distâncias em km) de todos os pontos a até radius_km do ponto
+        consultado, ordenados por distância. Filtra pela especialidade normalizada, se informada.
+        """
+        empty = (np.array([], dtype=np.int64), np.array([], dtype=float))
+        grid = self._grid_for(especialidade)
+        if grid is None or not len(grid) or lat is None or lon is None or np.isnan(lat) or np.isnan(lon):
+            return empty
+
+        candidates = self._candidates(grid, lat, lat, abs(lat), lon, lon, radius_km)
+        if not len(candidates):
+            return empty
+        distances = haversine_vectorized(lat, lon, self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, lats, lons, k: int = 1, especialidade: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Consulta em lote dos k pontos mais próximos de cada coordenada.
+
+        Retorna duas matrizes (n, k): posições e distâncias em km. Quando não há pontos
+        suficientes (ou a consulta não tem coordenadas) a posição é -1 e a distância, infinita.
+        """
+        lats = np.asarray(lats, dtype=float).reshape(-1)
+        lons = np.asarray(lons, dtype=float).reshape(-1)
+        positions = np.full((len(lats), k), -1, dtype=np.int64)
+        distances = np.full((len(lats), k), np.inf)
+
+        grid = self._grid_for(especialidade)
+        valid = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+        if grid is None or not len(grid) or not len(valid):
+            return positions, distances
+
+        # Agrupa as consultas pela célula em que caem: cada grupo compartilha a mesma caixa de busca
+        cell_i = np.floor(lats[valid] / self.cell_size_deg).astype(np.int64)
+        cell_j = np.floor(lons[valid] / self.cell_size_deg).astype(np.int64)
+        order = np.lexsort((cell_j, cell_i))
+        valid, cell_i, cell_j = valid[order], cell_i[order], cell_j[order]
+        boundaries = np.flatnonzero((np.diff(cell_i) != 0) | (np.diff(cell_j) != 0)) + 1
+        for group in np.split(valid, boundaries):
+            for start in range(0, len(group), QUERY_BLOCK_SIZE):
+                rows = group[start:start + QUERY_BLOCK_SIZE]
+                found_pos, found_dist = self._nearest_group(grid, lats[rows], lons[rows], k)
+                positions[rows, :found_pos.shape[1]] = found_pos
+                distances[rows, :found_dist.shape[1]] = found_dist
+        return positions, distances
+
+    def _nearest_group(self, grid: _GridBuckets, lats: np.ndarray, lons: np.ndarray, k: int):
+        """k vizinhos de um grupo de consultas próximas, ampliando o raio até a resposta ser exata."""
+        lat_min, lat_max = lats.min(), lats.max()
+        lon_min, lon_max = lons.min(), lons.max()
+        abs_lat = max(abs(lat_min), abs(lat_max))
+        half_circumference = math.pi * EARTH_RADIUS_KM
+        radius = self.cell_size_km
+        while True:
+            candidates = self._candidates(grid, lat_min, lat_max, abs_lat, lon_min, lon_max, radius)
+            if len(candidates) < k and radius < half_circumference:
+                radius *= 2
+                continue
+            distances = haversine_vectorized(lats[:, None], lons[:, None],
+                                             self.latitudes[candidates][None, :], self.longitudes[candidates][None, :])
+            kk = min(k, len(candidates))
+            # Ordenação estável: empates ficam com a menor posição, como nas varreduras lineares
+            best = np.argsort(distances, axis=1, kind='stable')[:, :kk]
+            best_distances = np.take_along_axis(distances, best, axis=1)
+            kth_distance = best_distances[:, -1].max() if kk else 0.0
+            if kth_distance <= radius or radius >= half_circumference:
+                return candidates[best], best_distances
+            # Algum k-ésimo vizinho está fora da caixa garantida: refaz com o raio exato
+            radius = kth_distance
@@ -0,0 +1,16 @@
+-- Normalização de especialidades usada pelo motor de alocação no PostGIS (ALLOCATION_ENGINE=postgis)
+-- e índices das consultas de src/pipeline/sql_allocation.py. Mesma regra de especialidades.normalizar_especialidade.
+CREATE OR REPLACE FUNCTION normalizar_especialidade(especialidade TEXT) RETURNS TEXT
+LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+    SELECT translate(lower(btrim(especialidade, E' \t\r\n')), 'ãáàâéêíîóôõúûç', 'aaaaeeiiooouuc')
+$$;
+
+CREATE OR REPLACE FUNCTION normalizar_especialidades(especialidades TEXT[]) RETURNS TEXT[]
+LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+    SELECT COALESCE(array_agg(normalizar_especialidade(e)), '{}')
+    FROM unnest(especialidades) AS e
+    WHERE btrim(e) <> ''
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_hospitais_especialidades_norm ON hospitais USING GIN (normalizar_especialidades(especialidades));
+CREATE INDEX IF NOT EXISTS idx_hospitais_municipio_id ON hospitais (municipio_id);
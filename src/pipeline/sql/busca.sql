@@ -0,0 +1,13 @@
+-- Busca de entidades do frontend (src/frontend/search.py): trigramas (pg_trgm) e prefixo de CPF.
+-- Reaplicado pelo pipeline no início de cada carga, então bancos criados antes deste arquivo também recebem os índices.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Índices de trigramas (GIN): servem ILIKE '%termo%' e a similaridade por palavra (<%)
+CREATE INDEX IF NOT EXISTS idx_municipios_nome_trgm ON municipios USING GIN (nome gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_hospitais_nome_trgm ON hospitais USING GIN (nome gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_medicos_nome_trgm ON medicos USING GIN (nome_completo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_medicos_especialidade_trgm ON medicos USING GIN (especialidade gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_pacientes_nome_trgm ON pacientes USING GIN (nome_completo gin_trgm_ops);
+
+-- Busca por prefixo de CPF (cpf LIKE '123%'), independente da collation do banco
+CREATE INDEX IF NOT EXISTS idx_pacientes_cpf_prefixo ON pacientes (cpf varchar_pattern_ops);
@@ -0,0 +1,37 @@
+-- Visões materializadas do dashboard (src/pipeline/dashboard_views.py; atualizadas ao fim de cada carga).
+-- Cada visão tem um índice único, exigido pelo REFRESH ... CONCURRENTLY.
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_dashboard_totais AS
+SELECT 1 AS id,
+       (SELECT COUNT(*) FROM pacientes) AS total_pacientes,
+       (SELECT COUNT(*) FROM medicos) AS total_medicos,
+       (SELECT COUNT(*) FROM hospitais) AS total_hospitais,
+       now() AS atualizado_em;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_dashboard_totais ON mv_dashboard_totais (id);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_pacientes_por_genero AS
+SELECT genero, COUNT(*) AS total FROM pacientes GROUP BY genero;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_pacientes_por_genero ON mv_pacientes_por_genero (genero);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_pacientes_por_convenio AS
+SELECT convenio, COUNT(*) AS total FROM pacientes GROUP BY convenio;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_pacientes_por_convenio ON mv_pacientes_por_convenio (convenio);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_pacientes_por_cid AS
+SELECT c.codigo, c.codigo || ' - ' || c.descricao AS cid_descricao, COUNT(*) AS total_pacientes
+FROM pacientes AS p
+JOIN cid10 AS c ON p.cid_10 = c.codigo
+GROUP BY c.codigo, c.descricao;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_pacientes_por_cid ON mv_pacientes_por_cid (codigo);
+CREATE INDEX IF NOT EXISTS idx_mv_pacientes_por_cid_total ON mv_pacientes_por_cid (total_pacientes DESC);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_ocupacao_hospitais AS
+SELECT h.codigo, h.nome, ST_Y(h.localizacao) AS lat, ST_X(h.localizacao) AS lon, h.leitos_totais,
+       COALESCE(p.leitos_ocupados, 0)::int AS leitos_ocupados
+FROM hospitais h
+LEFT JOIN (
+    SELECT hospital_alocado_id, COUNT(*) AS leitos_ocupados
+    FROM pacientes WHERE hospital_alocado_id IS NOT NULL GROUP BY hospital_alocado_id
+) p ON h.codigo = p.hospital_alocado_id;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_ocupacao_hospitais ON mv_ocupacao_hospitais (codigo);
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_medicos_por_num_hospitais AS
+SELECT CASE WHEN num_hospitais = 1 THEN '1 Hospital' WHEN num_hospitais = 2 THEN '2 Hospitais' ELSE '3+ Hospitais' END AS num_hospitais,
+       COUNT(*) AS total_medicos
+FROM (SELECT medico_id, COUNT(hospital_id) AS num_hospitais FROM medico_hospital_associacao GROUP BY medico_id) contagem
+GROUP BY 1;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_medicos_por_num_hospitais ON mv_medicos_por_num_hospitais (num_hospitais);
@@ -0,0 +1,17 @@
+-- Notifica o serviço de alocação (src/allocation_server.py) quando hospitais ou municípios mudam;
+-- o canal é CANAL_ALTERACOES de src/pipeline/allocation_service.py
+CREATE OR REPLACE FUNCTION notificar_alteracao_alocacao() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('alocacao_dados_alterados', TG_TABLE_NAME);
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_hospitais_alocacao ON hospitais;
+CREATE TRIGGER trg_hospitais_alocacao AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON hospitais
+FOR EACH STATEMENT EXECUTE FUNCTION notificar_alteracao_alocacao();
+
+DROP TRIGGER IF EXISTS trg_municipios_alocacao ON municipios;
+CREATE TRIGGER trg_municipios_alocacao AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON municipios
+FOR EACH STATEMENT EXECUTE FUNCTION notificar_alteracao_alocacao();
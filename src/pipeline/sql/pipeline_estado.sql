@@ -0,0 +1,9 @@
+-- Checkpoints da carga em chunks (LOAD_CHECKPOINT=on; src/pipeline/checkpoint.py)
+CREATE TABLE IF NOT EXISTS pipeline_estado (
+    carga VARCHAR(50) PRIMARY KEY,
+    fonte_hash VARCHAR(64) NOT NULL,
+    chunks_concluidos INT NOT NULL DEFAULT 0,
+    registros_concluidos BIGINT NOT NULL DEFAULT 0,
+    concluida BOOLEAN NOT NULL DEFAULT FALSE,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+);
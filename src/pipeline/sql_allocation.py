@@ -0,0 +1,137 @@
+# src/pipeline/sql_allocation.py
+# Motor de alocação no PostGIS: KNN (<->), ST_DWithin e INSERT ... SELECT com LATERAL
+
+import logging
+import os
+import pandas as pd
+from sqlalchemy import text
+from .bulk_copy import copy_dataframe
+from .ddl import aplicar_sql
+
+# Raio (km) da etapa de municípios vizinhos na alocação de médicos
+RAIO_VIZINHANCA_KM = 30
+# Pré-filtro em graus para o ST_DWithin usar o índice GiST de geometria (30 km < 0,5° em latitudes do Brasil)
+RAIO_VIZINHANCA_GRAUS = 0.5
+# Candidatos trazidos pelo KNN planar (<->) antes de reordenar pela distância na esfera
+KNN_CANDIDATOS = 16
+
+# Até 3 hospitais por médico, nas quatro prioridades de alocar_e_carregar_medicos:
+# 1/2 = mesmo município (com/sem a especialidade), 3/4 = outro município a até 30 km (com/sem).
+# As etapas 3 e 4 do Python só rodam se faltarem candidatos; como vêm depois na ordenação,
+# o LIMIT 3 sobre a união de todas as etapas dá o mesmo resultado.
+SQL_ALOCAR_MEDICOS = f"""
+    INSERT INTO medico_hospital_associacao (medico_id, hospital_id)
+    SELECT m.codigo, escolhidos.codigo
+    FROM medicos m
+    JOIN municipios mu ON mu.codigo_ibge = m.municipio_id AND mu.localizacao IS NOT NULL
+    CROSS JOIN LATERAL (
+        SELECT candidatos.codigo
+        FROM (
+            SELECT h.codigo,
+                   CASE WHEN normalizar_especialidades(h.especialidades) @> ARRAY[normalizar_especialidade(m.especialidade)]
+                        THEN 1 ELSE 2 END AS prioridade,
+                   ST_Distance(h.localizacao::geography, mu.localizacao::geography, false) AS distancia
+            FROM hospitais h
+            WHERE h.municipio_id = m.municipio_id
+              AND h.localizacao IS NOT NULL
+              AND array_length(h.especialidades, 1) > 0
+            UNION ALL
+            SELECT h.codigo,
+                   CASE WHEN normalizar_especialidades(h.especialidades) @> ARRAY[normalizar_especialidade(m.especialidade)]
+                        THEN 3 ELSE 4 END AS prioridade,
+                   ST_Distance(h.localizacao::geography, mu.localizacao::geography, false) AS distancia
+            FROM hospitais h
+            WHERE h.municipio_id <> m.municipio_id
+              AND array_length(h.especialidades, 1) > 0
+              AND ST_DWithin(h.localizacao, mu.localizacao, {RAIO_VIZINHANCA_GRAUS})
+              AND ST_DWithin(h.localizacao::geography, mu.localizacao::geography, {RAIO_VIZINHANCA_KM * 1000}, false)
+        ) AS candidatos
+        ORDER BY candidatos.prioridade, candidatos.distancia, candidatos.codigo
+        LIMIT 3
+    ) AS escolhidos
+    WHERE btrim(m.especialidade) <> ''
+"""
+
+# Regras do HospitalAllocationEngine (modo 'nearest'): especializado mais próximo; senão o hospital
+# mais próximo; sem coordenadas, o primeiro especializado (aqui, o de menor código) ou, sem
+# especialidade, um hospital geral (ou qualquer um) sorteado. Os candidatos dos casos sem
+# coordenadas são calculados uma vez por comando, nas CTEs, e não por paciente.
+SQL_INSERIR_PACIENTES = f"""
+    WITH primeiro_especializado AS (
+        SELECT DISTINCT ON (esp.especialidade) esp.especialidade, h.codigo
+        FROM hospitais h
+        CROSS JOIN LATERAL unnest(normalizar_especialidades(h.especialidades)) AS esp(especialidade)
+        WHERE h.localizacao IS NOT NULL
+        ORDER BY esp.especialidade, h.codigo
+    ), sorteio AS (
+        SELECT COALESCE(
+            (SELECT array_agg(h.codigo ORDER BY h.codigo) FROM hospitais h
+             WHERE h.localizacao IS NOT NULL AND normalizar_especialidades(h.especialidades) @> ARRAY['clinica geral']),
+            (SELECT array_agg(h.codigo ORDER BY h.codigo) FROM hospitais h WHERE h.localizacao IS NOT NULL)
+        ) AS codigos
+    )
+    INSERT INTO pacientes (codigo, cpf, nome_completo, genero, cod_municipio, bairro, convenio, cid_10, hospital_alocado_id)
+    SELECT s.codigo, s.cpf, s.nome_completo, s.genero, s.cod_municipio, s.bairro, s.convenio, s.cid_10,
+           COALESCE(especializado.codigo, proximo.codigo, sem_coordenadas.codigo,
+                    sorteio.codigos[1 + floor(random() * cardinality(sorteio.codigos))::int])
+    FROM {{stage}} s
+    CROSS JOIN sorteio
+    LEFT JOIN municipios mu ON mu.codigo_ibge = s.cod_municipio
+    LEFT JOIN cid10 c ON c.codigo = s.cid_10
+    LEFT JOIN primeiro_especializado sem_coordenadas
+        ON sem_coordenadas.especialidade = normalizar_especialidade(c.especialidade) AND mu.localizacao IS NULL
+    LEFT JOIN LATERAL (
+        SELECT knn.codigo FROM (
+            SELECT h.codigo, h.localizacao
+            FROM hospitais h
+            WHERE h.localizacao IS NOT NULL
+              AND normalizar_especialidades(h.especialidades) @> ARRAY[normalizar_especialidade(c.especialidade)]
+            ORDER BY h.localizacao <-> mu.localizacao, h.codigo
+            LIMIT {KNN_CANDIDATOS}
+        ) AS knn
+        ORDER BY ST_Distance(knn.localizacao::geography, mu.localizacao::geography, false), knn.codigo
+        LIMIT 1
+    ) AS especializado ON c.especialidade IS NOT NULL AND mu.localizacao IS NOT NULL
+    LEFT JOIN LATERAL (
+        SELECT knn.codigo FROM (
+            SELECT h.codigo, h.localizacao
+            FROM hospitais h
+            WHERE h.localizacao IS NOT NULL
+            ORDER BY h.localizacao <-> mu.localizacao, h.codigo
+            LIMIT {KNN_CANDIDATOS}
+        ) AS knn
+        ORDER BY ST_Distance(knn.localizacao::geography, mu.localizacao::geography, false), knn.codigo
+        LIMIT 1
+    ) AS proximo ON especializado.codigo IS NULL AND mu.localizacao IS NOT NULL
+"""
+
+def get_allocation_engine() -> str:
+    """Motor de alocação (ALLOCATION_ENGINE): 'python' (padrão, em memória) ou 'postgis' (no banco)."""
+    return os.getenv('ALLOCATION_ENGINE', 'python').strip().lower()
+
+def ensure_sql_functions(engine):
+    """Cria (ou atualiza) as funções de normalização e os índices usados pelas consultas de alocação (src/pipeline/sql/alocacao.sql)."""
+    with engine.begin() as conn:
+        aplicar_sql(conn, 'alocacao.sql')
+
+def alocar_medicos_postgis(engine) -> int:
+    """Recalcula medico_hospital_associacao inteiramente no banco. Retorna o número de associações."""
+    ensure_sql_functions(engine)
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE TABLE medico_hospital_associacao"))
+        associacoes = conn.execute(text(SQL_ALOCAR_MEDICOS)).rowcount
+    logging.info(f"Alocação de médicos no PostGIS: {associacoes} associações médico-hospital criadas.")
+    return associacoes
+
+def inserir_pacientes_postgis(cursor, chunk: pd.DataFrame) -> int:
+    """
+    Carrega um chunk de pacientes alocando o hospital no próprio INSERT: o chunk vai por COPY
+    para uma tabela temporária e o INSERT ... SELECT escolhe o hospital com LATERAL + KNN.
+    Roda no cursor informado, sem commit (a transação é de quem chama).
+    """
+    stage_name = "stage_pacientes_alocacao"
+    colunas = [c for c in chunk.columns if c != 'hospital_alocado_id']
+    cursor.execute(f"CREATE TEMP TABLE {stage_name} (LIKE pacientes INCLUDING DEFAULTS) ON COMMIT DROP")
+    copy_dataframe(cursor, chunk[colunas], stage_name)
+    cursor.execute(SQL_INSERIR_PACIENTES.format(stage=stage_name))
+    return cursor.rowcount
@@ -0,0 +1,98 @@
+# src/pipeline/staged.py
+# Modo em estágios: leitura, transformação e carga dos pacientes em threads ligadas por filas limitadas
+
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+DEFAULT_QUEUE_SIZE = 4
+# Marcadores na fila: item normal, fim da fonte ou exceção da fonte
+_ITEM, _FIM, _ERRO = range(3)
+
+def get_pipeline_mode() -> str:
+    """Modo do pipeline (PIPELINE_MODE): 'sequential' (padrão) ou 'staged' (estágios em threads com filas)."""
+    return os.getenv('PIPELINE_MODE', 'sequential').strip().lower()
+
+def get_queue_size() -> int:
+    """Chunks em espera entre dois estágios (PIPELINE_QUEUE_SIZE); limita a memória em voo."""
+    try:
+        return max(1, int(os.getenv('PIPELINE_QUEUE_SIZE', str(DEFAULT_QUEUE_SIZE))))
+    except ValueError:
+        logging.warning(f"PIPELINE_QUEUE_SIZE inválido. Usando {DEFAULT_QUEUE_SIZE}.")
+        return DEFAULT_QUEUE_SIZE
+
+class ThreadStage(Iterator):
+    """
+    Consome `source` numa thread própria e entrega os itens, na mesma ordem, por uma fila
+    limitada: enquanto o estágio seguinte processa um chunk, esta thread já produz os próximos.
+    Com a fila cheia a thread espera (backpressure), então no máximo `queue_size` chunks ficam
+    parados entre os estágios. A thread só começa no primeiro next() (o checkpoint da carga
+    precisa ser lido antes de a fonte ser consumida) e exceções da fonte são relançadas no consumidor.
+    """
+
+    def __init__(self, source: Iterator, name: str, queue_size: Optional[int] = None):
+        self.name = name
+        self._source = source
+        self._queue = queue.Queue(maxsize=queue_size or get_queue_size())
+        self._stop = threading.Event()
+        self._thread = None
+        self._done = False
+        # Tempo que o consumidor passou esperando por este estágio (gargalo do pipeline)
+        self.wait_seconds = 0.0
+        self.items = 0
+
+    def _put(self, kind: int, value=None) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            for item in self._source:
+                if not self._put(_ITEM, item):
+                    return
+            self._put(_FIM)
+        except BaseException as e:
+            self._put(_ERRO, e)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'pipeline-{self.name}', daemon=True)
+            self._thread.start()
+        inicio = time.perf_counter()
+        kind, value = self._queue.get()
+        self.wait_seconds += time.perf_counter() - inicio
+        if kind == _ITEM:
+            self.items += 1
+            return value
+        self._done = True
+        if kind == _ERRO:
+            raise value
+        logging.info(f"Estágio '{self.name}': {self.items} chunks; o consumidor esperou {self.wait_seconds:.2f}s por ele.")
+        raise StopIteration
+
+    def close(self):
+        """Interrompe a thread (ela termina no próximo put); usado quando o consumidor falha."""
+        self._stop.set()
+        self._done = True
+
+def stage_entity(dataframes: Dict, entity: str, name: str) -> Optional[ThreadStage]:
+    """Passa a entidade (se for um gerador) por um estágio em thread; devolve o estágio criado."""
+    data = dataframes.get(entity)
+    if not isinstance(data, Iterator):
+        return None
+    stage = ThreadStage(data, name)
+    dataframes[entity] = stage
+    return stage
@@ -1,11 +1,19 @@
 import logging
 import pandas as pd
-from typing import Iterator, Dict
+from typing import Iterator, Dict, Optional
 import math
+import multiprocessing
 import uuid
-import random
 from sqlalchemy import create_engine
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from .allocation_engine import HospitalAllocationEngine
+from .municipio_lookup import MunicipioLookup
+from .capacity import BedCapacity
+from .sql_allocation import get_allocation_engine
+from .cid_especialidades import TabelaCidEspecialidade, get_tabela_cid
 
 # --- FUNÇÕES DE AUTOSSUFICIÊNCIA (SEM ALTERAÇÃO) ---
 def get_database_engine():
@@ -37,30 +45,6 @@ def clean_name(full_name: str) -> str:
         if words[i].lower() != words[i-1].lower(): cleaned_words.append(words[i])
     return ' '.join(cleaned_words)
 
-def get_especialidade_from_cid(codigo: str) -> str:
-    if not isinstance(codigo, str) or not codigo: return "Clínica Geral"
-    letra = codigo[0].upper()
-    CID_CAPITULO_ESPECIALIDADE_MAP = {
-        'A': 'Infectologia', 'B': 'Infectologia', 'C': 'Oncologia', 'D': 'Oncologia',
-        'E': 'Endocrinologia', 'F': 'Psiquiatria', 'G': 'Neurologia', 'H': 'Oftalmologia',
-        'I': 'Cardiologia', 'J': 'Pneumologia', 'K': 'Gastroenterologia', 'L': 'Dermatologia',
-        'M': 'Ortopedia', 'N': 'Nefrologia', 'O': 'Ginecologia', 'P': 'Pediatria',
-        'Q': 'Genética Médica', 'R': 'Clínica Geral', 'S': 'Traumatologia', 'T': 'Traumatologia',
-        'U': 'Infectologia', 'V': 'Medicina de Emergência', 'W': 'Medicina de Emergência',
-        'X': 'Medicina de Emergência', 'Y': 'Medicina de Emergência', 'Z': 'Clínica Geral'
-    }
-    if letra == 'D' and len(codigo) >= 3:
-        try: 
-            num = int(codigo[1:3])
-            if 50 <= num <= 89: return 'Hematologia'
-        except ValueError: pass
-    if letra == 'H' and len(codigo) >= 3:
-        try: 
-            num = int(codigo[1:3])
-            if 60 <= num <= 95: return 'Otorrinolaringologia'
-        except ValueError: pass
-    return CID_CAPITULO_ESPECIALIDADE_MAP.get(letra, 'Clínica Geral')
-
 def haversine_distance(lat1, lon1, lat2, lon2):
     if any(v is None or pd.isna(v) for v in [lat1, lon1, lat2, lon2]): return float('inf')
     R = 6371
@@ -111,39 +95,191 @@ def clean_nome_fhir(nome_value):
         except (TypeError, KeyError): pass
     return clean_name(str(nome_value))
 
-def normalizar_especialidade(especialidade: str) -> str:
-    if not isinstance(especialidade, str): return ""
-    normalized = especialidade.lower().strip()
-    replacements = {'ã': 'a', 'á': 'a', 'à': 'a', 'â': 'a', 'é': 'e', 'ê': 'e', 'í': 'i', 'î': 'i', 'ó': 'o', 'ô': 'o', 'õ': 'o', 'ú': 'u', 'û': 'u', 'ç': 'c'}
-    for old, new in replacements.items():
-        normalized = normalized.replace(old, new)
-    return normalized
-
-def allocate_hospital_intelligent(patient, all_hospitals_with_coords, municipios_df, general_hospitals_ids):
-    cid_code, municipio_id = patient.get('cid_10'), patient.get('cod_municipio')
-    if pd.notna(cid_code):
-        required_specialty_norm = normalizar_especialidade(get_especialidade_from_cid(cid_code))
-        ideal_candidates = [h for h in all_hospitals_with_coords if required_specialty_norm in [normalizar_especialidade(s) for s in h.get('especialidades', []) if s and s.strip()]]
-        if ideal_candidates:
-            if pd.notna(municipio_id):
-                municipio_data = municipios_df.loc[municipios_df['codigo_ibge'] == int(municipio_id)]
-                if not municipio_data.empty and pd.notna(municipio_data.iloc[0].get('latitude')):
-                    patient_coords = {'latitude': municipio_data.iloc[0]['latitude'], 'longitude': municipio_data.iloc[0]['longitude']}
-                    for cand in ideal_candidates:
-                        cand['distance'] = haversine_distance(patient_coords['latitude'], patient_coords['longitude'], cand['latitude'], cand['longitude'])
-                    return min(ideal_candidates, key=lambda x: x['distance'])['codigo']
-            return ideal_candidates[0]['codigo']
-    logging.warning(f"Paciente {patient.get('codigo')} sem CID ou sem hospital especializado. Usando fallback.")
-    if pd.notna(municipio_id):
-        municipio_data = municipios_df.loc[municipios_df['codigo_ibge'] == int(municipio_id)]
-        if not municipio_data.empty and pd.notna(municipio_data.iloc[0].get('latitude')):
-            patient_coords = {'latitude': municipio_data.iloc[0]['latitude'], 'longitude': municipio_data.iloc[0]['longitude']}
-            for hospital in all_hospitals_with_coords:
-                hospital['distance'] = haversine_distance(patient_coords['latitude'], patient_coords['longitude'], hospital['latitude'], hospital['longitude'])
-            return min(all_hospitals_with_coords, key=lambda x: x.get('distance', float('inf')))['codigo']
-    if general_hospitals_ids: return random.choice(general_hospitals_ids)
-    if all_hospitals_with_coords: return random.choice(all_hospitals_with_coords)['codigo']
-    return None
+# --- VERSÕES VETORIZADAS (MESMO RESULTADO DAS FUNÇÕES ACIMA, POR CHUNK) ---
+UUID_PATTERN = r'^(?:[0-9a-fA-F]{32}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$'
+
+def _object_series(series: pd.Series) -> pd.Series:
+    return pd.Series([None] * len(series), index=series.index, dtype=object)
+
+def _map_distinct(series: pd.Series, func) -> pd.Series:
+    """Aplica `func` uma única vez por valor distinto (factorize) e espalha o resultado pelas linhas."""
+    codes, uniques = pd.factorize(series)
+    mapped = pd.Series([func(value) for value in uniques], dtype=object).to_numpy()
+    return pd.Series(mapped[codes], index=series.index, dtype=object)
+
+def _is_valid_uuid(val) -> bool:
+    try:
+        uuid.UUID(str(val)); return True
+    except (ValueError, TypeError):
+        return False
+
+def _new_uuids(count: int) -> list:
+    """Gera `count` UUIDs v4 a partir de um único bloco de bytes aleatórios."""
+    raw = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+def ensure_uuid_series(series: pd.Series) -> pd.Series:
+    """ensure_uuid vetorizado: valida por regex e só gera UUIDs novos para as linhas inválidas."""
+    result = series.astype(object).copy()
+    missing = series.isna().to_numpy()
+    valid = ~missing & series.astype(str).str.match(UUID_PATTERN).to_numpy()
+    # Formatos raros que uuid.UUID também aceita (chaves, prefixo urn:uuid:) seguem pela validação original
+    others = ~missing & ~valid
+    if others.any():
+        valid[others] = [_is_valid_uuid(val) for val in series[others]]
+    invalid = ~valid
+    if invalid.any():
+        result[invalid] = _new_uuids(int(invalid.sum()))
+    return result
+
+def normalize_gender_series(series: pd.Series) -> pd.Series:
+    """normalize_gender vetorizado: mapeamento categórico, a regra roda uma vez por valor distinto."""
+    result = _object_series(series)
+    present = series.notna()
+    if present.any():
+        result[present] = _map_distinct(series[present].astype(str), normalize_gender)
+    return result
+
+def clean_name_series(series: pd.Series) -> pd.Series:
+    """
+    clean_name para uma série de strings. A remoção de palavras repetidas com regex do
+    pandas mediu mais lenta que o próprio clean_name, então ele roda uma vez por nome distinto.
+    """
+    return _map_distinct(series, clean_name)
+
+def clean_nome_fhir_series(series: pd.Series) -> pd.Series:
+    """clean_nome_fhir vetorizado: nomes FHIR em JSON/lista seguem pela função original."""
+    result = _object_series(series)
+    kinds = series.map(type)
+    is_text = (kinds == str).to_numpy()
+    structured = (kinds == list).to_numpy()
+    if is_text.any():
+        structured[is_text] = series[is_text].str.lstrip().str.startswith('[').to_numpy(dtype=bool)
+    plain = series.notna().to_numpy() & ~structured
+    if plain.any():
+        result[plain] = clean_name_series(series[plain].astype(str))
+    if structured.any():
+        result[structured] = series[structured].map(clean_nome_fhir)
+    return result
+
+def convenio_series(series: pd.Series) -> pd.Series:
+    return series.astype(str).str.upper() == 'SIM'
+
+# --- TRANSFORMAÇÃO DOS CHUNKS DE PACIENTES (SERIAL OU EM PROCESSOS) ---
+PACIENTES_COLUMNS = ['codigo', 'cpf', 'nome_completo', 'genero', 'cod_municipio', 'bairro', 'convenio', 'cid_10']
+# Chunks em processamento por worker no modo paralelo (limita a memória dos chunks em voo)
+IN_FLIGHT_PER_WORKER = 2
+
+@dataclass
+class PacientesTransformContext:
+    """Estruturas somente leitura usadas em cada chunk; enviadas a cada worker uma única vez."""
+    valid_municipio_ids: set
+    valid_cid_codes: set
+    allocation_engine: Optional[HospitalAllocationEngine]
+    tabela_cid: TabelaCidEspecialidade
+
+def get_transform_workers() -> int:
+    """Número de processos na transformação de pacientes (TRANSFORM_WORKERS). 1 = serial; 0 ou negativo = todos os núcleos."""
+    try:
+        workers = int(os.getenv('TRANSFORM_WORKERS', '1'))
+    except ValueError:
+        logging.warning("TRANSFORM_WORKERS inválido. Usando transformação serial.")
+        return 1
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def get_allocation_mode() -> str:
+    """Modo de alocação de pacientes (ALLOCATION_MODE): 'nearest' (padrão, sem limite de leitos) ou 'capacity'."""
+    return os.getenv('ALLOCATION_MODE', 'nearest').strip().lower()
+
+def process_single_pacientes_chunk(chunk_data, context: PacientesTransformContext):
+    if not isinstance(chunk_data, pd.DataFrame) or chunk_data.empty: return pd.DataFrame()
+    try:
+        processed_chunk = chunk_data.copy()
+        processed_chunk = ensure_columns_exist(processed_chunk, PACIENTES_COLUMNS)
+        if 'cid-10' in processed_chunk.columns: processed_chunk.rename(columns={'cid-10': 'cid_10'}, inplace=True)
+        original_count = len(processed_chunk)
+        processed_chunk.dropna(subset=['cpf'], inplace=True)
+        if len(processed_chunk) < original_count:
+            logging.warning(f"Removidos {original_count - len(processed_chunk)} pacientes por terem CPF nulo.")
+        if processed_chunk.empty: return pd.DataFrame()
+        processed_chunk['codigo'] = ensure_uuid_series(processed_chunk['codigo'])
+        processed_chunk['nome_completo'] = clean_nome_fhir_series(processed_chunk['nome_completo'])
+        processed_chunk['genero'] = normalize_gender_series(processed_chunk['genero'])
+        processed_chunk['convenio'] = convenio_series(processed_chunk['convenio'])
+        processed_chunk['cod_municipio'] = pd.to_numeric(processed_chunk['cod_municipio'], errors='coerce').astype('Int64')
+        processed_chunk.loc[~processed_chunk['cod_municipio'].isin(context.valid_municipio_ids), 'cod_municipio'] = pd.NA
+        if 'cid_10' in processed_chunk.columns:
+            processed_chunk['cid_10'] = processed_chunk['cid_10'].astype(str)
+            processed_chunk.loc[~processed_chunk['cid_10'].isin(context.valid_cid_codes), 'cid_10'] = None
+        if context.allocation_engine is not None:
+            especialidade_norm = context.tabela_cid.especialidades_normalizadas(processed_chunk['cid_10'])
+            processed_chunk['hospital_alocado_id'] = context.allocation_engine.allocate(processed_chunk['cod_municipio'], especialidade_norm)
+        else:
+            processed_chunk['hospital_alocado_id'] = None
+        successful_allocations = int(processed_chunk['hospital_alocado_id'].notna().sum())
+        total_patients = len(processed_chunk)
+        allocation_rate = (successful_allocations / total_patients * 100) if total_patients > 0 else 0
+        logging.info(f"Chunk processado: {total_patients} pacientes, {successful_allocations} alocados ({allocation_rate:.1f}%)")
+        return processed_chunk[PACIENTES_COLUMNS + ['hospital_alocado_id']]
+    except Exception as e:
+        logging.error(f"Erro ao processar chunk de pacientes: {e}")
+        return None
+
+# Contexto do processo worker, instalado uma vez pelo initializer do pool
+_worker_context: Optional[PacientesTransformContext] = None
+
+def _init_transform_worker(context: PacientesTransformContext):
+    global _worker_context
+    _worker_context = context
+
+def _process_chunk_in_worker(chunk_data):
+    return process_single_pacientes_chunk(chunk_data, _worker_context)
+
+def _transform_chunks_parallel(chunks: Iterator, context: PacientesTransformContext, workers: int) -> Iterator:
+    """
+    Distribui os chunks entre processos e os devolve na ordem de entrada. No máximo
+    workers * IN_FLIGHT_PER_WORKER chunks ficam em voo; o próximo só é lido do gerador
+    de entrada quando o mais antigo é entregue.
+
+    Os workers vêm de um forkserver, e não de fork: no modo em estágios o pool nasce na thread
+    de transformação enquanto a de leitura está ativa, e um fork copiaria travas presas por ela.
+    """
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+    pending = deque()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'),
+                               initializer=_init_transform_worker, initargs=(context,))
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(_process_chunk_in_worker, chunk))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Se o consumidor parar antes do fim, descarta o trabalho ainda não iniciado
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def transform_pacientes(data_input, context: PacientesTransformContext, workers: int = 1) -> Iterator:
+    """Gerador de chunks de pacientes transformados, na ordem de entrada (serial ou em processos)."""
+    if data_input is None or isinstance(data_input, str): return
+    data_iterator = [data_input] if isinstance(data_input, pd.DataFrame) else data_input
+    engine = context.allocation_engine
+    if workers > 1 and engine is not None and engine.capacity is not None:
+        # Os contadores de leitos precisam ser únicos para a execução inteira: cada worker teria sua cópia
+        logging.warning("Alocação com capacidade exige um único estado de leitos. Transformando pacientes em modo serial.")
+        workers = 1
+    if workers > 1:
+        logging.info(f"Transformando chunks de pacientes em {workers} processos.")
+        results = _transform_chunks_parallel(data_iterator, context, workers)
+    else:
+        results = (process_single_pacientes_chunk(chunk, context) for chunk in data_iterator)
+    for result in results:
+        # Um resultado por chunk da fonte (vazio se falhou): o checkpoint da carga conta posições
+        yield result if result is not None else pd.DataFrame()
+    if engine is not None and engine.capacity is not None:
+        report = engine.capacity_report()
+        logging.info(f"Alocação com capacidade: {report['leitos_ocupados']} leitos ocupados, {report['hospitais_lotados']} hospitais lotados, "
+                     f"{report['realocados_por_lotacao']} pacientes realocados por lotação, {report['sem_leito']} pacientes excedentes sem leito.")
 
 # --- FUNÇÃO PRINCIPAL DE TRANSFORMAÇÃO ---
 def run(dataframes: Dict[str, pd.DataFrame | Iterator]) -> Dict[str, pd.DataFrame | Iterator]:
@@ -197,6 +333,8 @@ def run(dataframes: Dict[str, pd.DataFrame | Iterator]) -> Dict[str, pd.DataFram
     if df_cid10 is not None and not df_cid10.empty and 'codigo' in df_cid10.columns:
         valid_cid_codes = set(df_cid10['codigo'].dropna().astype(str))
         logging.info(f"Encontrados {len(valid_cid_codes)} códigos CID-10 válidos para validação.")
+    # Tabela CID -> especialidade montada uma vez (ou lida do cache) e usada por coluna inteira
+    tabela_cid = get_tabela_cid(valid_cid_codes)
 
     if df_hospitais is not None and not df_hospitais.empty and df_municipios is not None:
         if 'cidade' in df_hospitais.columns: df_hospitais.rename(columns={'cidade': 'municipio_id'}, inplace=True)
@@ -210,54 +348,25 @@ def run(dataframes: Dict[str, pd.DataFrame | Iterator]) -> Dict[str, pd.DataFram
         df_hospitais['localizacao'] = df_hospitais.apply(create_point_string, axis=1)
         dataframes['hospitais'] = df_hospitais[['codigo', 'nome', 'municipio_id', 'especialidades', 'leitos_totais', 'localizacao']]
 
-    all_hospitals_with_coords, general_hospitals_ids = [], []
-    if df_hospitais is not None and not df_hospitais.empty:
-        all_hospitals_with_coords = df_hospitais.to_dict('records')
-        general_hospitals_ids = [h['codigo'] for h in all_hospitals_with_coords if 'clinica geral' in [normalizar_especialidade(s) for s in h.get('especialidades', [])]]
-        logging.info(f"Pré-processados {len(all_hospitals_with_coords)} hospitais ({len(general_hospitals_ids)} gerais) para alocação.")
+    allocation_engine = None
+    if get_allocation_engine() == 'postgis':
+        logging.info("ALLOCATION_ENGINE=postgis: a alocação de pacientes será feita no banco durante a carga.")
+        if get_allocation_mode() == 'capacity':
+            logging.warning("ALLOCATION_MODE=capacity não é suportado com ALLOCATION_ENGINE=postgis: "
+                            "os pacientes serão alocados sem limite de leitos (modo 'nearest').")
+    elif df_hospitais is not None and not df_hospitais.empty:
+        hospital_records = df_hospitais.to_dict('records')
+        capacity = None
+        if get_allocation_mode() == 'capacity':
+            capacity = BedCapacity([h.get('leitos_totais') for h in hospital_records])
+            logging.info(f"Alocação com restrição de leitos: {int(capacity.total.sum())} leitos em {len(capacity)} hospitais.")
+        allocation_engine = HospitalAllocationEngine(hospital_records, MunicipioLookup(df_municipios), capacity)
+        logging.info(f"Pré-processados {len(allocation_engine)} hospitais ({len(allocation_engine.general_hospitals_ids)} gerais) para alocação.")
 
-    def process_single_pacientes_chunk(chunk_data):
-        if not isinstance(chunk_data, pd.DataFrame) or chunk_data.empty: return pd.DataFrame()
-        try:
-            processed_chunk = chunk_data.copy()
-            processed_chunk = ensure_columns_exist(processed_chunk, ['codigo', 'cpf', 'nome_completo', 'genero', 'cod_municipio', 'bairro', 'convenio', 'cid_10'])
-            if 'cid-10' in processed_chunk.columns: processed_chunk.rename(columns={'cid-10': 'cid_10'}, inplace=True)
-            original_count = len(processed_chunk)
-            processed_chunk.dropna(subset=['cpf'], inplace=True)
-            if len(processed_chunk) < original_count:
-                logging.warning(f"Removidos {original_count - len(processed_chunk)} pacientes por terem CPF nulo.")
-            if processed_chunk.empty: return pd.DataFrame()
-            processed_chunk['codigo'] = processed_chunk['codigo'].apply(ensure_uuid)
-            processed_chunk['nome_completo'] = processed_chunk['nome_completo'].apply(clean_nome_fhir)
-            processed_chunk['genero'] = processed_chunk['genero'].apply(normalize_gender)
-            processed_chunk['convenio'] = processed_chunk['convenio'].apply(lambda x: str(x).upper() == 'SIM')
-            processed_chunk['cod_municipio'] = pd.to_numeric(processed_chunk['cod_municipio'], errors='coerce').astype('Int64')
-            processed_chunk.loc[~processed_chunk['cod_municipio'].isin(valid_municipio_ids), 'cod_municipio'] = pd.NA
-            if 'cid_10' in processed_chunk.columns:
-                processed_chunk['cid_10'] = processed_chunk['cid_10'].astype(str)
-                processed_chunk.loc[~processed_chunk['cid_10'].isin(valid_cid_codes), 'cid_10'] = None
-            successful_allocations = 0
-            for idx, patient_row in processed_chunk.iterrows():
-                allocated_hospital = allocate_hospital_intelligent(patient_row.to_dict(), all_hospitals_with_coords, df_municipios, general_hospitals_ids)
-                processed_chunk.loc[idx, 'hospital_alocado_id'] = allocated_hospital
-                if allocated_hospital: successful_allocations += 1
-            total_patients = len(processed_chunk)
-            allocation_rate = (successful_allocations / total_patients * 100) if total_patients > 0 else 0
-            logging.info(f"Chunk processado: {total_patients} pacientes, {successful_allocations} alocados ({allocation_rate:.1f}%)")
-            return processed_chunk[['codigo', 'cpf', 'nome_completo', 'genero', 'cod_municipio', 'bairro', 'convenio', 'cid_10', 'hospital_alocado_id']]
-        except Exception as e:
-            logging.error(f"Erro ao processar chunk de pacientes: {e}")
-            return None
-
-    def safe_transform_pacientes(data_input):
-        if data_input is None or isinstance(data_input, str): return iter([])
-        data_iterator = [data_input] if isinstance(data_input, pd.DataFrame) else data_input
-        for chunk in data_iterator:
-            result = process_single_pacientes_chunk(chunk)
-            if result is not None: yield result
+    pacientes_context = PacientesTransformContext(valid_municipio_ids, valid_cid_codes, allocation_engine, tabela_cid)
 
     df_medicos = dataframes.get('medicos')
-    if df_cid10 is not None and not df_cid10.empty: df_cid10['especialidade'] = df_cid10['codigo'].astype(str).apply(get_especialidade_from_cid)
+    if df_cid10 is not None and not df_cid10.empty: df_cid10['especialidade'] = tabela_cid.especialidades(df_cid10['codigo'].astype(str))
     if df_estados is not None: dataframes['estados'] = df_estados[['codigo_uf', 'uf', 'nome']]
     if df_medicos is not None and not df_medicos.empty:
         if 'cidade' in df_medicos.columns: df_medicos.rename(columns={'cidade': 'municipio_id'}, inplace=True)
@@ -271,6 +380,6 @@ def run(dataframes: Dict[str, pd.DataFrame | Iterator]) -> Dict[str, pd.DataFram
         dataframes['medicos'] = df_medicos[['codigo', 'nome_completo', 'especialidade', 'municipio_id']]
     if df_municipios is not None: dataframes['municipios'] = df_municipios[['codigo_ibge', 'nome', 'codigo_uf', 'localizacao']]
     if 'pacientes' in dataframes:
-        dataframes['pacientes'] = safe_transform_pacientes(dataframes.get('pacientes'))
+        dataframes['pacientes'] = transform_pacientes(dataframes.get('pacientes'), pacientes_context, get_transform_workers())
     logging.info("Etapa de transformação concluída.")
     return dataframes
\ No newline at end of file
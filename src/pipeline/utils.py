@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calcula a distância em km entre dois pontos geográficos."""
@@ -13,4 +14,22 @@ def haversine_distance(lat1, lon1, lat2, lon2):
          math.sin(dLon / 2) * math.sin(dLon / 2))
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     distance = R * c
-    return distance
\ No newline at end of file
+    return distance
+
+def haversine_vectorized(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Versão NumPy da haversine_distance. Aceita escalares ou arrays (com broadcasting,
+    ex.: lat1[:, None] contra lat2[None, :] gera uma matriz de distâncias).
+    Coordenadas nulas (NaN) resultam em distância infinita.
+    """
+    lat1, lon1 = np.asarray(lat1, dtype=float), np.asarray(lon1, dtype=float)
+    lat2, lon2 = np.asarray(lat2, dtype=float), np.asarray(lon2, dtype=float)
+
+    R = 6371  # Raio da Terra em km
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    a = (np.sin(dLat / 2) ** 2 +
+         np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon / 2) ** 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    distance = R * c
+    return np.where(np.isnan(distance), np.inf, distance)